@@ -43,6 +43,14 @@ function getImageUrl(imagePath) {
   return '/media/' + (imagePath.startsWith('/') ? imagePath.substring(1) : imagePath);
 }
 
+// Resized WebP/JPEG renditions from the API (`image_renditions`), falling back to the original upload
+function responsiveImage(imagePath, renditions, attrs, sizes) {
+  if (!renditions) return `<img src="${getImageUrl(imagePath)}" ${attrs}>`;
+  sizes = sizes || '(max-width: 576px) 100vw, 400px';
+  const webp = renditions.srcset.webp ? `<source type="image/webp" srcset="${renditions.srcset.webp}" sizes="${sizes}">` : '';
+  return `<picture style="display: contents;">${webp}<img src="${renditions.src}" srcset="${renditions.srcset.jpeg}" sizes="${sizes}" width="${renditions.width}" height="${renditions.height}" ${attrs}></picture>`;
+}
+
 function showAlert(elementId, message, duration) {
   const el = document.getElementById(elementId);
   if (!el) return;
@@ -73,10 +81,30 @@ async function fetchServices() {
   }
 }
 
-async function fetchProducts() {
+// List endpoints are cursor-paginated: { next, previous, results }
+async function fetchPage(url) {
+  try {
+    const response = await fetch(url);
+    if (!response.ok) throw new Error('Failed to fetch ' + url);
+    const data = await response.json();
+    // Keep the next link relative so it follows the page's scheme behind the proxy
+    const next = data.next ? new URL(data.next) : null;
+    return { results: data.results, next: next ? next.pathname + next.search : null };
+  } catch (error) {
+    console.warn('API error:', error.message);
+    return null;
+  }
+}
+
+function fetchProducts(params = {}) {
+  return fetchPage(`${API_BASE_URL}/products/?${new URLSearchParams(params)}`);
+}
+
+async function searchProducts(query) {
   try {
-    const response = await fetch(`${API_BASE_URL}/products/`);
-    if (!response.ok) throw new Error('Failed to fetch products');
+    const params = new URLSearchParams({ q: query, limit: 50, ...productFilterParams() });
+    const response = await fetch(`${API_BASE_URL}/products/?${params}`);
+    if (!response.ok) throw new Error('Failed to search products');
     return await response.json();
   } catch (error) {
     console.warn('API error:', error.message);
@@ -97,12 +125,31 @@ async function createBooking(bookingData) {
   return await response.json();
 }
 
-async function createOrder(orderData) {
-  const response = await fetch(`${API_BASE_URL}/orders/create/`, {
-    method: 'POST',
-    headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify(orderData)
-  });
+// POST with an Idempotency-Key, resending on network errors: the server runs the
+// request once and answers retries with the stored response
+function newIdempotencyKey() {
+  return window.crypto && crypto.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+}
+
+async function postIdempotent(url, data, idempotencyKey, attempts = 3) {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKey },
+        body: JSON.stringify(data)
+      });
+      // 409: the first attempt is still being processed
+      if (response.status !== 409 || attempt >= attempts) return response;
+    } catch (e) {
+      if (attempt >= attempts) throw e;
+    }
+    await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+  }
+}
+
+async function createOrder(orderData, idempotencyKey) {
+  const response = await postIdempotent(`${API_BASE_URL}/orders/create/`, orderData, idempotencyKey);
   if (!response.ok) {
     const errorData = await response.json();
     throw new Error(errorData.error || 'Failed to create order');
@@ -241,7 +288,9 @@ const CartManager = {
 
 // ---- Render Functions ----
 // Cache for fetched data
+const PRODUCTS_PAGE_SIZE = 60;
 let allProducts = [];
+let productsNextUrl = null;
 let allServices = [];
 
 // ---- Global Helper for Slides/BeforeAfter ----
@@ -268,18 +317,17 @@ function generateImageSliderHTML(item, type) {
   if (images.length > 0) {
     allImages = images;
   } else if (item.image) {
-    allImages = [{ image: item.image, image_type: 'general' }];
+    allImages = [{ image: item.image, image_renditions: item.image_renditions, image_type: 'general' }];
   } else {
     allImages = [{ image: 'https://via.placeholder.com/400x250?text=' + (type === 'service' ? 'Service' : 'Product'), image_type: 'general' }];
   }
 
   if (allImages.length === 1) {
-    const imgUrl = getImageUrl(allImages[0].image);
     let badgeHtml = '';
     if (!!allImages[0].image_type && ['before', 'after'].includes(allImages[0].image_type.toLowerCase())) {
          badgeHtml = `<span class="badge bg-warning text-dark position-absolute m-2" style="top:0; left:0; z-index:5; font-size: 0.8rem; font-weight: bold; text-transform: uppercase;">${allImages[0].image_type}</span>`;
     }
-    return `<div style="position:relative;">${badgeHtml}<img src="${imgUrl}" class="card-img-top" alt="${item.name}" onerror="this.src='https://via.placeholder.com/400x250?text=${type}'"></div>`;
+    return `<div style="position:relative;">${badgeHtml}${responsiveImage(allImages[0].image, allImages[0].image_renditions, `class="card-img-top" alt="${item.name}" loading="lazy" onerror="this.src='https://via.placeholder.com/400x250?text=${type}'"`)}</div>`;
   }
 
   const carouselId = `carousel-${type}-${item.id}`;
@@ -292,7 +340,7 @@ function generateImageSliderHTML(item, type) {
     return `
       <div class="carousel-item ${index === 0 ? 'active' : ''}">
         ${badgeHtml}
-        <img src="${getImageUrl(img.image)}" class="d-block w-100 card-img-top" alt="${item.name}" style="height: 220px; object-fit: cover;" onerror="this.src='https://via.placeholder.com/400x250?text=${type}'">
+        ${responsiveImage(img.image, img.image_renditions, `class="d-block w-100 card-img-top" alt="${item.name}" style="height: 220px; object-fit: cover;" loading="lazy" onerror="this.src='https://via.placeholder.com/400x250?text=${type}'"`)}
       </div>
     `;
   }).join('');
@@ -409,9 +457,9 @@ function renderProductCard(product, isPreview) {
 
 async function fetchGallery() {
   try {
-    const response = await fetch(`${API_BASE_URL}/gallery/`, { signal: AbortSignal.timeout(5000) });
+    const response = await fetch(`${API_BASE_URL}/gallery/?page_size=${GALLERY_FETCH_SIZE}`, { signal: AbortSignal.timeout(5000) });
     if (!response.ok) throw new Error('Failed to fetch gallery');
-    return await response.json();
+    return (await response.json()).results;
   } catch (error) {
     console.warn('Error fetching gallery:', error);
     return null;
@@ -419,6 +467,7 @@ async function fetchGallery() {
 }
 
 // Gallery state for "See More" pagination on about page
+const GALLERY_FETCH_SIZE = 200;
 let allGalleryItems = [];
 let galleryShowCount = 0;
 const GALLERY_PAGE_SIZE = 8;
@@ -427,7 +476,7 @@ function renderGalleryItem(item) {
   return `
     <div class="col-6 col-md-4 col-lg-3">
       <div class="gallery-preview-item">
-        <img src="${getImageUrl(item.image)}" alt="${item.title || 'Gallery Item'}" loading="lazy" onerror="this.src='https://via.placeholder.com/400x300?text=Work'">
+        ${responsiveImage(item.image, item.image_renditions, `alt="${item.title || 'Gallery Item'}" loading="lazy" onerror="this.src='https://via.placeholder.com/400x300?text=Work'"`, '(max-width: 768px) 50vw, 25vw')}
         <div class="gallery-overlay"><span>${item.category || item.title || 'Our Work'}</span></div>
       </div>
     </div>
@@ -529,7 +578,9 @@ document.addEventListener('DOMContentLoaded', async () => {
   const noProducts = document.getElementById('noProductsFound');
 
   if (productsContainer || productsPreview) {
-    const products = await fetchProducts();
+    const page = await fetchProducts({ page_size: PRODUCTS_PAGE_SIZE });
+    const products = page ? page.results : null;
+    productsNextUrl = page ? page.next : null;
 
     // Hide spinner by clearing container
     if (productsContainer) productsContainer.innerHTML = '';
@@ -552,8 +603,10 @@ document.addEventListener('DOMContentLoaded', async () => {
     // Wire up search and filter
     const searchInput = document.getElementById('productSearch');
     const filterSelect = document.getElementById('productFilter');
-    if (searchInput) searchInput.addEventListener('input', filterAndRenderProducts);
-    if (filterSelect) filterSelect.addEventListener('change', filterAndRenderProducts);
+    if (searchInput) searchInput.addEventListener('input', onProductSearchInput);
+    if (filterSelect) filterSelect.addEventListener('change', onProductFilterChange);
+    const loadMoreBtn = document.getElementById('loadMoreProducts');
+    if (loadMoreBtn) loadMoreBtn.addEventListener('click', loadMoreProducts);
 
     // Auto-open product detail if param is present
     if (urlParams.get('product') && document.getElementById('productDetailModal')) {
@@ -663,36 +716,66 @@ document.addEventListener('DOMContentLoaded', async () => {
 });
 
 // ---- Product Search & Filter ----
+// Products returned by the server for the current search term (null when not searching)
+let searchResults = null;
+let searchTimer = null;
+
+function onProductSearchInput() {
+  clearTimeout(searchTimer);
+  searchTimer = setTimeout(async () => {
+    const searchTerm = (document.getElementById('productSearch')?.value || '').trim();
+    if (!searchTerm) {
+      searchResults = null;
+      filterAndRenderProducts();
+      return;
+    }
+
+    const data = await searchProducts(searchTerm);
+    // Ignore responses for a term the user has already changed
+    if (searchTerm !== (document.getElementById('productSearch')?.value || '').trim()) return;
+
+    searchResults = data ? data.results : [];
+    filterAndRenderProducts();
+  }, 250);
+}
+
+// Category / stock filters run on the server
+function productFilterParams() {
+  const filterValue = document.getElementById('productFilter')?.value || 'all';
+  if (filterValue === 'in-stock') return { is_available: 'true' };
+  if (filterValue !== 'all') return { category: filterValue };
+  return {};
+}
+
+async function onProductFilterChange() {
+  if (searchResults !== null) {
+    onProductSearchInput();
+    return;
+  }
+  const page = await fetchProducts({ ...productFilterParams(), page_size: PRODUCTS_PAGE_SIZE });
+  allProducts = page ? page.results : [];
+  productsNextUrl = page ? page.next : null;
+  filterAndRenderProducts();
+}
+
+async function loadMoreProducts() {
+  if (!productsNextUrl) return;
+  const page = await fetchPage(productsNextUrl);
+  if (!page) return;
+  allProducts = allProducts.concat(page.results);
+  productsNextUrl = page.next;
+  filterAndRenderProducts();
+}
+
 function filterAndRenderProducts() {
   const container = document.getElementById('productsContainer');
   const noProducts = document.getElementById('noProductsFound');
   if (!container) return;
 
-  const searchTerm = (document.getElementById('productSearch')?.value || '').toLowerCase().trim();
-  const filterValue = document.getElementById('productFilter')?.value || 'all';
+  const filtered = searchResults !== null ? searchResults : allProducts;
 
-  let filtered = allProducts;
-
-  // Category filter
-  if (filterValue === 'in-stock') {
-    filtered = filtered.filter(p => p.is_available && p.stock_quantity > 0);
-  } else if (filterValue !== 'all') {
-    // Normalizing DB values logic since backend might be returning numbers as strings.
-    let catFilter = filterValue;
-    if (filterValue === 'Spare parts') catFilter = '1';
-    else if (filterValue === 'Electrical') catFilter = '2';
-    else if (filterValue === 'Service parts') catFilter = '3';
-    else if (filterValue === 'Lubricants') catFilter = '4';
-    filtered = filtered.filter(p => p.category === filterValue || p.category === catFilter);
-  }
-
-  // Text search (name + description)
-  if (searchTerm) {
-    filtered = filtered.filter(p =>
-      (p.name || '').toLowerCase().includes(searchTerm) ||
-      (p.description || '').toLowerCase().includes(searchTerm)
-    );
-  }
+  const loadMoreBtn = document.getElementById('loadMoreProducts');
+  if (loadMoreBtn) loadMoreBtn.classList.toggle('d-none', !productsNextUrl || searchResults !== null);
 
   if (filtered.length > 0) {
     // Group products by their normalized category string
@@ -730,7 +813,7 @@ function filterAndRenderProducts() {
 
 // ---- Product Detail Modal ----
 window.openProductDetail = function(productId) {
-  const product = allProducts.find(p => p.id === productId);
+  const product = allProducts.find(p => p.id === productId) || (searchResults || []).find(p => p.id === productId);
   if (!product) return;
 
   let modalEl = document.getElementById('productDetailModal');
@@ -926,39 +1009,41 @@ document.addEventListener('click', async function (e) {
     };
 
     try {
-      const order = await createOrder(orderData);
+      const checkoutKey = newIdempotencyKey();
+      const order = await createOrder(orderData, checkoutKey);
       if (selectedPaymentMethod === 'online') {
         const stkPrompt = document.getElementById('stkPrompt');
         if (stkPrompt) stkPrompt.classList.remove('d-none');
 
         // Initiate STK Push
-        await fetch(`${API_BASE_URL}/payment/mpesa/initiate/${order.order_id}/`, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ phone_number: orderData.phone_number })
-        });
+        await postIdempotent(
+          `${API_BASE_URL}/payment/mpesa/initiate/${order.order_id}/`,
+          { phone_number: orderData.phone_number },
+          checkoutKey
+        );
 
         showAlert('orderSuccess', 'STK Push sent! Please enter your PIN on your phone (waiting up to 90s)...', 10000);
 
-        // Polling logic: check order status every 5 seconds for a max of 90 seconds (18 attempts)
+        // Long-poll the payment status: the server answers as soon as the M-Pesa callback
+        // marks the order paid or failed (each request waits up to 25s), for a max of 90 seconds
         let isPaid = false;
-        let attempts = 0;
-        const maxAttempts = 18;
-
-        while (attempts < maxAttempts && !isPaid) {
-          await new Promise(resolve => setTimeout(resolve, 5000)); // wait 5 seconds
-          attempts++;
+        let orderStatus = 'pending';
+        const deadline = Date.now() + 90000;
 
+        while (Date.now() < deadline && !isPaid && orderStatus !== 'failed') {
+          const wait = Math.min(25, Math.ceil((deadline - Date.now()) / 1000));
           try {
-            const checkRes = await fetch(`${API_BASE_URL}/orders/${order.order_id}/`);
+            const checkRes = await fetch(`${API_BASE_URL}/orders/${order.order_id}/payment-status/?since=${orderStatus}&wait=${wait}`);
             if (checkRes.ok) {
               const checkData = await checkRes.json();
-              if (checkData.is_paid) {
-                isPaid = true;
-              }
+              isPaid = checkData.is_paid;
+              orderStatus = checkData.status;
+            } else {
+              await new Promise(resolve => setTimeout(resolve, 5000));
             }
           } catch (e) {
-            console.warn('Order poll error:', e);
+            console.warn('Payment status error:', e);
+            await new Promise(resolve => setTimeout(resolve, 5000));
           }
         }
 
@@ -967,6 +1052,8 @@ document.addEventListener('click', async function (e) {
         if (isPaid) {
           showAlert('orderSuccess', 'Payment Successful!', 8000);
           order.is_paid = true; // inject for receipt generation
+        } else if (orderStatus === 'failed') {
+          showAlert('orderError', 'The M-Pesa payment was not completed. Please try again.', 8000);
         } else {
           showAlert('orderError', 'Payment confirmation timed out. If you paid, it will reflect shortly.', 8000);
         }
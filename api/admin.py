@@ -1,13 +1,25 @@
 from django.contrib import admin
-from .models import Services, Product, Order, Booking, Category, OrderItem, Gallery, ContactMessage, ProductImage, Offer, ServiceImage
+from .models import Services, Product, Order, Booking, Category, OrderItem, Gallery, ContactMessage, ProductImage, Offer, ServiceImage, StockReservation, OutboxEmail, OrderStatusHistory, MpesaCallback
+from .mpesa_inbox import replay
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
 
+class OrderStatusHistoryInline(admin.TabularInline):
+    model = OrderStatusHistory
+    extra = 0
+    can_delete = False
+    readonly_fields = ('from_status', 'to_status', 'changed_at', 'changed_by', 'note')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('id', 'full_name', 'total_price', 'created_at', 'is_paid', 'is_delivered')
-    inlines = [OrderItemInline]
+    list_display = ('id', 'full_name', 'total_price', 'created_at', 'status', 'paid_at')
+    list_filter = ('status',)
+    readonly_fields = ('status', 'paid_at')
+    inlines = [OrderItemInline, OrderStatusHistoryInline]
 
 class GalleryAdmin(admin.ModelAdmin):
     list_display = ('id', 'title', 'category', 'created_at')
@@ -20,7 +32,7 @@ class ServiceImageInline(admin.TabularInline):
     extra = 0
 
 class ServicesAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'created_at')
+    list_display = ('name', 'price', 'duration_minutes', 'bays', 'technicians', 'created_at')
     inlines = [ServiceImageInline]
     search_fields = ('name',)
 
@@ -61,3 +73,28 @@ class OfferAdmin(admin.ModelAdmin):
     search_fields = ('name',)
 
 admin.site.register(Offer, OfferAdmin)
+
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'order', 'product', 'quantity', 'expires_at')
+    list_filter = ('expires_at',)
+
+admin.site.register(StockReservation, StockReservationAdmin)
+
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'to_email', 'subject', 'status', 'attempts', 'created_at', 'sent_at', 'send_duration_ms')
+    list_filter = ('status',)
+    search_fields = ('to_email', 'subject')
+
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
+
+class MpesaCallbackAdmin(admin.ModelAdmin):
+    list_display = ('id', 'checkout_request_id', 'status', 'attempts', 'outcome', 'received_at', 'processed_at')
+    list_filter = ('status',)
+    search_fields = ('checkout_request_id',)
+    actions = ['replay_callbacks']
+
+    @admin.action(description="Replay selected callbacks")
+    def replay_callbacks(self, request, queryset):
+        self.message_user(request, f"Queued {replay(queryset)} callbacks for the worker.")
+
+admin.site.register(MpesaCallback, MpesaCallbackAdmin)
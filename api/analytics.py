@@ -0,0 +1,139 @@
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.db.models import BooleanField, Count, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from .models import Booking, BookingDailyStat, Order, OrderDailyStat
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fields whose change moves a row between daily stats; saves limited to other fields skip the refresh
+BOOKING_FIELDS = {'services', 'services_id', 'status', 'total_price', 'created_at'}
+ORDER_FIELDS = {'paid_at', 'total_price', 'created_at'}
+
+PERIODS = {
+    'day': F('date'),
+    'week': TruncWeek('date'),
+    'month': TruncMonth('date'),
+}
+
+
+def day_of(moment):
+    """ The local date a row was created on, as TruncDate groups it """
+    return timezone.localtime(moment).date()
+
+
+def created_between(queryset, start, end):
+    """ Rows of `queryset` created from the start of local day `start` to the end of `end` """
+    tz = timezone.get_current_timezone()
+    return queryset.filter(
+        created_at__gte=timezone.make_aware(datetime.combine(start, time.min), tz),
+        created_at__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz),
+    )
+
+
+def rollup_bookings(start, end):
+    """ Recompute the booking stats of the days from `start` to `end` with one grouped query """
+    rows = created_between(Booking.objects.all(), start, end).annotate(day=TruncDate('created_at')).values(
+        'day', 'services', 'status',
+    ).annotate(count=Count('id'), revenue=Sum('total_price')).order_by()
+    stats = [
+        BookingDailyStat(date=row['day'], services_id=row['services'], status=row['status'], count=row['count'],
+                         revenue=row['revenue'] or 0)
+        for row in rows
+    ]
+    with transaction.atomic():
+        BookingDailyStat.objects.filter(date__range=(start, end)).delete()
+        BookingDailyStat.objects.bulk_create(stats, batch_size=500)
+    return len(stats)
+
+
+def rollup_orders(start, end):
+    """ Recompute the order stats of the days from `start` to `end` with one grouped query """
+    rows = created_between(Order.objects.all(), start, end).annotate(
+        day=TruncDate('created_at'),
+        paid=ExpressionWrapper(Q(paid_at__isnull=False), output_field=BooleanField()),
+    ).values('day', 'paid').annotate(count=Count('id'), revenue=Sum('total_price')).order_by()
+    stats = [
+        OrderDailyStat(date=row['day'], paid=row['paid'], count=row['count'], revenue=row['revenue'] or 0)
+        for row in rows
+    ]
+    with transaction.atomic():
+        OrderDailyStat.objects.filter(date__range=(start, end)).delete()
+        OrderDailyStat.objects.bulk_create(stats, batch_size=500)
+    return len(stats)
+
+
+def refresh_day(rollup, day):
+    """
+    Bring one day's stats up to date once the write that changed it commits. A failure
+    only leaves that day stale until the nightly backfill, so it is logged, not raised.
+    """
+    def refresh():
+        try:
+            rollup(day, day)
+        except Exception as e:
+            logger.error(f"Failed to refresh {rollup.__name__} for {day}: {e}")
+
+    transaction.on_commit(refresh)
+
+
+def changes(fields, update_fields):
+    return update_fields is None or bool(fields & set(update_fields))
+
+
+def booking_changed(booking, update_fields=None):
+    if booking.created_at and changes(BOOKING_FIELDS, update_fields):
+        refresh_day(rollup_bookings, day_of(booking.created_at))
+
+
+def order_changed(order, update_fields=None):
+    if order.created_at and changes(ORDER_FIELDS, update_fields):
+        refresh_day(rollup_orders, day_of(order.created_at))
+
+
+def report_range(params):
+    """
+    (start, end) from ?start=YYYY-MM-DD&end=YYYY-MM-DD, either of them None when not
+    given. Raises ValueError on a malformed date or an end before the start.
+    """
+    start, end = (parse_date(params[name]) if params.get(name) else None for name in ('start', 'end'))
+    if (params.get('start') and start is None) or (params.get('end') and end is None):
+        raise ValueError("Dates must be YYYY-MM-DD")
+    if start and end and end < start:
+        raise ValueError("end is before start")
+    return start, end
+
+
+def in_range(queryset, start, end):
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        queryset = queryset.filter(date__lte=end)
+    return queryset
+
+
+def bookings_per(period, start=None, end=None):
+    """ [{period: date, 'count': n}] of bookings created per day, week or month """
+    return list(in_range(BookingDailyStat.objects.all(), start, end).annotate(**{period: PERIODS[period]}).values(
+        period,
+    ).annotate(count=Sum('count')).order_by(period))
+
+
+def bookings_by_status(start=None, end=None):
+    """ {status: (count, revenue)} of bookings created in the range """
+    rows = in_range(BookingDailyStat.objects.all(), start, end).values('status').annotate(
+        count=Sum('count'), revenue=Sum('revenue'),
+    ).order_by()
+    return {row['status']: (row['count'], row['revenue']) for row in rows}
+
+
+def orders_by_paid(start=None, end=None):
+    """ {paid: (count, revenue)} of orders created in the range """
+    rows = in_range(OrderDailyStat.objects.all(), start, end).values('paid').annotate(
+        count=Sum('count'), revenue=Sum('revenue'),
+    ).order_by()
+    return {row['paid']: (row['count'], row['revenue']) for row in rows}
@@ -0,0 +1,224 @@
+import uuid
+from datetime import time, timedelta
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from django.utils import timezone
+from .models import Booking, BookingSlot
+
+AVAILABLE_TIME_SLOTS = [
+    "09:00",
+    "10:00",
+    "11:00",
+    "12:00",
+    "14:00",
+    "15:00",
+    "16:00",
+    "17:00",
+    "18:00",
+    "19:00",
+    "20:00",
+]
+
+# Jobs must be finished by closing time
+CLOSING_TIME = "21:00"
+
+MINUTES_PER_DAY = 24 * 60
+
+# Bookings in these statuses hold their slot
+ACTIVE_STATUSES = ('pending', 'confirmed')
+
+MAX_RANGE_DAYS = 31
+
+DAY_TIMEOUT = 60 * 60 * 24
+
+
+class SlotTaken(IntegrityError):
+    """ Every unit of the service is busy for part of the booking """
+
+
+def minutes(value):
+    """ Minutes since midnight of a time or "HH:MM" """
+    if isinstance(value, str):
+        hours, mins = value.split(':')
+        return int(hours) * 60 + int(mins)
+    return value.hour * 60 + value.minute
+
+
+class IntervalIndex:
+    """
+    How many bookings are running at each minute of a day: a segment tree with range add
+    and range max, so adding a booking and asking for the busiest minute of an interval
+    are both O(log n) in the minutes of the day.
+    """
+
+    def __init__(self, size=MINUTES_PER_DAY):
+        self.size = size
+        # peak[node]: busiest minute below node, counting the adds stored on node itself
+        self.peak = [0] * (4 * size)
+        self.added = [0] * (4 * size)
+
+    def add(self, start, end, count=1):
+        """ Count `count` more bookings over the minutes [start, end) """
+        self._add(1, 0, self.size, max(start, 0), min(end, self.size), count)
+
+    def max_load(self, start, end):
+        """ The most bookings running at any one minute of [start, end) """
+        return self._max(1, 0, self.size, max(start, 0), min(end, self.size))
+
+    def _add(self, node, lo, hi, start, end, count):
+        if end <= lo or hi <= start or start >= end:
+            return
+        if start <= lo and hi <= end:
+            self.added[node] += count
+            self.peak[node] += count
+            return
+        mid = (lo + hi) // 2
+        self._add(2 * node, lo, mid, start, end, count)
+        self._add(2 * node + 1, mid, hi, start, end, count)
+        self.peak[node] = self.added[node] + max(self.peak[2 * node], self.peak[2 * node + 1])
+
+    def _max(self, node, lo, hi, start, end):
+        if end <= lo or hi <= start or start >= end:
+            return 0
+        if start <= lo and hi <= end:
+            return self.peak[node]
+        mid = (lo + hi) // 2
+        return self.added[node] + max(self._max(2 * node, lo, mid, start, end),
+                                      self._max(2 * node + 1, mid, hi, start, end))
+
+
+def version_key(service_id):
+    return f'availability:version:{service_id}'
+
+
+def get_version(service_id):
+    key = version_key(service_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(service_id):
+    cache.delete(version_key(service_id))
+
+
+def invalidate_availability(service_id):
+    """ Like invalidate_catalog: drop the service's cached days now and once the write commits """
+    bump_version(service_id)
+    transaction.on_commit(lambda: bump_version(service_id))
+
+
+def day_indexes(service, start, end):
+    """
+    {date: IntervalIndex} of the active bookings of a service from `start` to `end`, from
+    one grouped query. Bookings from before durations were recorded take the service's
+    current duration.
+    """
+    bookings = Booking.objects.filter(
+        services=service, booking_date__range=(start, end), status__in=ACTIVE_STATUSES, booking_time__isnull=False,
+    )
+    rows = bookings.values('booking_date', 'booking_time', 'duration_minutes').annotate(count=Count('id')).order_by()
+    indexes = {}
+    for row in rows:
+        begin = minutes(row['booking_time'])
+        length = row['duration_minutes'] or service.duration_minutes
+        indexes.setdefault(row['booking_date'], IntervalIndex()).add(begin, begin + length, row['count'])
+    return indexes
+
+
+def fits(service, index, slot, duration=None):
+    """ Whether a booking starting at `slot` finishes by closing time with a unit free throughout """
+    begin = minutes(slot)
+    end = begin + (duration or service.duration_minutes)
+    if end > minutes(CLOSING_TIME):
+        return False
+    return index is None or index.max_load(begin, end) < service.capacity
+
+
+def slot_is_free(service, day, slot, duration=None):
+    return fits(service, day_indexes(service, day, day).get(day), slot, duration)
+
+
+def day_rows(service, start, end):
+    """
+    {date: "1101..."} for every day from `start` to `end`, one character per
+    AVAILABLE_TIME_SLOTS entry ('1' a booking can start then, '0' not). Days are cached
+    per service; the days missing from the cache are read with a single query.
+    """
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    version = get_version(service.id)
+    keys = {day: f'availability:{service.id}:{version}:{day.isoformat()}' for day in days}
+    cached = cache.get_many(keys.values())
+    rows = {day: cached[key] for day, key in keys.items() if key in cached}
+
+    missing = [day for day in days if day not in rows]
+    if missing:
+        indexes = day_indexes(service, missing[0], missing[-1])
+        computed = {
+            day: ''.join('1' if fits(service, indexes.get(day), slot) else '0' for slot in AVAILABLE_TIME_SLOTS)
+            for day in missing
+        }
+        cache.set_many({keys[day]: row for day, row in computed.items()}, timeout=DAY_TIMEOUT)
+        rows.update(computed)
+    return rows
+
+
+def availability_grid(service, start, end):
+    """
+    The slot grid for a service from `start` to `end` inclusive: the start times and one
+    row per day. Days before today have no free slots.
+    """
+    rows = day_rows(service, start, end)
+    today = timezone.localdate()
+    closed = '0' * len(AVAILABLE_TIME_SLOTS)
+    return {
+        'service_id': service.id,
+        'duration_minutes': service.duration_minutes,
+        'capacity': service.capacity,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'slots': AVAILABLE_TIME_SLOTS,
+        'days': {day.isoformat(): closed if day < today else row for day, row in sorted(rows.items())},
+    }
+
+
+def cells(booking, duration):
+    """ The hour cells ("HH:00" times) a booking's [start, start + duration) touches """
+    begin = minutes(booking.booking_time)
+    end = min(begin + duration, MINUTES_PER_DAY)
+    return [time(hour) for hour in range(begin // 60, (end + 59) // 60)]
+
+
+def sync_slot_claim(booking):
+    """
+    Make the booking's slot claims match the booking: an active booking with a date and
+    time holds one unit of every hour cell its duration touches, any other holds none.
+    Raises SlotTaken when a cell has no free unit, or IntegrityError when another booking
+    claims the same unit first; callers run this in a savepoint.
+    """
+    claims = BookingSlot.objects.filter(booking=booking)
+    if booking.status not in ACTIVE_STATUSES or booking.booking_date is None or booking.booking_time is None:
+        claims.delete()
+        return
+    service = booking.services
+    wanted = cells(booking, booking.duration_minutes or service.duration_minutes)
+    held = claims.filter(services=service, date=booking.booking_date).values_list('time', flat=True)
+    if sorted(held) == wanted:
+        return
+    claims.delete()
+
+    taken = {}
+    for cell, unit in BookingSlot.objects.filter(
+        services=service, date=booking.booking_date, time__in=wanted,
+    ).values_list('time', 'unit'):
+        taken.setdefault(cell, set()).add(unit)
+    slots = []
+    for cell in wanted:
+        unit = next((unit for unit in range(service.capacity) if unit not in taken.get(cell, ())), None)
+        if unit is None:
+            raise SlotTaken(f"No free unit of service {service.id} at {booking.booking_date} {cell}")
+        slots.append(BookingSlot(services=service, booking=booking, date=booking.booking_date, time=cell, unit=unit))
+    BookingSlot.objects.bulk_create(slots)
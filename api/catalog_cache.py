@@ -0,0 +1,91 @@
+import hashlib
+import uuid
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Min, Q
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+
+CATALOG_VERSION_KEY = 'catalog:version'
+SNAPSHOT_TIMEOUT = 60 * 60 * 24
+
+
+def next_offer_boundary(now):
+    """ When the next offer starts or ends; discounted prices in the snapshots change then. """
+    from .models import Offer
+    boundaries = Offer.objects.filter(is_active=True).aggregate(
+        next_start=Min('start_date', filter=Q(start_date__gt=now)),
+        next_end=Min('end_date', filter=Q(end_date__gt=now)),
+    )
+    upcoming = [value for value in boundaries.values() if value is not None]
+    return min(upcoming) if upcoming else None
+
+
+def get_catalog_version():
+    entry = cache.get(CATALOG_VERSION_KEY)
+    now = timezone.now()
+    if entry is None:
+        # First request after a bump: whichever worker gets here first picks the version
+        candidate = (uuid.uuid4().hex, next_offer_boundary(now))
+        cache.add(CATALOG_VERSION_KEY, candidate, timeout=None)
+        entry = cache.get(CATALOG_VERSION_KEY) or candidate
+    elif entry[1] is not None and entry[1] <= now:
+        # An offer started or ended since the version was picked
+        entry = (uuid.uuid4().hex, next_offer_boundary(now))
+        cache.set(CATALOG_VERSION_KEY, entry, timeout=None)
+    return entry[0]
+
+
+def bump_catalog_version():
+    # The next reader picks a fresh random token, so stale snapshots become unreachable
+    cache.delete(CATALOG_VERSION_KEY)
+
+
+def invalidate_catalog():
+    """
+    Bump the version now and again once the surrounding transaction commits, so a
+    snapshot rendered by another worker before the commit is never served afterwards.
+    """
+    bump_catalog_version()
+    transaction.on_commit(bump_catalog_version)
+
+
+class CatalogSnapshotMixin:
+    """
+    Serves public list responses from a pre-rendered JSON snapshot keyed by the catalog
+    version and absolute request URL (the body holds absolute image and page links, so
+    each scheme and host gets its own). Responses carry a strong ETag, so a client that
+    already has the current snapshot gets a 304 without touching the database.
+    """
+
+    def use_snapshot(self, request):
+        return request.accepted_renderer.format == 'json'
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_snapshot(request):
+            return super().list(request, *args, **kwargs)
+
+        version = get_catalog_version()
+        url = request.build_absolute_uri()
+        etag = '"%s"' % hashlib.sha256(f'{version}:{url}'.encode()).hexdigest()[:32]
+
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponse(status=304)
+        else:
+            snapshot_key = f'catalog:snapshot:{version}:{url}'
+            body = cache.get(snapshot_key)
+            if body is None:
+                rendered = super().list(request, *args, **kwargs)
+                body = JSONRenderer().render(rendered.data)
+                if rendered.status_code == 200:
+                    cache.set(snapshot_key, body, timeout=SNAPSHOT_TIMEOUT)
+                else:
+                    return rendered
+            response = HttpResponse(body, content_type='application/json')
+
+        response['ETag'] = etag
+        # Let browsers keep the body but revalidate with If-None-Match on every visit
+        response['Cache-Control'] = 'no-cache'
+        return response
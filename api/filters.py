@@ -0,0 +1,45 @@
+from datetime import date
+from rest_framework.exceptions import ValidationError
+
+
+def parse_bool(value):
+    value = value.strip().lower()
+    if value in ('true', '1', 'yes'):
+        return True
+    if value in ('false', '0', 'no'):
+        return False
+    raise ValueError(value)
+
+
+def parse_date(value):
+    return date.fromisoformat(value.strip())
+
+
+def parse_str(value):
+    return value.strip()
+
+
+class QueryParamFilterMixin:
+    """
+    Pushes simple ?param=value filters into the SQL query.
+    `filter_params` maps a query parameter to a (lookup, parser) pair. The lookup is
+    a field lookup string, or a callable turning the parsed value into a Q object.
+    """
+    filter_params = {}
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        filters, conditions = {}, []
+        for param, (lookup, parse) in self.filter_params.items():
+            value = self.request.query_params.get(param)
+            if value is None or value == '':
+                continue
+            try:
+                parsed = parse(value)
+            except ValueError:
+                raise ValidationError({param: f"Invalid value '{value}'"})
+            if callable(lookup):
+                conditions.append(lookup(parsed))
+            else:
+                filters[lookup] = parsed
+        return queryset.filter(*conditions, **filters)
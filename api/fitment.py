@@ -0,0 +1,182 @@
+import re
+from django.db.models import Q
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Canonical make for common spellings seen in `car_models`
+MAKE_ALIASES = {
+    'toyota': 'toyota',
+    'nissan': 'nissan',
+    'mazda': 'mazda',
+    'subaru': 'subaru',
+    'honda': 'honda',
+    'mitsubishi': 'mitsubishi',
+    'isuzu': 'isuzu',
+    'suzuki': 'suzuki',
+    'daihatsu': 'daihatsu',
+    'lexus': 'lexus',
+    'hyundai': 'hyundai',
+    'kia': 'kia',
+    'ford': 'ford',
+    'peugeot': 'peugeot',
+    'volvo': 'volvo',
+    'audi': 'audi',
+    'bmw': 'bmw',
+    'mercedes': 'mercedes-benz',
+    'mercedes-benz': 'mercedes-benz',
+    'benz': 'mercedes-benz',
+    'merc': 'mercedes-benz',
+    'volkswagen': 'volkswagen',
+    'vw': 'volkswagen',
+    'land rover': 'land rover',
+    'landrover': 'land rover',
+    'jeep': 'jeep',
+    'porsche': 'porsche',
+}
+
+YEAR_RANGE = re.compile(r'\b((?:19|20)\d{2})\s*(?:-|–|to)\s*((?:19|20)?\d{2})\b')
+YEAR_FROM = re.compile(r'\b((?:19|20)\d{2})\s*\+')
+YEAR = re.compile(r'\b((?:19|20)\d{2})\b')
+
+
+def normalize(value):
+    return ' '.join((value or '').lower().split())
+
+
+def normalize_make(value):
+    value = normalize(value)
+    return MAKE_ALIASES.get(value, value)
+
+
+def parse_years(text):
+    """ Returns (year_from, year_to, text without the years) """
+    match = YEAR_RANGE.search(text)
+    if match:
+        start, end = match.group(1), match.group(2)
+        if len(end) == 2:
+            end = start[:2] + end
+        return int(start), int(end), text[:match.start()] + text[match.end():]
+    match = YEAR_FROM.search(text)
+    if match:
+        return int(match.group(1)), None, text[:match.start()] + text[match.end():]
+    match = YEAR.search(text)
+    if match:
+        year = int(match.group(1))
+        return year, year, text[:match.start()] + text[match.end():]
+    return None, None, text
+
+
+def split_make(words):
+    for size in (2, 1):
+        candidate = ' '.join(words[:size])
+        if len(words) >= size and candidate in MAKE_ALIASES:
+            return MAKE_ALIASES[candidate], words[size:]
+    return None, words
+
+
+def parse_car_models(car_models):
+    """
+    Parse the free-text `car_models` field ("Toyota Fielder 2010-2015, Axio") into
+    (make, model, year_from, year_to) tuples. An entry without a make inherits the
+    make of the previous entry, so "Toyota Fielder, Axio" gives two Toyota rows.
+    """
+    entries = []
+    current_make = ''
+    for chunk in re.split(r'[,;/\n]+', car_models or ''):
+        year_from, year_to, rest = parse_years(normalize(chunk))
+        words = re.sub(r'[^\w\s-]', ' ', rest).split()
+        make, model_words = split_make(words)
+        if make:
+            current_make = make
+        model = ' '.join(model_words)
+        if not model and not make:
+            continue
+        entries.append((make or current_make, model, year_from, year_to))
+    return entries
+
+
+def index_image(image):
+    """ Replace the fitment rows derived from one product image """
+    from .models import ProductFitment
+    ProductFitment.objects.filter(image_id=image.pk).delete()
+    ProductFitment.objects.bulk_create([
+        ProductFitment(
+            product_id=image.product_id,
+            image_id=image.pk,
+            make=make,
+            model=model,
+            year_from=year_from,
+            year_to=year_to,
+        )
+        for make, model, year_from, year_to in parse_car_models(image.car_models)
+    ])
+
+
+def index_images(images):
+    """ index_image() for many images, in one delete and one insert """
+    from .models import ProductFitment
+    images = list(images)
+    ProductFitment.objects.filter(image_id__in=[image.pk for image in images]).delete()
+    ProductFitment.objects.bulk_create([
+        ProductFitment(
+            product_id=image.product_id,
+            image_id=image.pk,
+            make=make,
+            model=model,
+            year_from=year_from,
+            year_to=year_to,
+        )
+        for image in images
+        for make, model, year_from, year_to in parse_car_models(image.car_models)
+    ], batch_size=500)
+
+
+def rebuild_index():
+    from .models import ProductFitment, ProductImage
+    ProductFitment.objects.all().delete()
+    count = 0
+    for image in ProductImage.objects.exclude(car_models__isnull=True).exclude(car_models='').iterator():
+        index_image(image)
+        count += 1
+    logger.info(f"Fitment index rebuilt from {count} product images")
+    return count
+
+
+def normalize_vehicle(make, model):
+    """ Normalize a make/model pair the way the index stores it ("", "Toyota Fielder" -> "toyota", "fielder") """
+    make = normalize_make(make)
+    model_words = normalize(model).split()
+    found_make, rest = split_make(model_words)
+    if found_make and (not make or found_make == make):
+        make, model_words = found_make, rest
+    return make, ' '.join(model_words)
+
+
+def fitment_filter(make=None, model=None, year=None):
+    """ Q over ProductFitment for an indexed make/model lookup, optionally narrowed by year """
+    make, model = normalize_vehicle(make, model)
+    query = Q()
+    if make:
+        query &= Q(make=make)
+    if model:
+        query &= Q(model=model)
+    if year:
+        query &= (Q(year_from__isnull=True) | Q(year_from__lte=year))
+        query &= (Q(year_to__isnull=True) | Q(year_to__gte=year))
+    return query
+
+
+def products_fitting(queryset, make=None, model=None, year=None):
+    from .models import ProductFitment
+    product_ids = ProductFitment.objects.filter(
+        fitment_filter(make, model, year)
+    ).values('product_id')
+    return queryset.filter(pk__in=product_ids)
+
+
+def parse_year(value):
+    """ Lenient year parsing for query params and Order.vehicle_year ("2015", "2015 model") """
+    match = YEAR.search(str(value or ''))
+    return int(match.group(1)) if match else None
@@ -0,0 +1,128 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from .models import IdempotencyKey
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# A key still in progress after this long belongs to a request that died; a retry takes it over
+IN_PROGRESS_TIMEOUT = timedelta(minutes=2)
+
+# "Not now" answers: the retry they ask for has to run the view again
+RETRY_STATUSES = (status.HTTP_409_CONFLICT, status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+def request_hash(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f"{request.method} {request.path}\n{body}".encode()).hexdigest()
+
+
+def claim_key(scope, key, fingerprint, now):
+    """ Record (scope, key) as in progress and return None, or return the existing record """
+    IdempotencyKey.objects.filter(scope=scope, key=key).filter(
+        Q(expires_at__lte=now) | Q(response_status__isnull=True, created_at__lt=now - IN_PROGRESS_TIMEOUT)
+    ).delete()
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(
+                scope=scope,
+                key=key,
+                request_hash=fingerprint,
+                created_at=now,
+                expires_at=now + timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS),
+            )
+        return None
+    except IntegrityError:
+        # Taken by another request, or freed again in the meantime (then it counts as in progress)
+        return IdempotencyKey.objects.filter(scope=scope, key=key).first() or IdempotencyKey(request_hash=fingerprint)
+
+
+def replay(record, fingerprint):
+    if record.request_hash != fingerprint:
+        return Response(
+            {"error": f"This {HEADER} was already used for a different request"},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if record.response_status is None:
+        return Response(
+            {"error": f"A request with this {HEADER} is still being processed"},
+            status=status.HTTP_409_CONFLICT,
+            headers={'Retry-After': '1'},
+        )
+    return Response(record.response_body, status=record.response_status, headers={'Idempotent-Replayed': 'true'})
+
+
+def is_final(response):
+    """ Whether a response is the outcome of the request, to be replayed to retries """
+    return (
+        response.status_code < 500
+        and response.status_code not in RETRY_STATUSES
+        and not response.has_header('Retry-After')
+    )
+
+
+def idempotent(scope):
+    """
+    For public POST endpoints that clients retry. A request carrying an Idempotency-Key
+    header runs once per (scope, key): retries within IDEMPOTENCY_KEY_TTL_HOURS get the
+    stored response without running the view again. Server errors and temporary answers
+    (409, 429 or anything with Retry-After) are not stored, so those can be retried.
+    Apply below @api_view.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view(request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response(
+                    {"error": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            fingerprint = request_hash(request)
+            existing = claim_key(scope, key, fingerprint, timezone.now())
+            if existing is not None:
+                logger.info(f"Replaying {scope} response for {HEADER} {key}")
+                return replay(existing, fingerprint)
+
+            records = IdempotencyKey.objects.filter(scope=scope, key=key)
+            try:
+                response = view(request, *args, **kwargs)
+            except Exception:
+                records.delete()
+                raise
+            if not is_final(response):
+                records.delete()
+            else:
+                records.update(response_status=response.status_code, response_body=response.data)
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired_keys(batch_size=500, now=None):
+    """ Delete expired keys a batch at a time. Returns the count. """
+    now = now or timezone.now()
+    purged = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        purged += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
+    if purged:
+        logger.info(f"Purged {purged} expired idempotency keys")
+    return purged
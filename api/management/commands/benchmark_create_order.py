@@ -0,0 +1,54 @@
+import json
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from api.models import Product
+from api.views import create_order
+
+
+class RolledBack(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Time create_order for 1, 10 and 50 line orders against throwaway products (nothing is kept)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[1, 10, 50])
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--payment-method', default='Delivery', help="Delivery also times the stock deduction")
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        self.stdout.write(f"{'lines':>6} {'queries':>8} {'median ms':>10} {'max ms':>8}")
+        for line_count in options['lines']:
+            timings, queries = [], 0
+            for _ in range(options['repeat']):
+                try:
+                    with transaction.atomic():
+                        products = Product.objects.bulk_create([
+                            Product(name=f"Benchmark part {i}", price=100, stock_quantity=1000)
+                            for i in range(line_count)
+                        ])
+                        body = json.dumps({
+                            'items': [{'product_id': product.id, 'quantity': 2} for product in products],
+                            'payment_method': options['payment_method'],
+                            'full_name': "Benchmark",
+                        })
+                        request = factory.post('/api/orders/create/', body, content_type='application/json')
+                        with CaptureQueriesContext(connection) as captured:
+                            start = time.perf_counter()
+                            response = create_order(request)
+                            timings.append((time.perf_counter() - start) * 1000)
+                        if response.status_code != 201:
+                            self.stderr.write(f"create_order failed: {response.data}")
+                            return
+                        queries = len(captured)
+                        raise RolledBack
+                except RolledBack:
+                    pass
+
+            timings.sort()
+            self.stdout.write(f"{line_count:>6} {queries:>8} {timings[len(timings) // 2]:>10.2f} {timings[-1]:>8.2f}")
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.product_import import detect_format, export_rows, write_rows
+
+
+class Command(BaseCommand):
+    help = "Export all products as CSV or JSONL in the layout import_products reads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='-', help="Output file, or - for stdout (default)")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the output extension, else csv")
+
+    def handle(self, *args, **options):
+        path = options['output']
+        file_format = options['format'] or detect_format(path) or 'csv'
+
+        if path == '-':
+            count = write_rows(export_rows(), self.stdout, file_format)
+        else:
+            try:
+                stream = open(path, 'w', newline='', encoding='utf-8')
+            except OSError as e:
+                raise CommandError(f"Cannot write {path}: {e}")
+            with stream:
+                count = write_rows(export_rows(), stream, file_format)
+        self.stderr.write(self.style.SUCCESS(f"Exported {count} products."))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from api.renditions import prune_unreferenced, queue_jobs, rendition_models
+
+# Instances per queue_jobs call
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = "Queue WebP/JPEG renditions for the product, service and gallery images that lack them; run_renditions builds them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Rebuild every image, not only missing or stale ones")
+        parser.add_argument('--prune', action='store_true', help="Delete rendition files no image references any more")
+
+    def handle(self, *args, **options):
+        queued = 0
+        for model in rendition_models():
+            instances = list(model.objects.only('pk', 'image', 'image_renditions').order_by('pk'))
+            for start in range(0, len(instances), CHUNK_SIZE):
+                queued += queue_jobs(instances[start:start + CHUNK_SIZE], force=options['force'])
+        self.stdout.write(self.style.SUCCESS(f"Queued renditions for {queued} images."))
+
+        if options['prune']:
+            removed = prune_unreferenced()
+            self.stdout.write(self.style.SUCCESS(f"Removed {removed} unreferenced rendition files."))
@@ -0,0 +1,39 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from api.product_import import CHUNK_SIZE, ProductImporter, detect_format, read_rows
+
+
+class Command(BaseCommand):
+    help = "Create or update products from a CSV or JSONL file (see export_products for the layout)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension")
+        parser.add_argument('--dry-run', action='store_true', help="Validate and report without saving anything")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or detect_format(path)
+        if file_format is None:
+            raise CommandError("Cannot tell the file format from its name; pass --format csv or --format jsonl")
+
+        if path == '-':
+            summary = ProductImporter(options['chunk_size']).run(read_rows(sys.stdin, file_format), options['dry_run'])
+        else:
+            try:
+                stream = open(path, newline='', encoding='utf-8-sig')
+            except OSError as e:
+                raise CommandError(f"Cannot open {path}: {e}")
+            with stream:
+                summary = ProductImporter(options['chunk_size']).run(read_rows(stream, file_format), options['dry_run'])
+
+        for error in summary['errors']:
+            self.stderr.write(f"Line {error['line']}: {error['error']}")
+        if summary['error_count'] > len(summary['errors']):
+            self.stderr.write(f"... and {summary['error_count'] - len(summary['errors'])} more errors")
+
+        prefix = "Dry run: would have" if summary['dry_run'] else "Products"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} created {summary['created']}, updated {summary['updated']}; {summary['error_count']} rows rejected."
+        ))
@@ -0,0 +1,113 @@
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+PHASES = ('order', 'pay', 'settle')
+
+
+def percentile(values, fraction):
+    """ Nearest-rank percentile of a sorted list """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_flow(session, base_url, product_ids, payment_method, phone_number, settle_within):
+    """
+    One checkout over HTTP: create an order, start its payment and (for M-Pesa) long-poll
+    until the callback settles it. Returns (outcome, {phase: seconds}).
+    """
+    timings = {}
+    started = time.perf_counter()
+    response = session.post(f'{base_url}/api/orders/create/', json={
+        'items': [{'product_id': random.choice(product_ids), 'quantity': 1}],
+        'payment_method': payment_method,
+        'full_name': "Load test",
+    }, headers={'Idempotency-Key': str(uuid.uuid4())}, timeout=30)
+    timings['order'] = time.perf_counter() - started
+    if response.status_code != 201:
+        return f"order {response.status_code}", timings
+    order_id = response.json()['order_id']
+    if payment_method == 'Delivery':
+        return 'placed', timings
+
+    endpoint = 'mpesa' if payment_method == 'M-Pesa' else 'stripe'
+    started = time.perf_counter()
+    response = session.post(f'{base_url}/api/payment/{endpoint}/initiate/{order_id}/', json={'phone_number': phone_number},
+                            headers={'Idempotency-Key': str(uuid.uuid4())}, timeout=30)
+    timings['pay'] = time.perf_counter() - started
+    if response.status_code != 200:
+        return f"pay {response.status_code}", timings
+    if payment_method != 'M-Pesa':
+        # No Stripe webhook yet, so card checkouts end at the intent
+        return 'intent', timings
+
+    started = time.perf_counter()
+    deadline = started + settle_within
+    while time.perf_counter() < deadline:
+        wait = max(0, min(25, deadline - time.perf_counter()))
+        response = session.get(f'{base_url}/api/orders/{order_id}/payment-status/',
+                               params={'since': 'pending', 'wait': f'{wait:.1f}'}, timeout=wait + 10)
+        if response.status_code != 200:
+            return f"status {response.status_code}", timings
+        data = response.json()
+        if data['changed']:
+            timings['settle'] = time.perf_counter() - started
+            return data['status'], timings
+    return 'unsettled', timings
+
+
+class Command(BaseCommand):
+    help = ("Drive concurrent order -> pay -> callback flows against a running server (e.g. gunicorn with "
+            "DARAJA_BASE_URL pointing at run_provider_simulator). Creates real orders; use a throwaway database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--product-id', type=int, nargs='+', required=True, help="Products to order, with enough stock")
+        parser.add_argument('--flows', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--payment-method', default='M-Pesa', choices=['M-Pesa', 'Stripe', 'Delivery'])
+        parser.add_argument('--phone-number', default='0700000000')
+        parser.add_argument('--settle-within', type=float, default=90, help="Seconds to wait for the callback")
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'].rstrip('/')
+        sessions = threading.local()
+
+        def flow(_):
+            if not hasattr(sessions, 'session'):
+                sessions.session = requests.Session()
+            try:
+                return run_flow(sessions.session, base_url, options['product_id'], options['payment_method'],
+                                options['phone_number'], options['settle_within'])
+            except requests.RequestException as e:
+                return f"error {type(e).__name__}", {}
+
+        try:
+            requests.get(f'{base_url}/api/orders/0/payment-status/', params={'wait': '0'}, timeout=5)
+        except requests.RequestException as e:
+            raise CommandError(f"{base_url} is not reachable: {e}")
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(flow, range(options['flows'])))
+        elapsed = time.perf_counter() - started
+
+        outcomes = Counter(outcome for outcome, _ in results)
+        timings = defaultdict(list)
+        for _, flow_timings in results:
+            for phase, seconds in flow_timings.items():
+                timings[phase].append(seconds * 1000)
+
+        self.stdout.write(f"{options['flows']} flows in {elapsed:.1f} s: {options['flows'] / elapsed:.1f} checkouts/s "
+                          f"at concurrency {options['concurrency']}")
+        self.stdout.write(", ".join(f"{outcome}: {count}" for outcome, count in outcomes.most_common()))
+        self.stdout.write(f"{'phase':>8} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for phase in PHASES:
+            values = sorted(timings[phase])
+            if values:
+                self.stdout.write(f"{phase:>8} {len(values):>6} {percentile(values, 0.5):>8.0f} {percentile(values, 0.95):>8.0f} "
+                                  f"{percentile(values, 0.99):>8.0f} {values[-1]:>8.0f}")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from api.mpesa_inbox import BATCH_SIZE, process_batch
+from api.work_queue import worker_runs
+
+
+class Command(BaseCommand):
+    help = "Apply M-Pesa callbacks stored by the webhook to their payments and orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Apply what is due now and exit")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        # Checkout pages long-poll for the result, so keep this short
+        parser.add_argument('--interval', type=float, default=1, help="Seconds to wait when nothing is due")
+
+    def handle(self, *args, **options):
+        total_processed = total_failed = 0
+        runs = worker_runs(lambda: process_batch(options['batch_size']), options['once'], options['interval'])
+        for processed, failed in runs:
+            total_processed += processed
+            total_failed += failed
+        self.stdout.write(self.style.SUCCESS(f"Applied {total_processed} callbacks, {total_failed} failed attempts."))
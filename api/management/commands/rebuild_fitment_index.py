@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api.fitment import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the vehicle fitment index from ProductImage.car_models"
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed fitment for {count} product images."))
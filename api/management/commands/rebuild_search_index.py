@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from api.search import rebuild_index, search_backend_available
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product search index from the Product and ProductImage tables"
+
+    def handle(self, *args, **options):
+        if not search_backend_available():
+            self.stdout.write(self.style.WARNING("Search index is only used on SQLite; nothing to rebuild."))
+            return
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} products."))
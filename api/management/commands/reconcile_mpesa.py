@@ -0,0 +1,28 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from api.mpesa_reconcile import BATCH_SIZE, MAX_WORKERS, STALE_AFTER, reconcile
+from api.work_queue import worker_runs
+
+
+class Command(BaseCommand):
+    help = "Ask Daraja for the result of M-Pesa payments whose callback never arrived and apply it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Reconcile what is stale now and exit")
+        parser.add_argument('--older-than', type=float, default=STALE_AFTER.total_seconds() / 60,
+                            help="Minutes a payment must have been pending")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=MAX_WORKERS, help="Concurrent STK queries")
+        parser.add_argument('--interval', type=float, default=300, help="Seconds between runs")
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(minutes=options['older_than'])
+        total_settled = total_pending = 0
+        runs = worker_runs(
+            lambda: reconcile(stale_after, options['batch_size'], options['workers']),
+            options['once'], options['interval'], drain=False,
+        )
+        for settled, pending in runs:
+            total_settled += settled
+            total_pending = pending
+        self.stdout.write(self.style.SUCCESS(f"Settled {total_settled} stale payments, {total_pending} still pending."))
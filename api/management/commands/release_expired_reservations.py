@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from api.stock import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Delete stock reservations of unpaid orders whose hold has expired"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = release_expired_reservations(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Released {count} expired reservations."))
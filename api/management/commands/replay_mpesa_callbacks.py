@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.models import MpesaCallback
+from api.mpesa_inbox import process_batch, replay
+
+
+class Command(BaseCommand):
+    help = "Queue failed M-Pesa callbacks to be applied again (all failed ones unless narrowed down)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--id', type=int, nargs='*', default=[], help="Inbox entry ids, in any status")
+        parser.add_argument('--checkout-request-id', nargs='*', default=[], help="CheckoutRequestIDs, in any status")
+        parser.add_argument('--process', action='store_true', help="Apply them now instead of leaving them to the worker")
+
+    def handle(self, *args, **options):
+        if options['id'] or options['checkout_request_id']:
+            entries = MpesaCallback.objects.filter(id__in=options['id']) | MpesaCallback.objects.filter(
+                checkout_request_id__in=options['checkout_request_id']
+            )
+        else:
+            entries = MpesaCallback.objects.filter(status=MpesaCallback.STATUS_FAILED)
+
+        count = replay(entries)
+        if not count:
+            raise CommandError("No matching callbacks to replay")
+        self.stdout.write(f"Queued {count} callbacks.")
+
+        if options['process']:
+            processed = failed = 0
+            while True:
+                batch_processed, batch_failed = process_batch()
+                if not batch_processed and not batch_failed:
+                    break
+                processed += batch_processed
+                failed += batch_failed
+            self.stdout.write(self.style.SUCCESS(f"Applied {processed} callbacks, {failed} failed attempts."))
@@ -0,0 +1,41 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from api.analytics import day_of, rollup_bookings, rollup_orders
+from api.models import Booking, Order
+
+
+class Command(BaseCommand):
+    help = ("Recompute the daily booking and order stats behind the report endpoints. Signals keep them current; "
+            "the Docker image runs this nightly to pick up anything they missed (bulk updates, raw SQL).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2, help="Recompute this many days up to today (default: yesterday and today)")
+        parser.add_argument('--since', help="Recompute from this date (YYYY-MM-DD) instead")
+        parser.add_argument('--all', action='store_true', help="Recompute all history")
+
+    def handle(self, *args, **options):
+        end = timezone.localdate()
+        if options['all']:
+            first = [day_of(moment) for moment in (
+                Booking.objects.aggregate(first=Min('created_at'))['first'],
+                Order.objects.aggregate(first=Min('created_at'))['first'],
+            ) if moment]
+            start = min(first, default=end)
+        elif options['since']:
+            try:
+                start = parse_date(options['since'])
+            except ValueError:
+                start = None
+            if start is None:
+                raise CommandError("--since must be YYYY-MM-DD")
+        else:
+            start = end - timedelta(days=max(options['days'], 1) - 1)
+
+        bookings = rollup_bookings(start, end)
+        orders = rollup_orders(start, end)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {start} to {end}: {bookings} booking stat rows, {orders} order stat rows."
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from api.outbox import BATCH_SIZE, send_batch
+from api.work_queue import worker_runs
+
+
+class Command(BaseCommand):
+    help = "Deliver queued emails from the outbox, retrying failures with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain what is due now and exit")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=5, help="Seconds to wait when nothing is due")
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        runs = worker_runs(lambda: send_batch(options['batch_size']), options['once'], options['interval'])
+        for sent, failed in runs:
+            total_sent += sent
+            total_failed += failed
+        self.stdout.write(self.style.SUCCESS(f"Sent {total_sent} emails, {total_failed} failed attempts."))
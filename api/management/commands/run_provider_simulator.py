@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from api.provider_simulator import ProviderSimulator
+
+
+class Command(BaseCommand):
+    help = "Serve a local Daraja and Stripe stand-in for end-to-end and load tests"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument('--latency', type=float, default=0.2, help="Mean seconds per request")
+        parser.add_argument('--failure-rate', type=float, default=0, help="Share of requests answered with a 5xx")
+        parser.add_argument('--success-rate', type=float, default=0.9, help="Share of STK pushes / intents the customer pays")
+        parser.add_argument('--callback-delay', type=float, default=3, help="Mean seconds before the STK callback is sent")
+        parser.add_argument('--drop-callbacks', type=float, default=0, help="Share of STK callbacks never sent")
+        parser.add_argument('--callback-url', help="Send callbacks here instead of the push's CallBackURL")
+
+    def handle(self, *args, **options):
+        simulator = ProviderSimulator(
+            (options['host'], options['port']),
+            latency=options['latency'],
+            failure_rate=options['failure_rate'],
+            success_rate=options['success_rate'],
+            callback_delay=options['callback_delay'],
+            callback_drop_rate=options['drop_callbacks'],
+            callback_url=options['callback_url'],
+        )
+        self.stdout.write(f"Provider simulator on {simulator.url}. Run the app with "
+                          f"DARAJA_BASE_URL={simulator.url} STRIPE_API_BASE={simulator.url}")
+        try:
+            simulator.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulator.server_close()
+        self.stdout.write(self.style.SUCCESS(", ".join(f"{name}: {count}" for name, count in sorted(simulator.stats.items()))))
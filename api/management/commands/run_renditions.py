@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from api.renditions import BATCH_SIZE, process_batch
+from api.work_queue import worker_runs
+
+
+class Command(BaseCommand):
+    help = "Build the WebP/JPEG renditions of images queued by uploads and product imports"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain what is due now and exit")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=2, help="Seconds to wait when nothing is queued")
+
+    def handle(self, *args, **options):
+        total_done = total_failed = 0
+        runs = worker_runs(lambda: process_batch(options['batch_size']), options['once'], options['interval'])
+        for done, failed in runs:
+            total_done += done
+            total_failed += failed
+        self.stdout.write(self.style.SUCCESS(f"Rendered {total_done} images, {total_failed} failed attempts."))
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+SEARCH_TABLE = 'api_product_search'
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        "name, description, category, car_models, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(
+        f"""
+        INSERT INTO {SEARCH_TABLE}(rowid, name, description, category, car_models)
+        SELECT p.id,
+               COALESCE(p.name, ''),
+               COALESCE(p.description, ''),
+               COALESCE(p.category, ''),
+               COALESCE((SELECT GROUP_CONCAT(REPLACE(i.car_models, ',', ' '), ' ')
+                         FROM api_productimage i WHERE i.product_id = p.id), '')
+        FROM api_product p
+        """
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_serviceimage_image_type'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
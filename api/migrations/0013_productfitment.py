@@ -0,0 +1,124 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:26
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# A frozen copy of the car_models parser in api.fitment as it stood when this migration
+# was written, so later changes to the live parser cannot change what it builds
+
+MAKE_ALIASES = {
+    'toyota': 'toyota',
+    'nissan': 'nissan',
+    'mazda': 'mazda',
+    'subaru': 'subaru',
+    'honda': 'honda',
+    'mitsubishi': 'mitsubishi',
+    'isuzu': 'isuzu',
+    'suzuki': 'suzuki',
+    'daihatsu': 'daihatsu',
+    'lexus': 'lexus',
+    'hyundai': 'hyundai',
+    'kia': 'kia',
+    'ford': 'ford',
+    'peugeot': 'peugeot',
+    'volvo': 'volvo',
+    'audi': 'audi',
+    'bmw': 'bmw',
+    'mercedes': 'mercedes-benz',
+    'mercedes-benz': 'mercedes-benz',
+    'benz': 'mercedes-benz',
+    'merc': 'mercedes-benz',
+    'volkswagen': 'volkswagen',
+    'vw': 'volkswagen',
+    'land rover': 'land rover',
+    'landrover': 'land rover',
+    'jeep': 'jeep',
+    'porsche': 'porsche',
+}
+
+YEAR_RANGE = re.compile(r'\b((?:19|20)\d{2})\s*(?:-|–|to)\s*((?:19|20)?\d{2})\b')
+YEAR_FROM = re.compile(r'\b((?:19|20)\d{2})\s*\+')
+YEAR = re.compile(r'\b((?:19|20)\d{2})\b')
+
+
+def parse_years(text):
+    match = YEAR_RANGE.search(text)
+    if match:
+        start, end = match.group(1), match.group(2)
+        if len(end) == 2:
+            end = start[:2] + end
+        return int(start), int(end), text[:match.start()] + text[match.end():]
+    match = YEAR_FROM.search(text)
+    if match:
+        return int(match.group(1)), None, text[:match.start()] + text[match.end():]
+    match = YEAR.search(text)
+    if match:
+        year = int(match.group(1))
+        return year, year, text[:match.start()] + text[match.end():]
+    return None, None, text
+
+
+def split_make(words):
+    for size in (2, 1):
+        candidate = ' '.join(words[:size])
+        if len(words) >= size and candidate in MAKE_ALIASES:
+            return MAKE_ALIASES[candidate], words[size:]
+    return None, words
+
+
+def parse_car_models(car_models):
+    entries = []
+    current_make = ''
+    for chunk in re.split(r'[,;/\n]+', car_models or ''):
+        year_from, year_to, rest = parse_years(' '.join(chunk.lower().split()))
+        words = re.sub(r'[^\w\s-]', ' ', rest).split()
+        make, model_words = split_make(words)
+        if make:
+            current_make = make
+        model = ' '.join(model_words)
+        if not model and not make:
+            continue
+        entries.append((make or current_make, model, year_from, year_to))
+    return entries
+
+
+def build_fitment_index(apps, schema_editor):
+    ProductImage = apps.get_model('api', 'ProductImage')
+    ProductFitment = apps.get_model('api', 'ProductFitment')
+    rows = []
+    for image in ProductImage.objects.exclude(car_models__isnull=True).exclude(car_models='').iterator():
+        for make, model, year_from, year_to in parse_car_models(image.car_models):
+            rows.append(ProductFitment(
+                product_id=image.product_id, image_id=image.pk,
+                make=make, model=model, year_from=year_from, year_to=year_to,
+            ))
+    ProductFitment.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_list_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFitment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('make', models.CharField(blank=True, max_length=50)),
+                ('model', models.CharField(blank=True, max_length=100)),
+                ('year_from', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('year_to', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fitments', to='api.productimage')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fitments', to='api.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['make', 'model'], name='api_product_make_d1944b_idx'), models.Index(fields=['model'], name='api_product_model_6dda2b_idx')],
+            },
+        ),
+        migrations.RunPython(build_fitment_index, migrations.RunPython.noop),
+    ]
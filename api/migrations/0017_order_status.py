@@ -0,0 +1,133 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:44
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+# Applied from least to most advanced, so a later (further along) status wins when
+# several flags are set: a paid order that was confirmed or shipped keeps that status,
+# and cancellation is final
+FLAG_STATUSES = [
+    ('is_failed', 'failed'),
+    ('is_paid', 'paid'),
+    ('is_confirmed', 'confirmed'),
+    ('is_out_for_delivery', 'out_for_delivery'),
+    ('is_completed', 'delivered'),
+    ('is_delivered', 'delivered'),
+    ('is_cancelled', 'cancelled'),
+]
+
+
+def flags_to_status(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    Order.objects.filter(is_paid=True).update(paid_at=F('updated_at'))
+    for flag, status in FLAG_STATUSES:
+        Order.objects.filter(**{flag: True}).update(status=status)
+
+
+def status_to_flags(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    Order.objects.update(is_pending=False)
+    Order.objects.filter(paid_at__isnull=False).update(is_paid=True)
+    Order.objects.filter(status='pending').update(is_pending=True)
+    Order.objects.filter(status__in=['confirmed', 'out_for_delivery', 'delivered']).update(is_confirmed=True)
+    Order.objects.filter(status='out_for_delivery').update(is_out_for_delivery=True)
+    Order.objects.filter(status='delivered').update(is_delivered=True, is_completed=True)
+    Order.objects.filter(status='failed').update(is_failed=True)
+    Order.objects.filter(status='cancelled').update(is_cancelled=True, is_restored=True)
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_outboxemail'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('paid', 'Paid'), ('out_for_delivery', 'Out for delivery'), ('delivered', 'Delivered'), ('failed', 'Payment failed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('to_status', models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('paid', 'Paid'), ('out_for_delivery', 'Out for delivery'), ('delivered', 'Delivered'), ('failed', 'Payment failed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('note', models.CharField(blank=True, default='', max_length=255)),
+            ],
+            options={
+                'verbose_name_plural': 'order status history',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='paid_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('paid', 'Paid'), ('out_for_delivery', 'Out for delivery'), ('delivered', 'Delivered'), ('failed', 'Payment failed'), ('cancelled', 'Cancelled')], default='pending', max_length=20),
+        ),
+        migrations.RunPython(flags_to_status, status_to_flags),
+        migrations.RemoveField(
+            model_name='order',
+            name='is_cancelled',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='is_completed',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='is_confirmed',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='is_delivered',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='is_failed',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='is_out_for_delivery',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='is_paid',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='is_pending',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='is_restored',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at'], name='api_order_status_1d49fe_idx'),
+        ),
+        migrations.AddField(
+            model_name='orderstatushistory',
+            name='changed_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='orderstatushistory',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_history', to='api.order'),
+        ),
+        migrations.AddIndex(
+            model_name='orderstatushistory',
+            index=models.Index(fields=['order', 'changed_at'], name='api_orderst_order_i_132230_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderstatushistory',
+            index=models.Index(fields=['to_status', 'changed_at'], name='api_orderst_to_stat_aba559_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=50, unique=True)),
+                ('access_token', models.TextField(blank=True, default='')),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True)),
+                ('refresh_lock_until', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_mpesacallback'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'created_at'], name='api_payment_status_268a01_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_payment_status_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['services', 'booking_date', 'booking_time', 'status'], name='api_booking_service_0ba1da_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def claim_active_bookings(apps, schema_editor):
+    # Where earlier races double-booked a slot, the first booking keeps the claim
+    Booking = apps.get_model('api', 'Booking')
+    BookingSlot = apps.get_model('api', 'BookingSlot')
+    claims = {}
+    active = Booking.objects.filter(
+        status__in=['pending', 'confirmed'], booking_date__isnull=False, booking_time__isnull=False,
+    ).order_by('id')
+    for booking in active.iterator():
+        key = (booking.services_id, booking.booking_date, booking.booking_time)
+        claims.setdefault(key, BookingSlot(
+            services_id=booking.services_id, booking_id=booking.id, date=booking.booking_date, time=booking.booking_time,
+        ))
+    BookingSlot.objects.bulk_create(claims.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_booking_availability_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingSlot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('time', models.TimeField()),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slot_claims', to='api.booking')),
+                ('services', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.services')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('services', 'date', 'time'), name='unique_booking_slot')],
+            },
+        ),
+        migrations.RunPython(claim_active_bookings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_bookingslot'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='bookingslot',
+            name='unique_booking_slot',
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='duration_minutes',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bookingslot',
+            name='unit',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='services',
+            name='bays',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Bays equipped for this service'),
+        ),
+        migrations.AddField(
+            model_name='services',
+            name='duration_minutes',
+            field=models.PositiveIntegerField(default=60, help_text='How long one booking keeps a bay busy'),
+        ),
+        migrations.AddField(
+            model_name='services',
+            name='technicians',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Technicians who can perform this service'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookingslot',
+            constraint=models.UniqueConstraint(fields=('services', 'date', 'time', 'unit'), name='unique_booking_slot_unit'),
+        ),
+    ]
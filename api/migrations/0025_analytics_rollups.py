@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import BooleanField, Count, ExpressionWrapper, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def roll_up_history(apps, schema_editor):
+    # The same grouping as api.analytics.rollup_bookings / rollup_orders, over all history
+    Booking = apps.get_model('api', 'Booking')
+    Order = apps.get_model('api', 'Order')
+    BookingDailyStat = apps.get_model('api', 'BookingDailyStat')
+    OrderDailyStat = apps.get_model('api', 'OrderDailyStat')
+    bookings = Booking.objects.annotate(day=TruncDate('created_at')).values('day', 'services', 'status').annotate(
+        count=Count('id'), revenue=Sum('total_price'),
+    ).order_by()
+    BookingDailyStat.objects.bulk_create([
+        BookingDailyStat(date=row['day'], services_id=row['services'], status=row['status'], count=row['count'],
+                         revenue=row['revenue'] or 0)
+        for row in bookings
+    ], batch_size=500)
+    orders = Order.objects.annotate(
+        day=TruncDate('created_at'), paid=ExpressionWrapper(Q(paid_at__isnull=False), output_field=BooleanField()),
+    ).values('day', 'paid').annotate(count=Count('id'), revenue=Sum('total_price')).order_by()
+    OrderDailyStat.objects.bulk_create([
+        OrderDailyStat(date=row['day'], paid=row['paid'], count=row['count'], revenue=row['revenue'] or 0)
+        for row in orders
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_service_duration_capacity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderDailyStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('paid', models.BooleanField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'paid'), name='unique_order_daily_stat')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BookingDailyStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('cancelled', 'Cancelled'), ('completed', 'Completed')], max_length=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('services', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.services')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'services', 'status'), name='unique_booking_daily_stat')],
+            },
+        ),
+        migrations.RunPython(roll_up_history, migrations.RunPython.noop),
+    ]
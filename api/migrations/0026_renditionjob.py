@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:28
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenditionJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(help_text='Model name in api.renditions.RENDITION_MODELS', max_length=50)),
+                ('object_id', models.PositiveIntegerField()),
+                ('queued_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['next_attempt_at'], name='api_renditi_next_at_4e3aeb_idx')],
+                'constraints': [models.UniqueConstraint(fields=('model', 'object_id'), name='unique_rendition_job')],
+            },
+        ),
+    ]
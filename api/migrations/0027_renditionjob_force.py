@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_renditionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='renditionjob',
+            name='force',
+            field=models.BooleanField(default=False, help_text='Rebuild even if the renditions look current'),
+        ),
+    ]
@@ -1,4 +1,6 @@
 
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
 from django.db import models
 import uuid
 from django.utils import timezone
@@ -8,9 +10,18 @@ class Services(models.Model):
     description = models.TextField(blank=False)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='services/')
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    duration_minutes = models.PositiveIntegerField(default=60, help_text="How long one booking keeps a bay busy")
+    bays = models.PositiveSmallIntegerField(default=1, help_text="Bays equipped for this service")
+    technicians = models.PositiveSmallIntegerField(default=1, help_text="Technicians who can perform this service")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    @property
+    def capacity(self):
+        # Each booking needs a bay and a technician for its whole duration
+        return max(min(self.bays, self.technicians), 1)
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
 
@@ -36,6 +47,7 @@ class ServiceImage(models.Model):
     ]
 
     image = models.ImageField(upload_to='services/')
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     image_type = models.CharField(max_length=10, choices=IMAGE_TYPE_CHOICES, default='general')
     service_type = models.CharField(max_length=255, blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
@@ -63,27 +75,45 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2, blank=True,null=True)
     description = models.TextField(blank=True,null=True)
     image = models.ImageField(upload_to='products/', blank=True,null=True)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_available = models.BooleanField(default=True)
     stock_quantity = models.IntegerField(default=0)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['category', 'is_available']),
+        ]
 
     @property
     def current_offer(self):
         now = timezone.now()
         # Prefetching ensures we don't hit the DB if `offers` is prefetched
-        for offer in self.offers.all():
-            if offer.is_active and offer.start_date <= now <= offer.end_date:
-                return offer
-        return None
+        valid_offers = [
+            offer for offer in self.offers.all()
+            if offer.is_active and offer.start_date <= now <= offer.end_date
+        ]
+        # Same rule as api.pricing: largest discount wins, oldest offer on ties
+        return min(valid_offers, key=lambda offer: (-offer.discount_percentage, offer.id), default=None)
 
     @property
-    def discounted_price(self):
+    def active_discount_percentage(self):
+        # Annotated by api.pricing.with_offer_prices(); otherwise resolved from the offers
+        if hasattr(self, 'resolved_discount_percentage'):
+            return self.resolved_discount_percentage
         offer = self.current_offer
-        if offer and self.price:
-            discount = (self.price * offer.discount_percentage) / 100
+        return offer.discount_percentage if offer else None
+
+    @property
+    def discounted_price(self):
+        return self.price_with_discount(self.active_discount_percentage)
+
+    def price_with_discount(self, discount_percentage):
+        if discount_percentage and self.price:
+            discount = (self.price * discount_percentage) / 100
             return round(self.price - discount, 2)
         return self.price
 
@@ -117,6 +147,7 @@ class ProductImage(models.Model):
     )
 
     image = models.ImageField(upload_to='products/')
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
     car_models = models.CharField(max_length=255, blank=True, null=True, help_text="Comma separated list of car models")
@@ -126,7 +157,43 @@ class ProductImage(models.Model):
     def __str__(self):
         return f"{self.product.name} Image"
 
+
+class ProductFitment(models.Model):
+    """ Normalized make/model/year rows parsed from ProductImage.car_models (see api/fitment.py) """
+    product = models.ForeignKey(Product, related_name='fitments', on_delete=models.CASCADE)
+    image = models.ForeignKey(ProductImage, related_name='fitments', on_delete=models.CASCADE)
+    make = models.CharField(max_length=50, blank=True)
+    model = models.CharField(max_length=100, blank=True)
+    year_from = models.PositiveSmallIntegerField(blank=True, null=True)
+    year_to = models.PositiveSmallIntegerField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['make', 'model']),
+            models.Index(fields=['model']),
+        ]
+
+    def __str__(self):
+        return f"{self.make} {self.model}".strip()
+
 class Order(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_CONFIRMED = 'confirmed'
+    STATUS_PAID = 'paid'
+    STATUS_OUT_FOR_DELIVERY = 'out_for_delivery'
+    STATUS_DELIVERED = 'delivered'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_CONFIRMED, 'Confirmed'),
+        (STATUS_PAID, 'Paid'),
+        (STATUS_OUT_FOR_DELIVERY, 'Out for delivery'),
+        (STATUS_DELIVERED, 'Delivered'),
+        (STATUS_FAILED, 'Payment failed'),
+        (STATUS_CANCELLED, 'Cancelled'),
+    ]
+
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -139,24 +206,90 @@ class Order(models.Model):
     phone_number = models.CharField(max_length=20, blank=True, null=True)
     estate = models.CharField(max_length=20, blank=True, null=True)
     street_address = models.CharField(max_length=255, blank=True, null=True)
-    is_delivered = models.BooleanField(default=False)
-    is_paid = models.BooleanField(default=False)
-    is_cancelled = models.BooleanField(default=False)
-    is_completed = models.BooleanField(default=False)
-    is_pending = models.BooleanField(default=True)
-    is_out_for_delivery = models.BooleanField(default=False)
-    is_restored = models.BooleanField(default=False)
-    is_failed = models.BooleanField(default=False)
-    is_confirmed = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    paid_at = models.DateTimeField(blank=True, null=True)
     payment_method = models.CharField(max_length=50, default='M-Pesa')
     description = models.TextField(blank=True, null=True)
 
-    
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['status', 'created_at']),
+        ]
 
     
     def __str__(self):
         return f"Order #{self.id} - {self.full_name}"
 
+    # Read-only views of `status` under the flag names the API has always exposed.
+    # FLAG_STATUSES lets queries filter on them as status lookups.
+    FLAG_STATUSES = {
+        'is_pending': (STATUS_PENDING,),
+        'is_confirmed': (STATUS_CONFIRMED, STATUS_OUT_FOR_DELIVERY, STATUS_DELIVERED),
+        'is_out_for_delivery': (STATUS_OUT_FOR_DELIVERY,),
+        'is_delivered': (STATUS_DELIVERED,),
+        'is_completed': (STATUS_DELIVERED,),
+        'is_cancelled': (STATUS_CANCELLED,),
+        'is_restored': (STATUS_CANCELLED,),
+        'is_failed': (STATUS_FAILED,),
+    }
+
+    @property
+    def is_paid(self):
+        return self.paid_at is not None
+
+    @property
+    def is_pending(self):
+        return self.status in self.FLAG_STATUSES['is_pending']
+
+    @property
+    def is_confirmed(self):
+        return self.status in self.FLAG_STATUSES['is_confirmed']
+
+    @property
+    def is_out_for_delivery(self):
+        return self.status in self.FLAG_STATUSES['is_out_for_delivery']
+
+    @property
+    def is_delivered(self):
+        return self.status in self.FLAG_STATUSES['is_delivered']
+
+    @property
+    def is_completed(self):
+        return self.status in self.FLAG_STATUSES['is_completed']
+
+    @property
+    def is_cancelled(self):
+        return self.status in self.FLAG_STATUSES['is_cancelled']
+
+    @property
+    def is_restored(self):
+        return self.status in self.FLAG_STATUSES['is_restored']
+
+    @property
+    def is_failed(self):
+        return self.status in self.FLAG_STATUSES['is_failed']
+
+
+class OrderStatusHistory(models.Model):
+    """ One row per order status change, written by api.order_status.transition """
+    order = models.ForeignKey(Order, related_name='status_history', on_delete=models.CASCADE)
+    from_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    to_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    changed_at = models.DateTimeField(default=timezone.now)
+    changed_by = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True, on_delete=models.SET_NULL)
+    note = models.CharField(max_length=255, blank=True, default='')
+
+    class Meta:
+        verbose_name_plural = 'order status history'
+        indexes = [
+            models.Index(fields=['order', 'changed_at']),
+            models.Index(fields=['to_status', 'changed_at']),
+        ]
+
+    def __str__(self):
+        return f"Order #{self.order_id}: {self.from_status} -> {self.to_status}"
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -165,6 +298,24 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.quantity} x {self.product.name} (Order #{self.order.id})"
+
+
+class StockReservation(models.Model):
+    """ Stock held for an unpaid order until it is paid or `expires_at` passes """
+    order = models.ForeignKey(Order, related_name='reservations', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='reservations', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'expires_at']),
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} held for Order #{self.order_id}"
     
     
 
@@ -173,6 +324,8 @@ class Booking(models.Model):
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     booking_date = models.DateField(blank=True, null=True)
     booking_time = models.TimeField(blank=True, null=True)   
+    # The service's duration when booked, like total_price; empty on older bookings
+    duration_minutes = models.PositiveIntegerField(blank=True, null=True)
     full_name = models.CharField(max_length=255, blank=True, null=True)
     email = models.EmailField(max_length=255, blank=True, null=True)
     phone_number = models.CharField(max_length=20, blank=True, null=True)
@@ -190,6 +343,13 @@ class Booking(models.Model):
     )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['status', 'booking_date']),
+            # Covers the availability engine's grouped slot query
+            models.Index(fields=['services', 'booking_date', 'booking_time', 'status']),
+        ]
 
 
     
@@ -197,6 +357,65 @@ class Booking(models.Model):
         return f"{self.full_name} - {self.services}"
 
 
+class BookingSlot(models.Model):
+    """
+    One hour cell of the schedule held by an active (pending or confirmed) booking, on
+    one of the service's `capacity` units. A booking holds every cell its duration
+    covers. Claims are inserted and released by api.availability.sync_slot_claim; the
+    unique constraint makes a second claim on a unit fail instead of overbooking it.
+    """
+    services = models.ForeignKey('Services', on_delete=models.CASCADE)
+    booking = models.ForeignKey(Booking, related_name='slot_claims', on_delete=models.CASCADE)
+    date = models.DateField()
+    time = models.TimeField()
+    unit = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['services', 'date', 'time', 'unit'], name='unique_booking_slot_unit'),
+        ]
+
+    def __str__(self):
+        return f"{self.services_id} {self.date} {self.time} #{self.unit} (booking {self.booking_id})"
+
+
+class BookingDailyStat(models.Model):
+    """
+    Bookings created on one day for one service in one status, kept by api.analytics
+    from model signals and the nightly `rollup_analytics` backfill. Reports read these
+    instead of aggregating the Booking table.
+    """
+    date = models.DateField()
+    services = models.ForeignKey('Services', on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=Booking.STATUS_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'services', 'status'], name='unique_booking_daily_stat'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.services_id} {self.status}: {self.count}"
+
+
+class OrderDailyStat(models.Model):
+    """ Orders created on one day, split by whether they have been paid; see BookingDailyStat """
+    date = models.DateField()
+    paid = models.BooleanField()
+    count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'paid'], name='unique_order_daily_stat'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {'paid' if self.paid else 'unpaid'}: {self.count}"
+
+
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -228,6 +447,12 @@ class Payment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # reconcile_mpesa scans stale pending payments
+            models.Index(fields=['status', 'created_at']),
+        ]
+
     def __str__(self):
         return f"Payment for Order #{self.order.id} - {self.status}"
 
@@ -235,11 +460,16 @@ class Payment(models.Model):
 class Gallery(models.Model):
     title = models.CharField(max_length=255, blank=True, null=True)
     image = models.ImageField(upload_to='gallery/')
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     category = models.CharField(max_length=100, blank=True, null=True, help_text="e.g. Tinting, Wrapping, PPF")
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         verbose_name_plural = "Gallery Items"
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['category']),
+        ]
 
     def __str__(self):
         return self.title or f"Gallery Item {self.id}"
@@ -256,10 +486,71 @@ class ContactMessage(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.subject} from {self.name}"
 
+
+class OutboxEmail(models.Model):
+    """ An email queued by a request and delivered by the `run_outbox` worker """
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    to_email = models.EmailField(max_length=255)
+    from_email = models.CharField(max_length=255)
+    subject = models.CharField(max_length=255)
+    plain_body = models.TextField()
+    html_body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    send_duration_ms = models.PositiveIntegerField(blank=True, null=True, help_text="Time the SMTP send took")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.to_email} ({self.status})"
+
+class RenditionJob(models.Model):
+    """
+    An image whose renditions need building, queued when it is saved or imported and
+    processed by the `run_renditions` worker. One job per row; queueing it again while
+    it is being processed moves `queued_at`, so the worker knows to run it once more.
+    """
+    model = models.CharField(max_length=50, help_text="Model name in api.renditions.RENDITION_MODELS")
+    object_id = models.PositiveIntegerField()
+    queued_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    force = models.BooleanField(default=False, help_text="Rebuild even if the renditions look current")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'object_id'], name='unique_rendition_job'),
+        ]
+        indexes = [
+            models.Index(fields=['next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"Renditions for {self.model} #{self.object_id}"
+
 class Offer(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
@@ -276,3 +567,69 @@ class Offer(models.Model):
     def is_valid(self):
         now = timezone.now()
         return self.is_active and self.start_date <= now <= self.end_date
+
+
+class IdempotencyKey(models.Model):
+    """ The stored outcome of a request sent with an Idempotency-Key header, see api.idempotency """
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(blank=True, null=True, help_text="Empty while the request is in progress")
+    response_body = models.JSONField(blank=True, null=True, encoder=JSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='unique_idempotency_key_per_scope'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key}"
+
+
+class ProviderToken(models.Model):
+    """ A payment provider's OAuth access token, shared by all workers, see api.provider_tokens """
+    provider = models.CharField(max_length=50, unique=True)
+    access_token = models.TextField(blank=True, default='')
+    expires_at = models.DateTimeField(blank=True, null=True)
+    refreshed_at = models.DateTimeField(blank=True, null=True)
+    # Set by the worker refreshing the token, so the others keep using the current one
+    refresh_lock_until = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.provider} token (expires {self.expires_at})"
+
+
+class MpesaCallback(models.Model):
+    """ A raw STK callback from Daraja, stored by the webhook and applied by `process_mpesa_callbacks` """
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSED = 'processed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSED, 'Processed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    # Daraja redelivers callbacks; the unique id keeps one entry per STK push
+    checkout_request_id = models.CharField(max_length=100, unique=True, blank=True, null=True)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    outcome = models.CharField(max_length=255, blank=True, default='')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"STK callback {self.checkout_request_id} ({self.status})"
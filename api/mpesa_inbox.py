@@ -0,0 +1,168 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import MpesaCallback, Order, Payment
+from .order_status import mark_paid, transition
+from .stock import convert_reservations, release_reservations
+from .utils import send_receipt_email
+from .work_queue import WorkQueue
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+
+MAX_ATTEMPTS = 10
+
+# Short first retries: the usual failure is a callback that beat the commit of its Payment row
+BACKOFF_BASE = timedelta(seconds=5)
+BACKOFF_MAX = timedelta(minutes=10)
+
+# A claimed entry is retried if its worker has not finished it within this lease
+CLAIM_LEASE = timedelta(minutes=2)
+
+queue = WorkQueue(
+    MpesaCallback, MAX_ATTEMPTS, BACKOFF_BASE, BACKOFF_MAX, CLAIM_LEASE,
+    pending_status=MpesaCallback.STATUS_PENDING, failed_status=MpesaCallback.STATUS_FAILED,
+    describe=lambda entry: f"M-Pesa callback {entry.id} ({entry.checkout_request_id})",
+)
+
+
+class PaymentNotFound(Exception):
+    """ No Payment has the callback's CheckoutRequestID (yet) """
+
+
+def stk_callback_of(payload):
+    body = payload.get('Body') if isinstance(payload, dict) else None
+    return (body or {}).get('stkCallback') or {}
+
+
+def record_callback(payload):
+    """
+    Store a webhook payload in the inbox. Returns (entry, created); redeliveries of a
+    CheckoutRequestID already stored return the existing entry.
+    """
+    checkout_request_id = stk_callback_of(payload).get('CheckoutRequestID') or None
+    try:
+        with transaction.atomic():
+            return MpesaCallback.objects.create(checkout_request_id=checkout_request_id, payload=payload), True
+    except IntegrityError:
+        return MpesaCallback.objects.get(checkout_request_id=checkout_request_id), False
+
+
+def adopt_abandoned_attempt(payload):
+    """
+    Match a successful callback nobody recorded the CheckoutRequestID for (the request
+    died mid-push, see mpesa_reconcile.recover_abandoned_attempts) to its attempt by
+    phone number and amount. Returns the payment, now Pending, or None.
+    """
+    stk_callback = stk_callback_of(payload)
+    items = {item.get('Name'): item.get('Value') for item in stk_callback.get('CallbackMetadata', {}).get('Item', [])}
+    if stk_callback.get('ResultCode') != 0 or not items.get('PhoneNumber') or items.get('Amount') is None:
+        return None
+    # The push sends int(amount)
+    amount = Decimal(str(items['Amount']))
+    payment = Payment.objects.filter(
+        status='Abandoned', payment_method='M-Pesa', transaction_id__isnull=True,
+        phone_number=str(items['PhoneNumber']), amount__gte=amount, amount__lt=amount + 1,
+    ).order_by('-created_at').first()
+    if payment is None:
+        return None
+    payment.transaction_id = stk_callback.get('CheckoutRequestID')
+    payment.status = 'Pending'
+    payment.save(update_fields=['transaction_id', 'status', 'updated_at'])
+    logger.warning(f"Matched M-Pesa callback {payment.transaction_id} to abandoned payment {payment.id}")
+    return payment
+
+
+def apply_callback(payload, payment):
+    """
+    Apply one STK callback to its payment and order. Payments already settled are left
+    alone, so replaying an entry is harmless. Returns a short outcome for the inbox.
+    """
+    stk_callback = stk_callback_of(payload)
+    result_code = stk_callback.get('ResultCode')
+    result_desc = stk_callback.get('ResultDesc')
+    checkout_request_id = stk_callback.get('CheckoutRequestID')
+    if not checkout_request_id:
+        raise ValueError("Callback has no CheckoutRequestID")
+    if payment is None:
+        raise PaymentNotFound(f"Payment with CheckoutRequestID {checkout_request_id} not found")
+    if payment.status != 'Pending':
+        return f"Payment already {payment.status.lower()}"
+
+    # Save raw data for auditing
+    payment.raw_callback_data = payload
+    order = Order.objects.select_for_update().get(pk=payment.order_id)
+
+    if result_code == 0:
+        logger.info(f"Payment successful: CheckoutID={checkout_request_id}, Ref={order.id}")
+        payment.status = 'Completed'
+        for item in stk_callback.get('CallbackMetadata', {}).get('Item', []):
+            if item.get('Name') == 'MpesaReceiptNumber':
+                payment.mpesa_receipt_number = item.get('Value')
+        payment.save()
+        # Results found by reconcile_mpesa's STK query carry no receipt number
+        reference = payment.mpesa_receipt_number or checkout_request_id
+
+        # Deduct stock ONLY when genuinely paid; the order's holds become deductions
+        if mark_paid(order, f"M-Pesa receipt {reference}"):
+            for product_id in convert_reservations(order):
+                logger.warning(f"Stock shortage for product {product_id} during late M-Pesa payment.")
+
+        # Send Email Receipt upon successful M-Pesa Payment
+        try:
+            if order.email:
+                subject = f"Payment Received: Order #{order.id}"
+                email_body = f"Hello {order.full_name},<br><br>We have successfully received your M-Pesa payment of <b>KES {payment.amount}</b> (Receipt: {reference}) for Order <b>#{order.id}</b>.<br><br>Your order is now processing. Thank you for shopping with Vinny KJ!"
+                send_receipt_email(order.email, subject, email_body)
+        except Exception as e:
+            logger.error(f"Failed to send Email Receipt for M-Pesa Order {order.id}: {e}")
+        return f"Paid, receipt {reference}"
+
+    logger.warning(f"Payment failed: CheckoutID={checkout_request_id}, Code={result_code}, Desc={result_desc}")
+    payment.status = 'Failed'
+    payment.save()
+
+    # Update order status to Failed and give its held stock back
+    release_reservations(order)
+    if order.status == Order.STATUS_PENDING:
+        transition(order, Order.STATUS_FAILED, result_desc or '')
+    return f"Failed: {result_desc or result_code}"[:255]
+
+
+def process_batch(batch_size=BATCH_SIZE):
+    """ Apply one batch of due inbox entries, each in its own transaction. Returns (processed, failed). """
+    entries = queue.claim(batch_size)
+    if not entries:
+        return 0, 0
+
+    payments = Payment.objects.in_bulk(
+        [entry.checkout_request_id for entry in entries if entry.checkout_request_id], field_name='transaction_id'
+    )
+    processed = failed = 0
+    for entry in entries:
+        try:
+            with transaction.atomic():
+                payment = payments.get(entry.checkout_request_id) or adopt_abandoned_attempt(entry.payload)
+                entry.outcome = apply_callback(entry.payload, payment)
+                entry.status = MpesaCallback.STATUS_PROCESSED
+                entry.attempts += 1
+                entry.processed_at = timezone.now()
+                entry.last_error = ''
+                entry.save(update_fields=['outcome', 'status', 'attempts', 'processed_at', 'last_error'])
+        except Exception as e:
+            queue.record_failure(entry, e)
+            failed += 1
+            continue
+        processed += 1
+    return processed, failed
+
+
+def replay(queryset):
+    """ Queue failed (or any) inbox entries to be applied again. Returns the count. """
+    return queryset.update(
+        status=MpesaCallback.STATUS_PENDING, attempts=0, next_attempt_at=timezone.now(), last_error=''
+    )
@@ -0,0 +1,142 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.db import connections
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from .models import MpesaCallback, Payment
+from .mpesa_inbox import process_batch
+from .utils import STK_QUERY_PROCESSING, MpesaClient
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Daraja's prompt expires after about a minute and the callback normally follows within
+# seconds, so a push still pending after this has most likely lost its callback
+STALE_AFTER = timedelta(minutes=5)
+
+# Pushes Daraja still has no result for after this are failed
+GIVE_UP_AFTER = timedelta(hours=24)
+
+# An attempt still 'Initiating' after this lost its request mid-push (the STK push and
+# token fetch time out well before it)
+INITIATE_TIMEOUT = timedelta(minutes=2)
+
+BATCH_SIZE = 100
+
+# Concurrent STK queries; Daraja rate-limits per app, so keep this small
+MAX_WORKERS = 4
+
+
+def recover_abandoned_attempts(now):
+    """
+    Mark attempts whose request died between recording them and storing Daraja's answer
+    as 'Abandoned'. They have no CheckoutRequestID to query; a successful callback for
+    one is matched back to it by mpesa_inbox.adopt_abandoned_attempt.
+    """
+    count = Payment.objects.filter(status='Initiating', created_at__lte=now - INITIATE_TIMEOUT).update(
+        status='Abandoned', updated_at=now,
+    )
+    if count:
+        logger.warning(f"Marked {count} M-Pesa payment attempts abandoned mid-push")
+    return count
+
+
+def stale_payments(now, stale_after=STALE_AFTER, after=None, limit=BATCH_SIZE):
+    """
+    Pending M-Pesa payments older than `stale_after`, oldest first, from the
+    (status, created_at) index. Payments whose callback is already in the inbox are left
+    to process_mpesa_callbacks. `after` is the (created_at, id) of the last payment of
+    the previous page.
+    """
+    payments = Payment.objects.filter(
+        status='Pending', created_at__lte=now - stale_after, payment_method='M-Pesa', transaction_id__isnull=False,
+    ).exclude(
+        Exists(MpesaCallback.objects.filter(checkout_request_id=OuterRef('transaction_id')))
+    )
+    if after:
+        created_at, pk = after
+        payments = payments.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+    return list(payments.order_by('created_at', 'id')[:limit])
+
+
+def query(client, checkout_request_id):
+    """ Daraja's answer for one STK push; runs on a pool thread """
+    try:
+        return client.stk_query(checkout_request_id)
+    finally:
+        connections.close_all()
+
+
+def result_of(payment, response, now):
+    """
+    The stkCallback to apply for a payment, built from its STK query response, or None
+    while the result is not known yet.
+    """
+    if response and response.get('ResultCode') not in (None, ''):
+        return {
+            'MerchantRequestID': response.get('MerchantRequestID'),
+            'CheckoutRequestID': payment.transaction_id,
+            'ResultCode': int(response['ResultCode']),
+            'ResultDesc': response.get('ResultDesc', ''),
+        }
+    if response and response.get('errorCode') not in (None, STK_QUERY_PROCESSING):
+        logger.warning(f"STK query for {payment.transaction_id} failed: {response.get('errorCode')} {response.get('errorMessage')}")
+    if payment.created_at <= now - GIVE_UP_AFTER:
+        return {
+            'CheckoutRequestID': payment.transaction_id,
+            'ResultCode': None,
+            'ResultDesc': "No result from M-Pesa",
+        }
+    return None
+
+
+def reconcile_batch(payments, client=None, max_workers=MAX_WORKERS, now=None):
+    """
+    Query Daraja for each payment, a few at a time, then store the answers in the
+    callback inbox with one insert and apply them like callbacks. Returns
+    (settled, still_pending).
+    """
+    if not payments:
+        return 0, 0
+    now = now or timezone.now()
+    client = client or MpesaClient()
+    # Fetch the token once here, so the pool threads all use this copy
+    client.get_access_token()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        responses = list(pool.map(lambda payment: query(client, payment.transaction_id), payments))
+
+    entries = []
+    for payment, response in zip(payments, responses):
+        stk_callback = result_of(payment, response, now)
+        if stk_callback is not None:
+            entries.append(MpesaCallback(
+                checkout_request_id=payment.transaction_id,
+                payload={'Body': {'stkCallback': stk_callback}, 'Source': 'reconcile_mpesa'},
+            ))
+    # A callback that arrived meanwhile wins; its entry is applied by the worker
+    MpesaCallback.objects.bulk_create(entries, ignore_conflicts=True)
+    while entries and any(process_batch(len(entries))):
+        pass
+
+    logger.info(f"Reconciled {len(payments)} stale M-Pesa payments: {len(entries)} settled")
+    return len(entries), len(payments) - len(entries)
+
+
+def reconcile(stale_after=STALE_AFTER, batch_size=BATCH_SIZE, max_workers=MAX_WORKERS):
+    """ Reconcile every stale pending payment, a page at a time. Returns (settled, still_pending). """
+    now = timezone.now()
+    recover_abandoned_attempts(now)
+    client = MpesaClient()
+    settled = pending = 0
+    after = None
+    while True:
+        payments = stale_payments(now, stale_after, after, batch_size)
+        if not payments:
+            break
+        batch_settled, batch_pending = reconcile_batch(payments, client, max_workers, now)
+        settled += batch_settled
+        pending += batch_pending
+        after = (payments[-1].created_at, payments[-1].id)
+    return settled, pending
@@ -0,0 +1,127 @@
+import asyncio
+from django.db.models import Q
+from django.utils import timezone
+from .models import Order, OrderStatusHistory
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Allowed moves out of each status. Delivered and cancelled orders are final.
+TRANSITIONS = {
+    Order.STATUS_PENDING: {Order.STATUS_CONFIRMED, Order.STATUS_PAID, Order.STATUS_FAILED, Order.STATUS_CANCELLED},
+    # A failed payment can be retried, or a late success callback can still arrive
+    Order.STATUS_FAILED: {Order.STATUS_PENDING, Order.STATUS_PAID, Order.STATUS_CANCELLED},
+    Order.STATUS_CONFIRMED: {Order.STATUS_OUT_FOR_DELIVERY, Order.STATUS_DELIVERED, Order.STATUS_CANCELLED},
+    Order.STATUS_PAID: {Order.STATUS_CONFIRMED, Order.STATUS_OUT_FOR_DELIVERY, Order.STATUS_DELIVERED, Order.STATUS_CANCELLED},
+    Order.STATUS_OUT_FOR_DELIVERY: {Order.STATUS_DELIVERED, Order.STATUS_CANCELLED},
+    Order.STATUS_DELIVERED: set(),
+    Order.STATUS_CANCELLED: set(),
+}
+
+STATUS_LABELS = dict(Order.STATUS_CHOICES)
+
+# Long-polled status checks: how often a waiting request re-reads the order, and the
+# longest it waits (kept under nginx's proxy_read_timeout)
+STATUS_POLL_INTERVAL = 0.5
+STATUS_WAIT_MAX = 25
+
+
+class InvalidTransition(Exception):
+    """ The order cannot move from its current status to the requested one """
+
+
+def can_transition(from_status, to_status):
+    return to_status in TRANSITIONS.get(from_status, ())
+
+
+def transition(order, to_status, note='', user=None):
+    """
+    Move `order` to `to_status` and record the change in its status history.
+    Raises InvalidTransition for moves TRANSITIONS does not allow. Callers lock the
+    order row (select_for_update) inside their transaction.
+    """
+    from_status = order.status
+    if to_status not in STATUS_LABELS:
+        raise InvalidTransition(f"Unknown order status '{to_status}'")
+    if not can_transition(from_status, to_status):
+        raise InvalidTransition(
+            f"Cannot move order #{order.id} from {STATUS_LABELS[from_status].lower()} to {STATUS_LABELS[to_status].lower()}"
+        )
+
+    now = timezone.now()
+    order.status = to_status
+    if to_status == Order.STATUS_DELIVERED and order.paid_at is None:
+        # Cash on delivery: the payment is collected with the order
+        order.paid_at = now
+    order.save(update_fields=['status', 'paid_at', 'updated_at'])
+    OrderStatusHistory.objects.create(
+        order=order,
+        from_status=from_status,
+        to_status=to_status,
+        changed_at=now,
+        changed_by=user if user is not None and user.is_authenticated else None,
+        note=note[:255],
+    )
+    logger.info(f"Order {order.id} moved from {from_status} to {to_status}")
+    return order
+
+
+def mark_paid(order, note=''):
+    """
+    Record that `order` has been paid. Pending and failed orders move to paid; orders
+    already further along keep their status. Returns False if it was already paid.
+    """
+    if order.paid_at is not None:
+        return False
+    order.paid_at = timezone.now()
+    if can_transition(order.status, Order.STATUS_PAID):
+        transition(order, Order.STATUS_PAID, note)
+    else:
+        if order.status == Order.STATUS_CANCELLED:
+            logger.warning(f"Payment received for cancelled order {order.id}")
+        order.save(update_fields=['paid_at', 'updated_at'])
+    return True
+
+
+def flag_filter(flag):
+    """ Query filter for one of the legacy is_* flags: a parsed bool -> Q on the status column """
+    if flag == 'is_paid':
+        return lambda value: Q(paid_at__isnull=not value)
+    statuses = Order.FLAG_STATUSES[flag]
+    return lambda value: Q(status__in=statuses) if value else ~Q(status__in=statuses)
+
+
+def parse_statuses(value):
+    """ ?status=paid,confirmed -> ['paid', 'confirmed']; raises ValueError on unknown statuses """
+    statuses = [item.strip() for item in value.split(',') if item.strip()]
+    if not statuses or any(status not in STATUS_LABELS for status in statuses):
+        raise ValueError(value)
+    return statuses
+
+
+async def wait_for_status(order_id, since=None, timeout=STATUS_WAIT_MAX):
+    """
+    Wait until the order's status differs from `since` (the status the client last
+    saw; by default the status when the wait starts) or `timeout` seconds pass.
+    Returns {'order_id', 'status', 'is_paid', 'changed'}, or None for unknown orders.
+    Each check reads two columns by primary key, and the wait holds no worker thread.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        row = await Order.objects.filter(pk=order_id).values('status', 'paid_at').afirst()
+        if row is None:
+            return None
+        if since is None:
+            since = row['status']
+        remaining = deadline - loop.time()
+        if row['status'] != since or remaining <= 0:
+            break
+        await asyncio.sleep(min(STATUS_POLL_INTERVAL, remaining))
+    return {
+        'order_id': order_id,
+        'status': row['status'],
+        'is_paid': row['paid_at'] is not None,
+        'changed': row['status'] != since,
+    }
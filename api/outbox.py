@@ -0,0 +1,102 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+from .models import OutboxEmail
+from .work_queue import WorkQueue
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+
+MAX_ATTEMPTS = 8
+
+# Retry delays double from BACKOFF_BASE up to BACKOFF_MAX, with jitter
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=2)
+
+# A claimed email is retried if its worker has not finished it within this lease
+CLAIM_LEASE = timedelta(minutes=5)
+
+queue = WorkQueue(
+    OutboxEmail, MAX_ATTEMPTS, BACKOFF_BASE, BACKOFF_MAX, CLAIM_LEASE,
+    pending_status=OutboxEmail.STATUS_PENDING, failed_status=OutboxEmail.STATUS_FAILED,
+    describe=lambda email: f"Email {email.id} to {email.to_email}",
+)
+
+
+def enqueue_email(to_email, subject, plain_body, html_body, from_email=None):
+    """
+    Queue an email for the outbox worker. Called inside the caller's transaction,
+    so the email exists if and only if the business change it reports commits.
+    """
+    # Own savepoint: callers catch and log email errors without breaking their transaction
+    with transaction.atomic():
+        return OutboxEmail.objects.create(
+            to_email=to_email,
+            from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+            subject=subject[:255],
+            plain_body=plain_body,
+            html_body=html_body,
+        )
+
+
+def build_message(email, connection):
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.plain_body,
+        from_email=email.from_email,
+        to=[email.to_email],
+        connection=connection,
+    )
+    message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def send_batch(batch_size=BATCH_SIZE):
+    """ Deliver one batch of due emails over a single SMTP connection. Returns (sent, failed). """
+    emails = queue.claim(batch_size)
+    if not emails:
+        return 0, 0
+
+    sent = failed = 0
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        # Server unreachable: every email in the batch waits for its next attempt
+        now = timezone.now()
+        for email in emails:
+            queue.record_failure(email, e, now)
+        return 0, len(emails)
+
+    try:
+        for email in emails:
+            started = time.monotonic()
+            try:
+                connection.send_messages([build_message(email, connection)])
+            except Exception as e:
+                queue.record_failure(email, e)
+                failed += 1
+                continue
+            email.status = OutboxEmail.STATUS_SENT
+            email.attempts += 1
+            email.sent_at = timezone.now()
+            email.send_duration_ms = round((time.monotonic() - started) * 1000)
+            email.last_error = ''
+            email.save(update_fields=['status', 'attempts', 'sent_at', 'send_duration_ms', 'last_error'])
+            logger.info(
+                f"Email {email.id} sent to {email.to_email} in {email.send_duration_ms} ms, "
+                f"{(email.sent_at - email.created_at).total_seconds():.1f}s after it was queued"
+            )
+            sent += 1
+    finally:
+        try:
+            connection.close()
+        except Exception as e:
+            logger.warning(f"Error closing SMTP connection: {e}")
+    return sent, failed
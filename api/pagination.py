@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+
+
+class ProductSearchPagination(LimitOffsetPagination):
+    # Search results are ordered by relevance, so they page by offset
+    default_limit = 20
+    max_limit = 100
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    # Keyset pagination, newest first: constant cost per page however deep the table gets
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,39 @@
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from .models import Offer
+
+
+def active_offers(now=None):
+    now = now or timezone.now()
+    return Offer.objects.filter(is_active=True, start_date__lte=now, end_date__gte=now)
+
+
+def with_offer_prices(queryset, now=None):
+    """
+    Annotate products with the discount of their winning offer (the largest active
+    discount, oldest offer on ties) in the same query that loads them. The annotation
+    is read by Product.discounted_price / active_discount_percentage.
+    """
+    winning_offer = active_offers(now).filter(
+        products=OuterRef('pk')
+    ).order_by('-discount_percentage', 'id')
+    return queryset.annotate(
+        resolved_discount_percentage=Subquery(winning_offer.values('discount_percentage')[:1])
+    )
+
+
+def resolve_discounts(product_ids, now=None):
+    """ Winning discount percentage for many products in one query: {product_id: percentage} """
+    now = now or timezone.now()
+    rows = Offer.products.through.objects.filter(
+        product_id__in=product_ids,
+        offer__is_active=True,
+        offer__start_date__lte=now,
+        offer__end_date__gte=now,
+    ).values_list('product_id', 'offer__discount_percentage')
+
+    discounts = {}
+    for product_id, percentage in rows:
+        if percentage > discounts.get(product_id, 0):
+            discounts[product_id] = percentage
+    return discounts
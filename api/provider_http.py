@@ -0,0 +1,147 @@
+import random
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# (connect, read) seconds. Only 3 gunicorn workers serve the site, so a hung provider
+# must never hold one for long.
+DEFAULT_TIMEOUT = (3.05, 15)
+
+# Extra attempts for idempotent calls, with backoff RETRY_BACKOFF * 2**n plus jitter
+DEFAULT_RETRIES = 2
+RETRY_BACKOFF = 0.25
+
+# The breaker opens after this many consecutive failures and lets one trial call
+# through once BREAKER_RESET seconds have passed
+BREAKER_THRESHOLD = 5
+BREAKER_RESET = 30
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+
+class CircuitOpen(requests.RequestException):
+    """ The provider has been failing; the call was not attempted """
+
+
+class ProviderClient:
+    """
+    HTTP client for one payment provider, one per worker process: a pooled keep-alive
+    session, connect/read timeouts on every call, bounded retries with jitter for
+    idempotent calls and a circuit breaker that fails fast while the provider is down.
+
+    Each response carries `duration_ms`; `stats` counts calls, retries, failures,
+    short circuits and total milliseconds for this process.
+    """
+    def __init__(self, name, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 breaker_threshold=BREAKER_THRESHOLD, breaker_reset=BREAKER_RESET):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=10, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    # Circuit breaker
+
+    def allow_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.breaker_reset:
+                # Half open: let this call through as a trial, hold back the rest
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"{self.name} circuit closed")
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self.stats['failures'] += 1
+            if self._failures >= self.breaker_threshold:
+                if self._opened_at is None:
+                    logger.error(f"{self.name} circuit opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    # Requests
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """
+        Send one request. Idempotent calls (by default GET/HEAD/OPTIONS/PUT/DELETE) are
+        retried on connection errors, timeouts and 5xx responses. Other calls are
+        retried only on connect timeouts, so the provider never sees them twice. Raises CircuitOpen or the last requests exception.
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        kwargs.setdefault('timeout', self.timeout)
+        path = urlsplit(url).path
+
+        for attempt in range(self.retries + 1):
+            if not self.allow_request():
+                self.stats['short_circuits'] += 1
+                raise CircuitOpen(f"{self.name} is unavailable, not calling {method} {path}")
+
+            last_attempt = attempt == self.retries
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                elapsed = (time.monotonic() - started) * 1000
+                self.stats['calls'] += 1
+                self.stats['total_ms'] += elapsed
+                self.record_failure()
+                retryable = idempotent or isinstance(e, requests.ConnectTimeout)
+                logger.warning(f"{self.name} {method} {path} failed after {elapsed:.0f} ms (attempt {attempt + 1}): {e}")
+                if last_attempt or not retryable:
+                    raise
+                self.backoff(attempt)
+                continue
+
+            response.duration_ms = round((time.monotonic() - started) * 1000)
+            self.stats['calls'] += 1
+            self.stats['total_ms'] += response.duration_ms
+            logger.info(f"{self.name} {method} {path} -> {response.status_code} in {response.duration_ms} ms")
+            if response.status_code >= 500:
+                self.record_failure()
+                if idempotent and not last_attempt:
+                    response.close()
+                    self.backoff(attempt)
+                    continue
+            else:
+                self.record_success()
+            return response
+
+    def backoff(self, attempt):
+        self.stats['retries'] += 1
+        time.sleep(RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
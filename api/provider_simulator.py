@@ -0,0 +1,268 @@
+import json
+import random
+import secrets
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import requests
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+STK_PUSH_FIELDS = ('BusinessShortCode', 'Password', 'Timestamp', 'Amount', 'PhoneNumber', 'CallBackURL', 'AccountReference')
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    """ Routes one request to the ProviderSimulator serving it """
+    protocol_version = 'HTTP/1.1'
+
+    def handle_request(self):
+        simulator = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path = urlsplit(self.path).path
+        simulator.count('requests')
+        simulator.delay()
+        if random.random() < simulator.failure_rate:
+            simulator.count('injected_failures')
+            if path.startswith('/v1/'):
+                return self.reply(500, {'error': {'type': 'api_error', 'message': "Simulated Stripe failure"}})
+            return self.reply(503, {'requestId': secrets.token_hex(8), 'errorCode': '503.001.01', 'errorMessage': "Service Unavailable"})
+
+        if self.command == 'GET' and path == '/oauth/v1/generate':
+            return self.reply(200, simulator.issue_token())
+        if path.startswith('/mpesa/') and not simulator.token_valid(self.headers.get('Authorization', '')):
+            return self.reply(401, {'requestId': secrets.token_hex(8), 'errorCode': '404.001.04', 'errorMessage': "Invalid Access Token"})
+        if self.command == 'POST' and path == '/mpesa/stkpush/v1/processrequest':
+            return self.reply(*simulator.stk_push(self.json(body)))
+        if self.command == 'POST' and path == '/mpesa/stkpushquery/v1/query':
+            return self.reply(*simulator.stk_query(self.json(body)))
+        if path == '/v1/payment_intents' and self.command == 'POST':
+            form = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+            return self.reply(*simulator.create_intent(form, self.headers.get('Idempotency-Key')))
+        if path.startswith('/v1/payment_intents/'):
+            intent_id, _, action = path[len('/v1/payment_intents/'):].partition('/')
+            if self.command == 'GET' and not action:
+                return self.reply(*simulator.get_intent(intent_id))
+            if self.command == 'POST' and action == 'confirm':
+                return self.reply(*simulator.confirm_intent(intent_id))
+        return self.reply(404, {'errorMessage': f"No simulated endpoint for {self.command} {path}"})
+
+    do_GET = do_POST = handle_request
+
+    def json(self, body):
+        try:
+            return json.loads(body or b'{}')
+        except ValueError:
+            return {}
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out
+
+    def log_message(self, *args):
+        pass
+
+
+class ProviderSimulator(ThreadingHTTPServer):
+    """
+    A local stand-in for Daraja (OAuth, STK push, STK query and the callback to
+    CallBackURL) and Stripe's PaymentIntent endpoints, for end-to-end and load tests.
+    Point DARAJA_BASE_URL and STRIPE_API_BASE at it.
+
+    Every request waits about `latency` seconds and fails with probability
+    `failure_rate`. An STK push succeeds with probability `success_rate` (otherwise the
+    customer "cancels"); its callback is posted after about `callback_delay` seconds,
+    unless dropped with probability `callback_drop_rate`. `callback_url`, when set,
+    overrides the CallBackURL sent with the push.
+    """
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0, failure_rate=0, success_rate=1, callback_delay=1,
+                 callback_drop_rate=0, callback_url=None):
+        super().__init__(address, SimulatorHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.success_rate = success_rate
+        self.callback_delay = callback_delay
+        self.callback_drop_rate = callback_drop_rate
+        self.callback_url = callback_url
+        self.stats = Counter()
+        self.tokens = set()
+        self.pushes = {}
+        self.intents = {}
+        self.intent_keys = {}
+        self.callbacks = requests.Session()
+        self._lock = threading.Lock()
+        self._sequence = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """ Serve from a background thread (for tests) """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    def next_id(self, prefix):
+        with self._lock:
+            self._sequence += 1
+            return f"{prefix}{datetime.now():%d%m%Y%H%M%S}{self._sequence:06d}"
+
+    # Daraja
+
+    def issue_token(self):
+        token = secrets.token_urlsafe(24)
+        with self._lock:
+            self.tokens.add(token)
+        return {'access_token': token, 'expires_in': '3599'}
+
+    def token_valid(self, authorization):
+        scheme, _, token = authorization.partition(' ')
+        return scheme == 'Bearer' and token in self.tokens
+
+    def stk_push(self, data):
+        missing = [field for field in STK_PUSH_FIELDS if not data.get(field)]
+        if missing:
+            return 400, {'requestId': secrets.token_hex(8), 'errorCode': '400.002.02', 'errorMessage': f"Bad Request - Invalid {missing[0]}"}
+
+        checkout_request_id = self.next_id('ws_CO_')
+        merchant_request_id = f"{random.randint(10000, 99999)}-{random.randint(10000000, 99999999)}-1"
+        if random.random() < self.success_rate:
+            result = (0, "The service request is processed successfully.")
+        else:
+            result = (1032, "Request cancelled by user")
+        delay = self.callback_delay * random.uniform(0.5, 1.5)
+        push = {
+            'merchant_request_id': merchant_request_id,
+            'result': result,
+            'amount': data['Amount'],
+            'phone_number': data['PhoneNumber'],
+            'answered_at': time.monotonic() + delay,
+        }
+        with self._lock:
+            self.pushes[checkout_request_id] = push
+            self.stats['stk_pushes'] += 1
+
+        if random.random() < self.callback_drop_rate:
+            self.count('callbacks_dropped')
+        else:
+            timer = threading.Timer(delay, self.send_callback, (self.callback_url or data['CallBackURL'], checkout_request_id, push))
+            timer.daemon = True
+            timer.start()
+
+        return 200, {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            'ResponseCode': '0',
+            'ResponseDescription': "Success. Request accepted for processing",
+            'CustomerMessage': "Success. Request accepted for processing",
+        }
+
+    def callback_payload(self, checkout_request_id, push):
+        code, description = push['result']
+        callback = {
+            'MerchantRequestID': push['merchant_request_id'],
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': code,
+            'ResultDesc': description,
+        }
+        if code == 0:
+            callback['CallbackMetadata'] = {'Item': [
+                {'Name': 'Amount', 'Value': push['amount']},
+                {'Name': 'MpesaReceiptNumber', 'Value': 'S' + secrets.token_hex(5).upper()[:9]},
+                {'Name': 'TransactionDate', 'Value': int(f"{datetime.now():%Y%m%d%H%M%S}")},
+                {'Name': 'PhoneNumber', 'Value': int(push['phone_number'])},
+            ]}
+        return {'Body': {'stkCallback': callback}}
+
+    def send_callback(self, url, checkout_request_id, push):
+        try:
+            response = self.callbacks.post(url, json=self.callback_payload(checkout_request_id, push), timeout=10)
+            self.count('callbacks_sent')
+            if response.status_code != 200:
+                self.count('callbacks_rejected')
+                logger.warning(f"Callback for {checkout_request_id} got {response.status_code}")
+        except requests.RequestException as e:
+            self.count('callbacks_failed')
+            logger.warning(f"Callback for {checkout_request_id} to {url} failed: {e}")
+
+    def stk_query(self, data):
+        push = self.pushes.get(data.get('CheckoutRequestID'))
+        if push is None:
+            return 500, {'requestId': secrets.token_hex(8), 'errorCode': '500.001.1001', 'errorMessage': "The transaction is not found"}
+        if time.monotonic() < push['answered_at']:
+            return 500, {'requestId': secrets.token_hex(8), 'errorCode': '500.001.1001', 'errorMessage': "The transaction is being processed"}
+        code, description = push['result']
+        return 200, {
+            'ResponseCode': '0',
+            'ResponseDescription': "The service request has been accepted successsfully",
+            'MerchantRequestID': push['merchant_request_id'],
+            'CheckoutRequestID': data['CheckoutRequestID'],
+            'ResultCode': str(code),
+            'ResultDesc': description,
+        }
+
+    # Stripe
+
+    def create_intent(self, form, idempotency_key):
+        with self._lock:
+            if idempotency_key and idempotency_key in self.intent_keys:
+                return 200, self.intents[self.intent_keys[idempotency_key]]
+        if not form.get('amount') or not form.get('currency'):
+            return 400, {'error': {'type': 'invalid_request_error', 'message': "Missing required param: amount."}}
+        intent_id = 'pi_' + secrets.token_hex(12)
+        intent = {
+            'id': intent_id,
+            'object': 'payment_intent',
+            'amount': int(form['amount']),
+            'currency': form['currency'],
+            'status': 'requires_payment_method',
+            'client_secret': f"{intent_id}_secret_{secrets.token_hex(12)}",
+            'created': int(time.time()),
+            'livemode': False,
+        }
+        with self._lock:
+            self.intents[intent_id] = intent
+            if idempotency_key:
+                self.intent_keys[idempotency_key] = intent_id
+            self.stats['payment_intents'] += 1
+        return 200, intent
+
+    def get_intent(self, intent_id):
+        intent = self.intents.get(intent_id)
+        if intent is None:
+            return 404, {'error': {'type': 'invalid_request_error', 'message': f"No such payment_intent: '{intent_id}'"}}
+        return 200, intent
+
+    def confirm_intent(self, intent_id):
+        status, intent = self.get_intent(intent_id)
+        if status != 200:
+            return status, intent
+        with self._lock:
+            intent['status'] = 'succeeded' if random.random() < self.success_rate else 'requires_payment_method'
+        return 200, intent
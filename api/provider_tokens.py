@@ -0,0 +1,111 @@
+import time
+from collections import Counter
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import ProviderToken
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tokens are refreshed this long before they expire, so requests never carry a dying one
+REFRESH_AHEAD = timedelta(minutes=5)
+
+# How long one worker may hold the refresh lock, and how long the others wait for it
+# when they have no usable token at all
+REFRESH_LOCK_TIMEOUT = timedelta(seconds=30)
+REFRESH_WAIT = 10
+REFRESH_POLL_INTERVAL = 0.2
+
+# Per-process counters: memory_hits, shared_hits, stale_hits, refreshes, refresh_failures, lock_waits
+stats = Counter()
+
+
+class TokenUnavailable(Exception):
+    """ No valid token could be fetched from the provider """
+
+
+def usable(expires_at, now, margin=timedelta(0)):
+    return expires_at is not None and expires_at - margin > now
+
+
+def acquire_refresh_lock(provider, now):
+    """ Claim the refresh for `provider` with one conditional UPDATE; True for the winner """
+    try:
+        with transaction.atomic():
+            ProviderToken.objects.get_or_create(provider=provider)
+    except IntegrityError:
+        pass
+    return ProviderToken.objects.filter(provider=provider).filter(
+        Q(refresh_lock_until__isnull=True) | Q(refresh_lock_until__lte=now)
+    ).update(refresh_lock_until=now + REFRESH_LOCK_TIMEOUT) == 1
+
+
+def refresh(provider, fetch):
+    """ Fetch a new token while holding the lock and store it for every worker """
+    started = time.monotonic()
+    try:
+        token, expires_in = fetch()
+    except Exception:
+        stats['refresh_failures'] += 1
+        ProviderToken.objects.filter(provider=provider).update(refresh_lock_until=None)
+        raise
+    now = timezone.now()
+    ProviderToken.objects.filter(provider=provider).update(
+        access_token=token,
+        expires_at=now + timedelta(seconds=expires_in),
+        refreshed_at=now,
+        refresh_lock_until=None,
+    )
+    stats['refreshes'] += 1
+    logger.info(
+        f"{provider} token refreshed in {(time.monotonic() - started) * 1000:.0f} ms, valid {expires_in}s "
+        f"(this worker: {stats['memory_hits']} memory hits, {stats['shared_hits']} shared hits, {stats['refreshes']} refreshes)"
+    )
+    return token, now + timedelta(seconds=expires_in)
+
+
+def get_token(provider, fetch):
+    """
+    A valid access token for `provider`, shared by all workers through the database.
+    `fetch()` asks the provider for a new one and returns (token, expires_in_seconds).
+
+    A token close to expiry is refreshed by the one worker that wins the refresh lock;
+    the others keep using the current token meanwhile. Without any valid token, the
+    losers wait for the winner rather than all calling the provider at once.
+    Returns (token, expires_at); raises TokenUnavailable.
+    """
+    deadline = time.monotonic() + REFRESH_WAIT
+    while True:
+        now = timezone.now()
+        current = ProviderToken.objects.filter(provider=provider).values('access_token', 'expires_at').first()
+        has_token = current is not None and usable(current['expires_at'], now)
+        if has_token and usable(current['expires_at'], now, REFRESH_AHEAD):
+            stats['shared_hits'] += 1
+            return current['access_token'], current['expires_at']
+
+        if acquire_refresh_lock(provider, now):
+            try:
+                return refresh(provider, fetch)
+            except Exception as e:
+                if has_token:
+                    logger.warning(f"{provider} token refresh failed, using the current token: {e}")
+                    stats['stale_hits'] += 1
+                    return current['access_token'], current['expires_at']
+                raise TokenUnavailable(f"Could not fetch a {provider} token: {e}") from e
+
+        if has_token:
+            # Another worker is refreshing; the current token is still good
+            stats['stale_hits'] += 1
+            return current['access_token'], current['expires_at']
+        if time.monotonic() >= deadline:
+            raise TokenUnavailable(f"Timed out waiting for another worker to fetch the {provider} token")
+        stats['lock_waits'] += 1
+        time.sleep(REFRESH_POLL_INTERVAL)
+
+
+def invalidate(provider):
+    """ Drop the shared token, e.g. after the provider rejected it """
+    ProviderToken.objects.filter(provider=provider).update(access_token='', expires_at=None)
@@ -0,0 +1,218 @@
+import hashlib
+from datetime import timedelta
+from io import BytesIO
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+from .catalog_cache import bump_catalog_version
+from .models import RenditionJob
+from .work_queue import WorkQueue
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Target widths in pixels; sources are never upscaled
+RENDITION_WIDTHS = {'thumb': 320, 'medium': 960}
+
+# format -> (Pillow format, file extension, save options)
+RENDITION_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+RENDITION_DIR = 'renditions'
+
+# Models with an `image` upload and an `image_renditions` description of its renditions
+RENDITION_MODELS = ('Product', 'ProductImage', 'Services', 'ServiceImage', 'Gallery')
+
+BATCH_SIZE = 20
+
+MAX_ATTEMPTS = 5
+
+# A failed render is usually a storage hiccup or a file still being written, so retry
+# soon; the email backoff of up to two hours would leave pages without renditions
+BACKOFF_BASE = timedelta(seconds=10)
+BACKOFF_MAX = timedelta(minutes=10)
+
+# A claimed job is retried if its worker has not finished it within this lease
+CLAIM_LEASE = timedelta(minutes=10)
+
+# Jobs that run out of attempts are dropped; the next upload or backfill queues them again
+queue = WorkQueue(
+    RenditionJob, MAX_ATTEMPTS, BACKOFF_BASE, BACKOFF_MAX, CLAIM_LEASE,
+    describe=lambda job: f"Renditions for {job.model} #{job.object_id}",
+)
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def rendition_name(digest, width, extension):
+    # Same bytes always map to the same names, so files can be cached forever and shared
+    return f"{RENDITION_DIR}/{digest[:2]}/{digest}-{width}w.{extension}"
+
+
+def target_widths(source_width):
+    return sorted({min(width, source_width) for width in RENDITION_WIDTHS.values()})
+
+
+def encode(image, width, image_format):
+    pil_format, _, options = RENDITION_FORMATS[image_format]
+    if image.width > width:
+        height = round(image.height * width / image.width)
+        image = image.resize((width, height), Image.LANCZOS)
+
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no alpha channel: flatten transparent areas onto white
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+
+    buffer = BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def build_renditions(field_file):
+    """
+    Write the renditions of an uploaded image and return their description:
+    {"source", "width", "height", "webp": [[name, width], ...], "jpeg": [...]}.
+    """
+    with field_file.open('rb') as source:
+        data = source.read()
+
+    digest = content_hash(data)
+    with Image.open(BytesIO(data)) as opened:
+        image = ImageOps.exif_transpose(opened)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        image.load()
+
+    renditions = {'source': field_file.name, 'width': image.width, 'height': image.height}
+    for image_format, (_, extension, _) in RENDITION_FORMATS.items():
+        entries = []
+        for width in target_widths(image.width):
+            name = rendition_name(digest, width, extension)
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(encode(image, width, image_format)))
+            entries.append([name, width])
+        renditions[image_format] = entries
+    return renditions
+
+
+def is_current(instance):
+    if not instance.image:
+        return not instance.image_renditions
+    return instance.image_renditions.get('source') == instance.image.name
+
+
+def generate_for_instance(instance, force=False):
+    """ Build renditions for `instance.image` if they are missing or stale. Returns True when updated. """
+    if not force and is_current(instance):
+        return False
+
+    renditions = {}
+    if instance.image:
+        try:
+            renditions = build_renditions(instance.image)
+        except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+            logger.warning(f"Could not render {instance.image.name} for {instance._meta.label} #{instance.pk}: {e}")
+            return False
+
+    # update() so the catalog signals don't fire for every image; one bump below covers it
+    type(instance).objects.filter(pk=instance.pk).update(image_renditions=renditions)
+    instance.image_renditions = renditions
+    bump_catalog_version()
+    return True
+
+
+def queue_renditions(instances):
+    """
+    Queue rendition jobs for the instances (all of one model) whose renditions are
+    missing or stale, for the `run_renditions` worker. Runs in the caller's transaction,
+    so a job exists if and only if the image change commits.
+    """
+    if not getattr(settings, 'IMAGE_RENDITIONS_ON_UPLOAD', True):
+        return 0
+    return queue_jobs(instances)
+
+
+def queue_jobs(instances, force=False):
+    """
+    Queue jobs for the instances (all of one model) whose renditions are missing or
+    stale, or for all of them with `force`. Returns the number queued; two queries per call.
+    """
+    ids = [instance.pk for instance in instances if instance.pk and (force or not is_current(instance))]
+    if not ids:
+        return 0
+    model = type(instances[0]).__name__
+    now = timezone.now()
+    # Jobs already queued (maybe mid-render) run again for the new image
+    RenditionJob.objects.filter(model=model, object_id__in=ids).update(
+        queued_at=now, next_attempt_at=now, attempts=0, **({'force': True} if force else {}),
+    )
+    RenditionJob.objects.bulk_create(
+        [RenditionJob(model=model, object_id=pk, queued_at=now, next_attempt_at=now, force=force) for pk in ids],
+        ignore_conflicts=True,
+    )
+    return len(ids)
+
+
+def run_job(job):
+    model = apps.get_model('api', job.model)
+    instance = model.objects.only('pk', 'image', 'image_renditions').filter(pk=job.object_id).first()
+    if instance is not None:
+        generate_for_instance(instance, force=job.force)
+
+
+def process_batch(batch_size=BATCH_SIZE):
+    """ Build the renditions of one batch of queued images. Returns (done, failed). """
+    done = failed = 0
+    for job in queue.claim(batch_size):
+        try:
+            run_job(job)
+        except Exception as e:
+            queue.record_failure(job, e)
+            failed += 1
+            continue
+        # Unless the image was replaced meanwhile, which queued it again
+        RenditionJob.objects.filter(pk=job.pk, queued_at=job.queued_at).delete()
+        done += 1
+    return done, failed
+
+
+def rendition_models():
+    return [apps.get_model('api', name) for name in RENDITION_MODELS]
+
+
+def referenced_names():
+    names = set()
+    for model in rendition_models():
+        for renditions in model.objects.values_list('image_renditions', flat=True):
+            for image_format in RENDITION_FORMATS:
+                names.update(name for name, _ in (renditions or {}).get(image_format, ()))
+    return names
+
+
+def prune_unreferenced():
+    """ Delete rendition files no image points at any more. Returns the number removed. """
+    keep = referenced_names()
+    removed = 0
+    try:
+        shards, _ = default_storage.listdir(RENDITION_DIR)
+    except (FileNotFoundError, NotImplementedError):
+        return 0
+    for shard in shards:
+        _, files = default_storage.listdir(f"{RENDITION_DIR}/{shard}")
+        for filename in files:
+            name = f"{RENDITION_DIR}/{shard}/{filename}"
+            if name not in keep:
+                default_storage.delete(name)
+                removed += 1
+    return removed
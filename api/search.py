@@ -0,0 +1,122 @@
+import re
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from .models import Product
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# FTS5 virtual table keyed by product id (rowid), created in migration 0011
+SEARCH_TABLE = 'api_product_search'
+
+# bm25 column weights: name, description, category, car_models
+RANK_EXPRESSION = f'bm25({SEARCH_TABLE}, 10.0, 2.0, 4.0, 6.0)'
+
+MAX_QUERY_TERMS = 8
+
+# One row per product: its text fields plus every car model listed on its images
+INDEX_SQL = f"""
+    INSERT INTO {SEARCH_TABLE}(rowid, name, description, category, car_models)
+    SELECT p.id,
+           COALESCE(p.name, ''),
+           COALESCE(p.description, ''),
+           COALESCE(p.category, ''),
+           COALESCE((SELECT GROUP_CONCAT(REPLACE(i.car_models, ',', ' '), ' ')
+                     FROM api_productimage i WHERE i.product_id = p.id), '')
+    FROM api_product p
+"""
+
+
+def search_backend_available():
+    return connection.vendor == 'sqlite'
+
+
+def index_product(product_id):
+    """ Refresh the search row for a single product """
+    if not search_backend_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [product_id])
+        cursor.execute(INDEX_SQL + " WHERE p.id = %s", [product_id])
+
+
+def index_products(product_ids, batch_size=500):
+    """ Refresh the search rows for many products, a batch of ids per statement """
+    if not search_backend_available():
+        return
+    product_ids = list(product_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(product_ids), batch_size):
+            batch = product_ids[start:start + batch_size]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", batch)
+            cursor.execute(INDEX_SQL + f" WHERE p.id IN ({placeholders})", batch)
+
+
+def remove_product(product_id):
+    if not search_backend_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [product_id])
+
+
+def rebuild_index():
+    """ Rebuild the whole index from the product tables. Returns the number of indexed products. """
+    if not search_backend_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        cursor.execute(INDEX_SQL)
+        cursor.execute(f"SELECT COUNT(*) FROM {SEARCH_TABLE}")
+        count = cursor.fetchone()[0]
+    logger.info(f"Product search index rebuilt with {count} products")
+    return count
+
+
+def parse_query(query):
+    """ Split free text into search terms, dropping FTS5 operators and punctuation """
+    return re.findall(r'\w+', (query or '').lower())[:MAX_QUERY_TERMS]
+
+
+def build_match_expression(terms):
+    # Every term must match, and each one is treated as a prefix ("fiel" finds "Fielder")
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_products(query, queryset=None):
+    """
+    Ranked, prefix-aware product search over name, description, category and
+    the car models listed on product images.
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+
+    terms = parse_query(query)
+    if not terms:
+        return queryset.none()
+
+    if search_backend_available():
+        # Rank is looked up per matching row (FTS5 seeks by rowid), so filters and
+        # pagination on the queryset still run in SQL
+        match = build_match_expression(terms)
+        return queryset.filter(
+            pk__in=RawSQL(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", [match])
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT {RANK_EXPRESSION} FROM {SEARCH_TABLE} "
+                f"WHERE {SEARCH_TABLE} MATCH %s AND rowid = \"api_product\".\"id\"",
+                [match]
+            )
+        ).order_by('search_rank', 'id')
+
+    # Fallback for databases without FTS5: substring matching, every term required
+    for term in terms:
+        queryset = queryset.filter(
+            Q(name__icontains=term) |
+            Q(description__icontains=term) |
+            Q(category__icontains=term) |
+            Q(images__car_models__icontains=term)
+        )
+    return queryset.distinct().order_by('name')
@@ -1,27 +1,159 @@
 
+from django.core.files.storage import default_storage
+from django.db.models import F, Sum
 from rest_framework import serializers
-from .models import Services, Product, Order, Booking, Category, Cart, CartItem, OrderItem, Gallery, ContactMessage, ProductImage, ServiceImage
+from .models import Services, Product, Order, Booking, Category, Cart, CartItem, OrderItem, OrderStatusHistory, Gallery, ContactMessage, ProductImage, ServiceImage
+
+
+def split_param(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+def nested_names(names, prefix):
+    """ {"items.quantity", "items.product.name"}, "items" -> {"quantity", "product.name"} """
+    return {name[len(prefix) + 1:] for name in names if name.startswith(prefix + '.')}
+
+
+class SparseFieldsMixin:
+    """
+    Lets GET requests shape the response:
+
+      ?fields=id,name,items.quantity   only these fields (dotted names reach into nested objects)
+      ?expand=images,items.product     include nested relations
+      ?view=summary                    the serializer's `summary_fields`
+
+    In a sparse response, nested relations listed in `expandable_fields` are left out
+    (to-many) or collapsed to their primary key (to-one) unless expanded. Naming a
+    nested field in `fields` expands its parents. Without any of these parameters the
+    serializer renders in full.
+    """
+    expandable_fields = ()
+    summary_fields = ()
+    # Model columns needed by fields that are not columns themselves (properties, methods)
+    column_dependencies = {}
+
+    def get_sparse_spec(self):
+        """ (fields or None, expand) for this serializer, or None when rendering in full """
+        if hasattr(self, '_sparse_spec'):
+            return self._sparse_spec
+
+        is_root = self.parent is None or (
+            isinstance(self.parent, serializers.ListSerializer) and self.parent.parent is None
+        )
+        request = self.context.get('request')
+        if not is_root or request is None or request.method not in ('GET', 'HEAD'):
+            return None
+
+        params = request.query_params
+        fields = split_param(params.get('fields'))
+        expand = split_param(params.get('expand'))
+        if params.get('view') == 'summary' and not fields:
+            fields = set(self.summary_fields)
+        if not fields and not expand:
+            return None
+        return (fields or None, expand)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        spec = self.get_sparse_spec()
+        if spec is None:
+            return fields
+
+        wanted, expand = spec
+        # Dotted field names expand every parent on their path
+        for name in wanted or ():
+            parts = name.split('.')
+            expand = expand | {'.'.join(parts[:i]) for i in range(1, len(parts))}
+
+        for name in list(fields):
+            if wanted is not None and name not in wanted and name not in expand:
+                del fields[name]
+            elif name in self.expandable_fields and name not in expand:
+                field = fields.pop(name)
+                if not isinstance(field, serializers.ListSerializer):
+                    fields[name] = serializers.PrimaryKeyRelatedField(read_only=True, source=field.source)
+
+        # Hand the rest of the spec down to nested sparse serializers
+        for name, field in fields.items():
+            child = getattr(field, 'child', field)
+            if isinstance(child, SparseFieldsMixin):
+                child._sparse_spec = ((nested_names(wanted, name) or None) if wanted else None, nested_names(expand, name))
+        return fields
+
+    @property
+    def is_sparse(self):
+        return self.get_sparse_spec() is not None
+
+    def get_rendered_columns(self):
+        """ Model columns the rendered fields read, for QuerySet.only(); None when rendering in full """
+        if not self.is_sparse:
+            return None
+        concrete = {field.name for field in self.Meta.model._meta.concrete_fields}
+        columns = {'pk'}
+        for name, field in self.fields.items():
+            if field.write_only:
+                continue
+            source = field.source.split('.')[0]
+            if source in concrete:
+                columns.add(source)
+            columns.update(self.column_dependencies.get(name, ()))
+        return columns
+
+
+class ImageRenditionsField(serializers.Field):
+    """
+    Renders a model's `image_renditions` as srcset strings, e.g.
+    {"width": 3024, "height": 4032, "src": "<960w jpeg>", "srcset": {"webp": "<url> 320w, <url> 960w", "jpeg": "..."}}.
+    None until the renditions have been generated; clients then fall back to `image`.
+    """
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def url(self, name):
+        url = default_storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def to_representation(self, value):
+        if not value or not value.get('jpeg'):
+            return None
+        srcset = {
+            image_format: ', '.join(f"{self.url(name)} {width}w" for name, width in value[image_format])
+            for image_format in ('webp', 'jpeg') if value.get(image_format)
+        }
+        return {
+            'width': value['width'],
+            'height': value['height'],
+            'src': self.url(value['jpeg'][-1][0]),
+            'srcset': srcset,
+        }
+
+
+class GallerySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    image_renditions = ImageRenditionsField()
 
-
-class GallerySerializer(serializers.ModelSerializer):
     class Meta:
         model = Gallery
         fields = '__all__'
 
 
-class ServicesSerializer(serializers.ModelSerializer):
+class ServicesSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    image_renditions = ImageRenditionsField()
+
     class Meta:
         model = Services
         fields = '__all__'
 
-class ProductImageSerializer(serializers.ModelSerializer):
+class ProductImageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    image_renditions = ImageRenditionsField()
 
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'price', 'description', 'car_models', 'uploaded_at']
+        fields = ['id', 'image', 'image_renditions', 'price', 'description', 'car_models', 'uploaded_at']
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
@@ -30,51 +162,76 @@ class CategorySerializer(serializers.ModelSerializer):
 
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     discounted_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     discount_percentage = serializers.SerializerMethodField()
+    image_renditions = ImageRenditionsField()
+
+    expandable_fields = ('images',)
+    summary_fields = (
+        'id', 'name', 'price', 'discounted_price', 'discount_percentage', 'image', 'image_renditions',
+        'category', 'is_available', 'stock_quantity'
+    )
+    column_dependencies = {'discounted_price': ('price',)}
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'image', 'discounted_price', 'discount_percentage', 'category', 'images', 'created_at', 'updated_at', 'is_available', 'stock_quantity', 'is_active']
+        fields = ['id', 'name', 'description', 'price', 'image', 'image_renditions', 'discounted_price', 'discount_percentage', 'category', 'images', 'created_at', 'updated_at', 'is_available', 'stock_quantity', 'is_active']
 
     def get_discount_percentage(self, obj):
-        offer = obj.current_offer
-        if offer:
-            return offer.discount_percentage
-        return None
+        return obj.active_discount_percentage
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(), source='product', write_only=True
     )
+
+    expandable_fields = ('product',)
     class Meta:
         model = OrderItem
         fields = ['id', 'product', 'product_id', 'quantity', 'price_at_order']
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
+
+    expandable_fields = ('items',)
+    summary_fields = (
+        'id', 'full_name', 'total_price', 'created_at', 'payment_method', 'status', 'is_paid', 'is_pending',
+        'is_confirmed', 'is_out_for_delivery', 'is_delivered', 'is_cancelled', 'is_failed'
+    )
+    # The is_* flags are read-only views of status (is_paid of paid_at), see Order.FLAG_STATUSES
+    column_dependencies = {flag: ('status',) for flag in Order.FLAG_STATUSES}
+    column_dependencies['is_paid'] = ('paid_at',)
+
     class Meta:
         model = Order
         fields = [
             'id', 'items', 'total_price', 'created_at', 'updated_at', 'auto_part',
             'vehicle_model', 'vehicle_make', 'vehicle_year', 'full_name',
-            'phone_number', 'estate', 'street_address', 'is_delivered',
+            'phone_number', 'estate', 'street_address', 'status', 'paid_at', 'is_delivered',
             'is_paid', 'is_cancelled', 'is_completed', 'is_pending',
             'is_out_for_delivery', 'is_restored', 'is_failed', 'payment_method',
             'is_confirmed', 'description'
         ]
-        read_only_fields = ['total_price']
+        read_only_fields = ['total_price', 'status', 'paid_at']
 
 
-class BookingSerializer(serializers.ModelSerializer):
+class OrderStatusHistorySerializer(serializers.ModelSerializer):
+    changed_by = serializers.StringRelatedField()
+
+    class Meta:
+        model = OrderStatusHistory
+        fields = ['from_status', 'to_status', 'changed_at', 'changed_by', 'note']
+
+
+class BookingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Booking
         fields = '__all__'
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(), source='product', write_only=True
@@ -83,37 +240,52 @@ class CartItemSerializer(serializers.ModelSerializer):
         max_digits=10, decimal_places=2, source='total_price', read_only=True
     )
 
+    expandable_fields = ('product',)
+    summary_fields = ('id', 'product', 'quantity', 'sub_total')
+    column_dependencies = {'sub_total': ('product', 'quantity')}
+
     class Meta:
         model = CartItem
         fields = ['id', 'product', 'product_id', 'quantity', 'sub_total']
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     grand_total = serializers.SerializerMethodField()
 
+    expandable_fields = ('items',)
+
     class Meta:
         model = Cart
         fields = ['id', 'items', 'grand_total', 'created_at']
 
     def get_grand_total(self, obj):
-        return sum(item.total_price for item in obj.items.all())
+        if 'items' in getattr(obj, '_prefetched_objects_cache', {}):
+            return sum(item.total_price for item in obj.items.all())
+        # Responses that leave out the items skip their prefetch: one aggregate, not a query per item
+        return obj.items.aggregate(total=Sum(F('product__price') * F('quantity')))['total'] or 0
 
-class ContactMessageSerializer(serializers.ModelSerializer):
+class ContactMessageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ContactMessage
         fields = '__all__'
 
 
-class ServiceImageSerializer(serializers.ModelSerializer):
+class ServiceImageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    image_renditions = ImageRenditionsField()
+
     class Meta:
         model = ServiceImage
-        fields = ['id', 'image', 'image_type', 'service_type', 'price', 'description', 'uploaded_at']
+        fields = ['id', 'image', 'image_renditions', 'image_type', 'service_type', 'price', 'description', 'uploaded_at']
 
-class ServicesSerializer(serializers.ModelSerializer):
+class ServicesSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     images = ServiceImageSerializer(many=True, read_only=True)
+    image_renditions = ImageRenditionsField()
+
+    expandable_fields = ('images',)
+    summary_fields = ('id', 'name', 'price', 'image', 'image_renditions')
 
     class Meta:
         model = Services
-        fields = ['id', 'name', 'description', 'price', 'image', 'images', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'description', 'price', 'duration_minutes', 'bays', 'technicians', 'image', 'image_renditions', 'images', 'created_at', 'updated_at']
 
 
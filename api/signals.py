@@ -0,0 +1,105 @@
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Booking, Order, Product, ProductImage, Offer, Services, ServiceImage, Gallery
+from .analytics import booking_changed, order_changed
+from .availability import invalidate_availability, sync_slot_claim
+from .catalog_cache import invalidate_catalog
+from . import fitment, renditions, search
+
+
+# Keep the product search index in sync with the catalog
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, **kwargs):
+    search.index_product(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def reindex_product_images(sender, instance, **kwargs):
+    search.index_product(instance.product_id)
+
+
+# Fitment rows are derived from the image's car_models; deletes cascade
+@receiver(post_save, sender=ProductImage)
+def index_image_fitment(sender, instance, **kwargs):
+    fitment.index_image(instance)
+
+
+# Any change to what the public catalog endpoints render invalidates their snapshots
+CATALOG_MODELS = (Product, ProductImage, Offer, Services, ServiceImage, Gallery)
+
+
+def invalidate_catalog_snapshots(sender, **kwargs):
+    invalidate_catalog()
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(invalidate_catalog_snapshots, sender=model, dispatch_uid=f'catalog_save_{model.__name__}')
+    post_delete.connect(invalidate_catalog_snapshots, sender=model, dispatch_uid=f'catalog_delete_{model.__name__}')
+m2m_changed.connect(invalidate_catalog_snapshots, sender=Offer.products.through, dispatch_uid='catalog_offer_products')
+
+
+# Active bookings hold their slots; a save that would overbook raises IntegrityError
+@receiver(post_save, sender=Booking)
+def claim_booking_slot(sender, instance, **kwargs):
+    sync_slot_claim(instance)
+
+
+# Cached availability of a service is dropped whenever one of its bookings changes,
+# including the service a booking is moved away from
+@receiver(pre_save, sender=Booking)
+def remember_booking_service(sender, instance, update_fields=None, **kwargs):
+    instance._previous_services_id = None
+    if instance.pk and (update_fields is None or {'services', 'services_id'} & set(update_fields)):
+        instance._previous_services_id = Booking.objects.filter(pk=instance.pk).values_list('services_id', flat=True).first()
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def invalidate_booking_availability(sender, instance, **kwargs):
+    invalidate_availability(instance.services_id)
+    previous = getattr(instance, '_previous_services_id', None)
+    if previous and previous != instance.services_id:
+        invalidate_availability(previous)
+
+
+# ...and when the service's duration or capacity may have changed
+@receiver(post_save, sender=Services)
+def invalidate_service_availability(sender, instance, **kwargs):
+    invalidate_availability(instance.id)
+
+
+# Keep the daily report stats of the day a booking or order was created on current
+@receiver(post_save, sender=Booking)
+def roll_up_saved_booking(sender, instance, update_fields=None, **kwargs):
+    booking_changed(instance, update_fields)
+
+
+@receiver(post_delete, sender=Booking)
+def roll_up_deleted_booking(sender, instance, **kwargs):
+    booking_changed(instance)
+
+
+@receiver(post_save, sender=Order)
+def roll_up_saved_order(sender, instance, update_fields=None, **kwargs):
+    order_changed(instance, update_fields)
+
+
+@receiver(post_delete, sender=Order)
+def roll_up_deleted_order(sender, instance, **kwargs):
+    order_changed(instance)
+
+
+# Queue new uploads for the `run_renditions` worker; resizing a large photo is too slow
+# for the request. `generate_image_renditions` queues the rest.
+def render_uploaded_image(sender, instance, **kwargs):
+    renditions.queue_renditions([instance])
+
+
+for model in (Product, ProductImage, Services, ServiceImage, Gallery):
+    post_save.connect(render_uploaded_image, sender=model, dispatch_uid=f'renditions_{model.__name__}')
@@ -0,0 +1,192 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.lookups import GreaterThan, GreaterThanOrEqual
+from django.utils import timezone
+from .catalog_cache import invalidate_catalog
+from .models import OrderItem, Product, StockReservation
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_ADJUSTMENTS = 2000
+
+
+class StockConflict(Exception):
+    """ The stock changed between the check and the update; nothing was applied """
+
+
+def parse_adjustments(items):
+    """ [{"product_id", "delta"}, ...] -> {product_id: summed delta}; raises ValueError on bad input """
+    if not isinstance(items, list) or not items:
+        raise ValueError("Provide a non-empty list of adjustments")
+    if len(items) > MAX_ADJUSTMENTS:
+        raise ValueError(f"At most {MAX_ADJUSTMENTS} adjustments per request")
+
+    deltas = defaultdict(int)
+    for index, item in enumerate(items):
+        try:
+            product_id, delta = int(item['product_id']), int(item['delta'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Adjustment {index}: needs integer product_id and delta")
+        deltas[product_id] += delta
+    return dict(deltas)
+
+
+def delta_expression(deltas):
+    return Case(
+        *[When(pk=product_id, then=Value(delta)) for product_id, delta in deltas.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def apply_stock_deltas(deltas):
+    """
+    Add each delta to its product's stock in one UPDATE, recomputing is_available in
+    SQL. Rows the delta would take below zero are left alone. Returns the number of
+    rows updated.
+    """
+    if not deltas:
+        return 0
+    new_stock = F('stock_quantity') + delta_expression(deltas)
+    return Product.objects.filter(
+        GreaterThanOrEqual(new_stock, 0), pk__in=deltas.keys()
+    ).update(
+        stock_quantity=new_stock,
+        is_available=GreaterThan(new_stock, 0),
+    )
+
+
+def adjust_stock(deltas, partial=False):
+    """
+    Apply {product_id: delta} stock adjustments in one transaction: one locking read
+    and one UPDATE, whatever the number of products.
+
+    Adjustments for unknown products, or that would leave negative stock, are
+    reported in `rejected`. Unless `partial` is set, any rejection means nothing
+    is applied.
+    """
+    with transaction.atomic():
+        current = dict(
+            Product.objects.select_for_update().filter(pk__in=deltas.keys()).values_list('pk', 'stock_quantity')
+        )
+
+        rejected = []
+        for product_id, delta in deltas.items():
+            if product_id not in current:
+                rejected.append({'product_id': product_id, 'delta': delta, 'error': "Product not found"})
+            elif current[product_id] + delta < 0:
+                rejected.append({
+                    'product_id': product_id,
+                    'delta': delta,
+                    'stock_quantity': current[product_id],
+                    'error': "Stock would go negative",
+                })
+
+        applied = {} if rejected and not partial else {
+            product_id: delta for product_id, delta in deltas.items()
+            if product_id in current and current[product_id] + delta >= 0
+        }
+        if applied:
+            if apply_stock_deltas(applied) != len(applied):
+                raise StockConflict("Stock changed while adjusting; retry the request")
+            invalidate_catalog()
+
+    logger.info(f"Stock adjusted for {len(applied)} products, {len(rejected)} rejected")
+    return {
+        'applied': [
+            {'product_id': product_id, 'delta': delta, 'stock_quantity': current[product_id] + delta}
+            for product_id, delta in applied.items()
+        ],
+        'rejected': rejected,
+    }
+
+
+# Reservations: unpaid orders hold their quantities for STOCK_RESERVATION_MINUTES.
+# Stock available to new orders is on-hand stock minus the holds that have not expired.
+
+def active_holds(product_ids, now=None):
+    """ {product_id: quantity held by unexpired reservations} """
+    now = now or timezone.now()
+    return dict(
+        StockReservation.objects.filter(
+            product_id__in=product_ids, expires_at__gt=now
+        ).values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+    )
+
+
+def reserve_stock(order, demand, now=None):
+    """ Hold {product_id: quantity} for `order`; the caller has checked availability under lock """
+    expires_at = (now or timezone.now()) + timedelta(minutes=settings.STOCK_RESERVATION_MINUTES)
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for product_id, quantity in demand.items()
+    ])
+
+
+def hold_order_stock(order, now=None):
+    """
+    Make sure an unpaid order holds its stock before a payment attempt starts. An order
+    whose holds were released (a failed payment) or have expired holds them again if the
+    stock is still free. Returns the names of products without enough stock left, in
+    which case nothing is held.
+    """
+    now = now or timezone.now()
+    if StockReservation.objects.filter(order=order, expires_at__gt=now).exists():
+        return []
+    demand = dict(
+        OrderItem.objects.filter(order=order).values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+    )
+    with transaction.atomic():
+        # Locked in id order, like create_order, so the two cannot deadlock
+        products = Product.objects.select_for_update().filter(pk__in=demand.keys()).order_by('pk')
+        StockReservation.objects.filter(order=order).delete()
+        holds = active_holds(list(demand), now)
+        shortages = [product.name for product in products if not product.has_stock(demand[product.pk] + holds.get(product.pk, 0))]
+        if not shortages:
+            reserve_stock(order, demand, now)
+    return shortages
+
+
+def release_reservations(order):
+    return StockReservation.objects.filter(order=order).delete()[0]
+
+
+def convert_reservations(order):
+    """
+    The order is paid: deduct its quantities from on-hand stock and drop its holds,
+    expired or not. Returns the ids of products without enough stock left, which
+    are not deducted.
+    """
+    demand = dict(
+        OrderItem.objects.filter(order=order).values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+    )
+    with transaction.atomic():
+        current = dict(
+            Product.objects.select_for_update().filter(pk__in=demand.keys()).order_by('pk').values_list('pk', 'stock_quantity')
+        )
+        shortages = [product_id for product_id, quantity in demand.items() if current.get(product_id, 0) < quantity]
+        deltas = {product_id: -quantity for product_id, quantity in demand.items() if product_id not in shortages}
+        if deltas:
+            apply_stock_deltas(deltas)
+            invalidate_catalog()
+        release_reservations(order)
+    return shortages
+
+
+def release_expired_reservations(batch_size=500, now=None):
+    """ Delete expired holds a batch at a time, so the write lock is never held for long. Returns the count. """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        ids = list(StockReservation.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        released += StockReservation.objects.filter(pk__in=ids).delete()[0]
+    if released:
+        logger.info(f"Released {released} expired stock reservations")
+    return released
@@ -0,0 +1,96 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from api.analytics import bookings_by_status, orders_by_paid
+from api.models import Booking, BookingDailyStat, Order, OrderDailyStat, Services
+from api.order_status import mark_paid
+
+
+class RollupSignalTest(TestCase):
+    def setUp(self):
+        self.service = Services.objects.create(name="Tint", description="Tint", price=5000, image='services/t.jpg')
+
+    def book(self, status='pending'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Booking.objects.create(services=self.service, total_price=5000, status=status)
+
+    def test_booking_changes_move_counts_between_statuses(self):
+        booking = self.book()
+        self.book(status='completed')
+        self.assertEqual(bookings_by_status(), {'pending': (1, Decimal('5000')), 'completed': (1, Decimal('5000'))})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.status = 'completed'
+            booking.save(update_fields=['status'])
+        self.assertEqual(bookings_by_status(), {'completed': (2, Decimal('10000'))})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.delete()
+        self.assertEqual(BookingDailyStat.objects.get().count, 1)
+
+    def test_payment_moves_an_order_to_paid(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(total_price=250, payment_method='M-Pesa')
+        self.assertEqual(orders_by_paid(), {False: (1, Decimal('250'))})
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_paid(order)
+        self.assertEqual(orders_by_paid(), {True: (1, Decimal('250'))})
+
+    def test_unrelated_saves_skip_the_refresh(self):
+        booking = self.book()
+        with patch('api.analytics.rollup_bookings') as rollup, self.captureOnCommitCallbacks(execute=True):
+            booking.full_name = "Jane"
+            booking.save(update_fields=['full_name'])
+        rollup.assert_not_called()
+
+
+class BookingReportTest(TestCase):
+    def setUp(self):
+        self.service = Services.objects.create(name="Tint", description="Tint", price=5000, image='services/t.jpg')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pass'))
+        # Tuesday 2026-03-03 and Thursday 2026-03-05 fall in one week, 2026-04-01 in another month
+        for day, status, price in [(date(2026, 3, 3), 'completed', 1000), (date(2026, 3, 3), 'pending', 2000),
+                                   (date(2026, 3, 5), 'completed', 3000), (date(2026, 4, 1), 'cancelled', 4000)]:
+            booking = Booking.objects.create(services=self.service, total_price=price, status=status)
+            Booking.objects.filter(pk=booking.pk).update(
+                created_at=timezone.make_aware(datetime.combine(day, time(12))),
+            )
+        # The bulk update bypasses the signals; the backfill picks such changes up
+        call_command('rollup_analytics', all=True, stdout=StringIO())
+
+    def get(self, path, **params):
+        response = self.client.get(f'/api/bookings/{path}/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_periods_are_derived_from_daily_stats(self):
+        self.assertEqual(self.get('daily'), [
+            {'day': '2026-03-03', 'count': 2}, {'day': '2026-03-05', 'count': 1}, {'day': '2026-04-01', 'count': 1},
+        ])
+        self.assertEqual(self.get('weekly'), [{'week': '2026-03-02', 'count': 3}, {'week': '2026-03-30', 'count': 1}])
+        self.assertEqual(self.get('monthly', start='2026-03-04'), [
+            {'month': '2026-03-01', 'count': 1}, {'month': '2026-04-01', 'count': 1},
+        ])
+
+    def test_summary_and_revenue_take_a_range(self):
+        self.assertEqual(self.get('summary'), {
+            'total_bookings': 4, 'pending': 1, 'confirmed': 0, 'completed': 2, 'cancelled': 1,
+        })
+        self.assertEqual(self.get('summary', end='2026-03-03')['total_bookings'], 2)
+        self.assertEqual(Decimal(self.get('revenue')['completed_booking_revenue']), 4000)
+        self.assertEqual(Decimal(self.get('revenue', start='2026-03-04', end='2026-03-31')['completed_booking_revenue']), 3000)
+
+    def test_rejects_bad_ranges(self):
+        self.assertEqual(self.client.get('/api/bookings/daily/', {'start': 'March'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/bookings/summary/', {'start': '2026-03-05', 'end': '2026-03-01'}).status_code, 400)
+
+    def test_backfill_replaces_the_days_it_covers(self):
+        OrderDailyStat.objects.create(date=date(2026, 3, 3), paid=True, count=9, revenue=9)
+        call_command('rollup_analytics', since='2026-03-01', stdout=StringIO())
+        self.assertFalse(OrderDailyStat.objects.exists())
+        self.assertEqual(BookingDailyStat.objects.filter(date__gte='2026-03-01').count(), 4)
@@ -0,0 +1,194 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import time, timedelta
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections
+from django.test import Client, TestCase, TransactionTestCase
+from django.utils import timezone
+from api.availability import IntervalIndex
+from api.models import Booking, BookingSlot, Services
+
+
+class BookingAvailabilityTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = Services.objects.create(name="Tint", description="Tint", price=5000, image='services/t.jpg')
+        self.other = Services.objects.create(name="Wrap", description="Wrap", price=9000, image='services/w.jpg')
+        self.day = timezone.localdate() + timedelta(days=1)
+
+    def book(self, day, hour, service=None, status='pending'):
+        return Booking.objects.create(
+            services=service or self.service, total_price=5000, booking_date=day, booking_time=time(hour), status=status,
+        )
+
+    def grid(self, **params):
+        return self.client.get('/api/bookings/availability/', {'service': self.service.id, **params})
+
+    def test_grid_marks_slots_held_by_active_bookings(self):
+        self.book(self.day, 10)
+        self.book(self.day, 11, status='cancelled')
+        self.book(self.day + timedelta(days=1), 9, status='confirmed')
+        self.book(self.day, 12, service=self.other)
+
+        data = self.grid(start=self.day.isoformat(), days=3).json()
+        self.assertEqual(data['slots'][:3], ['09:00', '10:00', '11:00'])
+        self.assertEqual(list(data['days'].values()), ['10111111111', '01111111111', '11111111111'])
+
+    def test_days_are_cached_until_a_booking_changes(self):
+        self.grid(start=self.day.isoformat(), days=7)
+        with self.assertNumQueries(1):  # the service lookup only
+            self.grid(start=self.day.isoformat(), days=7)
+
+        # An overlapping range only reads the days not cached yet, in one query
+        with self.assertNumQueries(2):
+            self.grid(start=(self.day + timedelta(days=5)).isoformat(), days=7)
+
+        booking = self.book(self.day, 9)
+        self.assertEqual(self.grid(start=self.day.isoformat(), days=1).json()['days'][self.day.isoformat()][0], '0')
+        booking.status = 'cancelled'
+        booking.save()
+        self.assertEqual(self.grid(start=self.day.isoformat(), days=1).json()['days'][self.day.isoformat()][0], '1')
+
+    def test_moving_a_booking_frees_the_old_service(self):
+        booking = self.book(self.day, 9)
+        self.assertEqual(self.grid(start=self.day.isoformat(), days=1).json()['days'][self.day.isoformat()][0], '0')
+
+        booking.services = self.other
+        booking.save()
+        self.assertEqual(self.grid(start=self.day.isoformat(), days=1).json()['days'][self.day.isoformat()][0], '1')
+
+    def test_past_days_are_closed(self):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        data = self.grid(start=yesterday.isoformat(), end=self.day.isoformat()).json()
+        self.assertEqual(list(data['days'].values())[0], '0' * len(data['slots']))
+        self.assertEqual(len(data['days']), 3)
+
+    def test_rejects_bad_ranges(self):
+        self.assertEqual(self.grid(days=32).status_code, 400)
+        self.assertEqual(self.grid(start=self.day.isoformat(), end=(self.day - timedelta(days=1)).isoformat()).status_code, 400)
+        self.assertEqual(self.grid(start='tomorrow').status_code, 400)
+        self.assertEqual(self.client.get('/api/bookings/availability/').status_code, 400)
+        self.assertEqual(self.client.get('/api/bookings/availability/', {'service': 999}).status_code, 404)
+
+
+class SlotClaimTest(TestCase):
+    def setUp(self):
+        self.service = Services.objects.create(name="Tint", description="Tint", price=5000, image='services/t.jpg')
+        self.day = timezone.localdate() + timedelta(days=3)
+
+    def request_booking(self, hour=10):
+        return self.client.post('/api/bookings/create/', {
+            'services': self.service.id, 'booking_date': self.day.isoformat(), 'booking_time': f'{hour:02d}:00',
+            'full_name': "Jane",
+        }, content_type='application/json')
+
+    def test_taken_slot_is_rejected_and_freed_by_cancelling(self):
+        self.assertEqual(self.request_booking().status_code, 201)
+        response = self.request_booking()
+        self.assertEqual((response.status_code, response.json()['error']), (400, "This time slot is already booked."))
+        self.assertEqual(Booking.objects.count(), 1)
+
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_login(admin)
+        booking = Booking.objects.get()
+        self.assertEqual(self.client.post(f'/api/bookings/{booking.id}/cancel/').status_code, 200)
+        self.assertFalse(BookingSlot.objects.exists())
+        self.assertEqual(self.request_booking().status_code, 201)
+
+    def test_moving_a_booking_moves_its_claim(self):
+        booking = Booking.objects.create(services=self.service, total_price=5000, booking_date=self.day, booking_time=time(10))
+        booking.booking_time = time(11)
+        booking.save()
+        self.assertEqual(list(BookingSlot.objects.values_list('time', flat=True)), [time(11)])
+        self.assertEqual(self.request_booking(10).status_code, 201)
+
+
+class IntervalIndexTest(TestCase):
+    def test_max_load_over_overlapping_intervals(self):
+        index = IntervalIndex()
+        index.add(540, 660)          # 09:00-11:00
+        index.add(600, 720, 2)       # 10:00-12:00, twice
+        index.add(1380, 1500)        # 23:00 past midnight is clipped
+        self.assertEqual(index.max_load(540, 600), 1)
+        self.assertEqual(index.max_load(630, 631), 3)
+        self.assertEqual(index.max_load(660, 720), 2)
+        self.assertEqual(index.max_load(720, 780), 0)
+        self.assertEqual(index.max_load(1439, 1440), 1)
+
+
+class CapacityTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = Services.objects.create(
+            name="Wrap", description="Wrap", price=50000, image='services/w.jpg', duration_minutes=120, bays=2, technicians=3,
+        )
+        self.day = timezone.localdate() + timedelta(days=3)
+
+    def request_booking(self, at):
+        return self.client.post('/api/bookings/create/', {
+            'services': self.service.id, 'booking_date': self.day.isoformat(), 'booking_time': at,
+        }, content_type='application/json')
+
+    def row(self):
+        return self.client.get('/api/bookings/availability/', {
+            'service': self.service.id, 'start': self.day.isoformat(), 'days': 1,
+        }).json()['days'][self.day.isoformat()]
+
+    def test_bookings_hold_a_unit_for_their_duration(self):
+        self.assertEqual(self.row(), '11111111110')  # a 20:00 start would run past closing
+        self.assertEqual(self.request_booking('10:00').status_code, 201)
+        self.assertEqual(self.request_booking('11:00').status_code, 201)
+        # Both bays are busy from 11:00 to 12:00, so nothing can start at 10:00 or 11:00
+        self.assertEqual(self.row(), '10011111110')
+        response = self.request_booking('10:00')
+        self.assertEqual((response.status_code, response.json()['error']), (400, "This time slot is already booked."))
+        self.assertEqual(self.request_booking('12:00').status_code, 201)
+        self.assertEqual(
+            sorted(BookingSlot.objects.values_list('time', 'unit')),
+            [(time(10), 0), (time(11), 0), (time(11), 1), (time(12), 0), (time(12), 1), (time(13), 0)],
+        )
+
+    def test_capacity_is_the_scarcer_resource(self):
+        self.service.technicians = 1
+        self.service.save()
+        self.assertEqual(self.request_booking('09:00').status_code, 201)
+        self.assertEqual(self.row(), '00111111110')
+
+    def test_rejects_times_off_the_grid_or_past_closing(self):
+        self.assertEqual(self.request_booking('10:30').status_code, 400)
+        self.assertEqual(self.request_booking('20:00').status_code, 400)
+        self.assertFalse(Booking.objects.exists())
+
+
+class ConcurrentSlotClaimTest(TransactionTestCase):
+    """ Many requests at once, each on its own connection, as under gunicorn """
+
+    def setUp(self):
+        self.service = Services.objects.create(name="Tint", description="Tint", price=5000, image='services/t.jpg')
+        self.day = timezone.localdate() + timedelta(days=3)
+
+    def hammer(self, hours):
+        barrier = threading.Barrier(len(hours))
+
+        def book(hour):
+            try:
+                barrier.wait()
+                return Client().post('/api/bookings/create/', {
+                    'services': self.service.id, 'booking_date': self.day.isoformat(), 'booking_time': f'{hour:02d}:00',
+                }, content_type='application/json').status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=len(hours)) as pool:
+            return list(pool.map(book, hours))
+
+    def test_only_one_request_gets_a_contested_slot(self):
+        codes = self.hammer([10] * 8)
+        self.assertEqual((codes.count(201), codes.count(400)), (1, 7))
+        self.assertEqual(Booking.objects.filter(booking_time=time(10)).count(), 1)
+
+    def test_different_slots_all_succeed(self):
+        hours = [9, 10, 11, 12, 14, 15, 16, 17]
+        self.assertEqual(self.hammer(hours), [201] * len(hours))
+        self.assertEqual(BookingSlot.objects.count(), len(hours))
@@ -0,0 +1,84 @@
+from datetime import timedelta
+from unittest.mock import patch
+from django.core.cache import cache
+from django.test import TestCase, Client
+from django.utils import timezone
+from api.models import Gallery, Offer, Product, ProductImage
+from api.catalog_cache import get_catalog_version
+
+
+class CatalogSnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.product = Product.objects.create(name="Wiper Blade", price=1000, stock_quantity=3)
+
+    def test_repeat_request_with_etag_gets_304_without_queries(self):
+        first = self.client.get('/api/products/')
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], etag)
+
+    def test_snapshot_is_served_without_queries(self):
+        body = self.client.get('/api/gallery/').content
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/gallery/').content, body)
+
+    def test_catalog_changes_invalidate_snapshots(self):
+        etag = self.client.get('/api/products/')['ETag']
+
+        ProductImage.objects.create(product=self.product, image='products/w.jpg')
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results'][0]['images']), 1)
+
+    def test_offer_membership_change_invalidates(self):
+        now = timezone.now()
+        offer = Offer.objects.create(
+            name="Sale", discount_percentage=10,
+            start_date=now - timedelta(days=1), end_date=now + timedelta(days=1)
+        )
+        self.client.get('/api/products/')
+        offer.products.add(self.product)
+        data = self.client.get('/api/products/').json()
+        self.assertEqual(data['results'][0]['discounted_price'], '900.00')
+
+    def test_version_rolls_over_at_offer_boundary(self):
+        now = timezone.now()
+        Offer.objects.create(
+            name="Flash", discount_percentage=10,
+            start_date=now + timedelta(seconds=30), end_date=now + timedelta(days=1)
+        )
+        version = get_catalog_version()
+        self.assertEqual(get_catalog_version(), version)
+        with patch('api.catalog_cache.timezone.now', return_value=now + timedelta(minutes=1)):
+            self.assertNotEqual(get_catalog_version(), version)
+
+    def test_unrelated_writes_keep_snapshot(self):
+        version = get_catalog_version()
+        self.client.post('/api/contact/', {'name': 'A', 'phone_number': '0700', 'subject': 'Hi', 'message': 'Hello'})
+        self.assertEqual(get_catalog_version(), version)
+
+    def test_gallery_query_strings_are_cached_separately(self):
+        Gallery.objects.create(title="Tint job", image='gallery/a.jpg', category='Tinting')
+        Gallery.objects.create(title="Wrap job", image='gallery/b.jpg', category='Wrapping')
+        all_items = self.client.get('/api/gallery/').json()['results']
+        tinting = self.client.get('/api/gallery/', {'category': 'Tinting'}).json()['results']
+        self.assertEqual(len(all_items), 2)
+        self.assertEqual([item['title'] for item in tinting], ["Tint job"])
+
+    def test_each_host_and_scheme_gets_its_own_snapshot(self):
+        ProductImage.objects.create(product=self.product, image='products/w.jpg')
+        plain = self.client.get('/api/products/', HTTP_HOST='shop.example.com')
+        secure = self.client.get('/api/products/', HTTP_HOST='shop.example.com', secure=True)
+        other = self.client.get('/api/products/', HTTP_HOST='www.example.com', HTTP_IF_NONE_MATCH=plain['ETag'])
+
+        self.assertTrue(plain.json()['results'][0]['images'][0]['image'].startswith('http://shop.example.com/'))
+        self.assertTrue(secure.json()['results'][0]['images'][0]['image'].startswith('https://shop.example.com/'))
+        self.assertNotEqual(plain['ETag'], secure['ETag'])
+        self.assertEqual(other.status_code, 200)
+        self.assertTrue(other.json()['results'][0]['images'][0]['image'].startswith('http://www.example.com/'))
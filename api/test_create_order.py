@@ -0,0 +1,151 @@
+from datetime import timedelta
+from unittest.mock import patch
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from api.models import Order, Payment, Product, StockReservation
+from api.mpesa_inbox import process_batch
+from api.stock import release_expired_reservations
+
+
+class CreateOrderTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.products = [Product.objects.create(name=f"Part {i}", price=100, stock_quantity=5) for i in range(10)]
+
+    def place(self, items, payment_method='Delivery'):
+        return self.client.post('/api/orders/create/', {
+            'items': items,
+            'payment_method': payment_method,
+            'full_name': "Jane",
+        }, format='json')
+
+    def test_query_count_does_not_grow_with_lines(self):
+        counts = []
+        for products in (self.products[:1], self.products):
+            with CaptureQueriesContext(connection) as captured:
+                response = self.place([{'product_id': p.id, 'quantity': 1} for p in products])
+            self.assertEqual(response.status_code, 201)
+            counts.append(len(captured))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_delivery_order_deducts_stock_per_product(self):
+        first, second = self.products[:2]
+        response = self.place([
+            {'product_id': first.id, 'quantity': 2},
+            {'product_id': second.id, 'quantity': 5},
+            {'product_id': first.id, 'quantity': 1},
+        ])
+        self.assertEqual(response.status_code, 201)
+
+        order = Order.objects.get(id=response.json()['order_id'])
+        self.assertEqual(order.items.count(), 3)
+        self.assertEqual(order.total_price, 800)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.stock_quantity, first.is_available), (2, True))
+        self.assertEqual((second.stock_quantity, second.is_available), (0, False))
+
+    def test_repeated_lines_are_checked_against_stock_together(self):
+        product = self.products[0]
+        response = self.place([{'product_id': product.id, 'quantity': 3}, {'product_id': product.id, 'quantity': 3}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Not enough stock", response.json()['error'])
+        self.assertFalse(Order.objects.exists())
+
+    def test_mpesa_order_leaves_stock_for_the_payment_callback(self):
+        product = self.products[0]
+        self.assertEqual(self.place([{'product_id': product.id, 'quantity': 2}], 'M-Pesa').status_code, 201)
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 5)
+
+    def test_unknown_product_is_not_found(self):
+        response = self.place([{'product_id': self.products[0].id}, {'product_id': 999}])
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Order.objects.exists())
+
+
+class StockReservationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = Product.objects.create(name="Last Units", price=100, stock_quantity=3)
+
+    def place(self, quantity):
+        return self.client.post('/api/orders/create/', {
+            'items': [{'product_id': self.product.id, 'quantity': quantity}],
+            'payment_method': 'M-Pesa',
+        }, format='json')
+
+    def callback(self, order_id, result_code):
+        Payment.objects.create(order_id=order_id, transaction_id=f'ws_CO_{order_id}', payment_method='M-Pesa', amount=100)
+        body = {'Body': {'stkCallback': {'CheckoutRequestID': f'ws_CO_{order_id}', 'ResultCode': result_code, 'ResultDesc': ''}}}
+        response = self.client.post('/api/payment/mpesa/callback/', body, format='json')
+        process_batch()
+        return response
+
+    def test_unpaid_orders_hold_stock(self):
+        self.assertEqual(self.place(2).status_code, 201)
+        response = self.place(2)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Not enough stock", response.json()['error'])
+        self.assertEqual(self.place(1).status_code, 201)
+
+    def test_expired_holds_are_ignored_and_swept(self):
+        self.place(3)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.place(3).status_code, 201)
+
+        self.assertEqual(release_expired_reservations(batch_size=1), 1)
+        self.assertEqual(StockReservation.objects.count(), 1)
+
+    def test_paid_callback_converts_holds_to_deductions(self):
+        order_id = self.place(2).json()['order_id']
+        self.assertEqual(self.callback(order_id, 0).status_code, 200)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 1)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(self.place(1).status_code, 201)
+
+    def test_failed_callback_releases_holds(self):
+        order_id = self.place(3).json()['order_id']
+        self.callback(order_id, 1032)
+
+        self.assertFalse(StockReservation.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 3)
+
+    @patch('api.utils.MpesaClient.stk_push')
+    def test_retry_after_failure_holds_stock_again(self, mock_stk_push):
+        mock_stk_push.return_value = {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_retry', 'CustomerMessage': 'Sent'}
+        order_id = self.place(2).json()['order_id']
+        self.callback(order_id, 1032)
+        self.assertEqual(Order.objects.get(pk=order_id).status, Order.STATUS_FAILED)
+
+        # Retrying the payment holds the 2 units again, so a competing order only gets 1
+        retry = self.client.post(f'/api/payment/mpesa/initiate/{order_id}/', {'phone_number': '0700000000'}, format='json')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(self.place(2).status_code, 400)
+        competing = self.place(1).json()['order_id']
+
+        self.client.post('/api/payment/mpesa/callback/', {'Body': {'stkCallback': {
+            'CheckoutRequestID': 'ws_CO_retry', 'ResultCode': 0, 'ResultDesc': 'Processed',
+        }}}, format='json')
+        process_batch()
+        self.assertTrue(Order.objects.get(pk=order_id).is_paid)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 1)
+        self.assertEqual(list(StockReservation.objects.values_list('order_id', 'quantity')), [(competing, 1)])
+
+    @patch('api.utils.MpesaClient.stk_push')
+    def test_retry_is_refused_once_the_stock_is_gone(self, mock_stk_push):
+        order_id = self.place(2).json()['order_id']
+        self.callback(order_id, 1032)
+        self.assertEqual(self.place(3).status_code, 201)
+
+        retry = self.client.post(f'/api/payment/mpesa/initiate/{order_id}/', {'phone_number': '0700000000'}, format='json')
+        self.assertEqual(retry.status_code, 400)
+        self.assertIn("Not enough stock", retry.json()['error'])
+        mock_stk_push.assert_not_called()
@@ -0,0 +1,62 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+from api.fitment import parse_car_models
+from api.models import Order, OrderItem, Product, ProductFitment, ProductImage
+
+
+class FitmentParsingTest(TestCase):
+    def test_make_carries_over_and_years_are_parsed(self):
+        self.assertEqual(parse_car_models("Toyota Fielder 2010-2015, Axio; VW Golf 2012+, Mercedes-Benz C200 2008"), [
+            ('toyota', 'fielder', 2010, 2015),
+            ('toyota', 'axio', None, None),
+            ('volkswagen', 'golf', 2012, None),
+            ('mercedes-benz', 'c200', 2008, 2008),
+        ])
+
+    def test_short_year_ranges_and_blank_entries(self):
+        self.assertEqual(parse_car_models("Land Rover Discovery 2010-16,, "), [('land rover', 'discovery', 2010, 2016)])
+        self.assertEqual(parse_car_models(None), [])
+
+
+class FitmentEndpointTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.pads = Product.objects.create(name="Brake Pads", price=3500, stock_quantity=5)
+        self.filter = Product.objects.create(name="Oil Filter", price=900, stock_quantity=5)
+        self.image = ProductImage.objects.create(product=self.pads, image='products/p.jpg', car_models="Toyota Fielder 2010-2015, Axio")
+        ProductImage.objects.create(product=self.filter, image='products/f.jpg', car_models="Nissan Note")
+
+    def fitment(self, **params):
+        response = self.client.get('/api/products/fitment/', params)
+        self.assertEqual(response.status_code, 200)
+        return [p['id'] for p in response.json()['results']]
+
+    def test_lookup_by_make_model_and_year(self):
+        self.assertEqual(self.fitment(make='Toyota', model='Fielder', year=2012), [self.pads.id])
+        self.assertEqual(self.fitment(make='toyota', model='fielder', year=2018), [])
+        self.assertEqual(self.fitment(model='Axio'), [self.pads.id])
+        self.assertEqual(self.fitment(make='Nissan'), [self.filter.id])
+
+    def test_index_follows_image_edits(self):
+        self.image.car_models = "Mazda Demio"
+        self.image.save()
+        self.assertEqual(self.fitment(model='fielder'), [])
+        self.assertEqual(self.fitment(make='mazda', model='demio'), [self.pads.id])
+
+        self.image.delete()
+        self.assertFalse(ProductFitment.objects.filter(product=self.pads).exists())
+
+    def test_requires_make_or_model(self):
+        self.assertEqual(self.client.get('/api/products/fitment/').status_code, 400)
+
+    def test_order_suggested_parts(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_authenticate(admin)
+        order = Order.objects.create(total_price=900, vehicle_make="Toyota", vehicle_model="Toyota Fielder", vehicle_year="2013")
+        response = self.client.get(f'/api/orders/{order.id}/suggested-parts/')
+        self.assertEqual([p['id'] for p in response.json()], [self.pads.id])
+
+        OrderItem.objects.create(order=order, product=self.pads, quantity=1, price_at_order=3500)
+        response = self.client.get(f'/api/orders/{order.id}/suggested-parts/')
+        self.assertEqual(response.json(), [])
@@ -0,0 +1,110 @@
+from datetime import timedelta
+from unittest.mock import patch
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from api.idempotency import purge_expired_keys
+from api.models import IdempotencyKey, Order, Payment, Product
+
+
+class IdempotencyKeyTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = Product.objects.create(name="Pads", price=100, stock_quantity=5)
+
+    def place(self, quantity=1, key='checkout-1'):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return self.client.post('/api/orders/create/', {
+            'items': [{'product_id': self.product.id, 'quantity': quantity}],
+            'payment_method': 'Delivery',
+        }, format='json', **headers)
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.place()
+        retry = self.place()
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 4)
+
+    def test_requests_without_a_key_run_every_time(self):
+        self.place(key=None)
+        self.place(key=None)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_key_reused_for_a_different_request_is_rejected(self):
+        self.place(quantity=1)
+        self.assertEqual(self.place(quantity=2).status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_request_in_progress_conflicts(self):
+        self.place()
+        IdempotencyKey.objects.update(response_status=None, response_body=None)
+        response = self.place()
+        self.assertEqual((response.status_code, response['Retry-After']), (409, '1'))
+
+        # A request that died mid-way frees its key after a while
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(self.place().status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_expired_keys_run_again_and_are_purged(self):
+        self.place()
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertNotIn('Idempotent-Replayed', self.place())
+        self.assertEqual(Order.objects.count(), 2)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(purge_expired_keys(), 1)
+
+    @patch('api.utils.MpesaClient.stk_push')
+    def test_server_errors_are_not_stored(self, mock_stk_push):
+        order = Order.objects.create(total_price=100)
+        url = f'/api/payment/mpesa/initiate/{order.id}/'
+        mock_stk_push.side_effect = ConnectionError("Daraja down")
+        self.assertEqual(self.client.post(url, {'phone_number': '0700000000'}, format='json', HTTP_IDEMPOTENCY_KEY='pay-1').status_code, 500)
+
+        mock_stk_push.side_effect = None
+        mock_stk_push.return_value = {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_1', 'CustomerMessage': 'Sent'}
+        self.assertEqual(self.client.post(url, {'phone_number': '0700000000'}, format='json', HTTP_IDEMPOTENCY_KEY='pay-1').status_code, 200)
+        self.assertEqual(mock_stk_push.call_count, 2)
+
+    @patch('api.utils.MpesaClient.stk_push')
+    def test_recent_stk_push_is_reused(self, mock_stk_push):
+        order = Order.objects.create(total_price=100)
+        mock_stk_push.return_value = {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_1', 'CustomerMessage': 'Sent'}
+        url = f'/api/payment/mpesa/initiate/{order.id}/'
+        self.client.post(url, {'phone_number': '0700000000'}, format='json')
+        response = self.client.post(url, {'phone_number': '0700000000'}, format='json')
+
+        self.assertEqual(response.json()['checkout_request_id'], 'ws_CO_1')
+        self.assertEqual((mock_stk_push.call_count, Payment.objects.count()), (1, 1))
+
+    @patch('api.utils.MpesaClient.stk_push')
+    def test_temporary_answers_are_not_stored(self, mock_stk_push):
+        order = Order.objects.create(total_price=100)
+        url = f'/api/payment/mpesa/initiate/{order.id}/'
+
+        def pay():
+            return self.client.post(url, {'phone_number': '0700000000'}, format='json', HTTP_IDEMPOTENCY_KEY='pay-1')
+
+        # Another attempt is still talking to Daraja
+        attempt = Payment.objects.create(order=order, payment_method='M-Pesa', amount=100, phone_number='254700000000',
+                                         status='Initiating')
+        self.assertEqual(pay().status_code, 409)
+        attempt.status = 'Failed'
+        attempt.save()
+
+        # Then Daraja does not answer
+        mock_stk_push.return_value = None
+        response = pay()
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '5'))
+
+        mock_stk_push.return_value = {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_1', 'CustomerMessage': 'Sent'}
+        response = pay()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(mock_stk_push.call_count, 2)
+        self.assertEqual(Payment.objects.get(status='Pending').transaction_id, 'ws_CO_1')
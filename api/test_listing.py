@@ -0,0 +1,70 @@
+from datetime import date, time, timedelta
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from api.models import Booking, ContactMessage, Order, Product, Services
+
+
+class ListPaginationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_authenticate(self.admin)
+
+    def collect(self, url, params):
+        """ Follow `next` links and return every id in page order """
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids.extend(row['id'] for row in data['results'])
+            if not data['next']:
+                return ids
+            response = self.client.get(data['next'])
+
+    def test_orders_page_newest_first_without_gaps(self):
+        orders = [Order.objects.create(total_price=100, full_name=f"Customer {i}") for i in range(7)]
+        ids = self.collect('/api/orders/', {'page_size': 3})
+        self.assertEqual(ids, [o.id for o in reversed(orders)])
+
+    def test_order_flag_filters(self):
+        paid = Order.objects.create(total_price=100, status=Order.STATUS_PAID, paid_at=timezone.now())
+        pending = Order.objects.create(total_price=100)
+        ids = self.collect('/api/orders/', {'is_paid': 'true'})
+        self.assertEqual(ids, [paid.id])
+        self.assertEqual(self.collect('/api/orders/', {'is_pending': 'false'}), [paid.id])
+        self.assertEqual(self.collect('/api/orders/', {'status': 'pending,failed'}), [pending.id])
+        self.assertEqual(self.client.get('/api/orders/', {'status': 'lost'}).status_code, 400)
+
+    def test_booking_status_and_date_range_filters(self):
+        service = Services.objects.create(name="Tint", description="Tint", price=5000, image='services/t.jpg')
+        today = date.today()
+        keep = Booking.objects.create(services=service, total_price=5000, booking_date=today, booking_time=time(9), status='confirmed')
+        Booking.objects.create(services=service, total_price=5000, booking_date=today + timedelta(days=10), booking_time=time(9), status='confirmed')
+        Booking.objects.create(services=service, total_price=5000, booking_date=today, booking_time=time(10), status='pending')
+
+        ids = self.collect('/api/bookings/', {
+            'status': 'confirmed',
+            'booking_date_from': today.isoformat(),
+            'booking_date_to': (today + timedelta(days=1)).isoformat(),
+        })
+        self.assertEqual(ids, [keep.id])
+
+    def test_invalid_filter_value_is_rejected(self):
+        response = self.client.get('/api/bookings/', {'booking_date_from': 'tomorrow'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_product_filters(self):
+        Product.objects.create(name="Bulb", category='Electrical', is_available=False)
+        oil = Product.objects.create(name="Oil", category='Lubricants', is_available=True)
+        ids = self.collect('/api/products/', {'is_available': 'true'})
+        self.assertEqual(ids, [oil.id])
+
+    def test_contact_messages_are_paginated(self):
+        for i in range(3):
+            ContactMessage.objects.create(name="A", phone_number="0700", subject=f"S{i}", message="Hi")
+        data = self.client.get('/api/contact/messages/', {'page_size': 2}).json()
+        self.assertEqual(len(data['results']), 2)
+        self.assertIsNotNone(data['next'])
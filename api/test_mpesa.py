@@ -1,9 +1,14 @@
 import json
+from datetime import timedelta
+from django.db import connection
 from django.test import TestCase, Client
+from django.utils import timezone
 from django.urls import reverse
 from unittest.mock import patch, MagicMock
-from api.models import Order, Payment, Product, Category
+from api.models import Order, OrderItem, Payment, Product, Category
 from api.utils import MpesaClient
+from api.mpesa_inbox import process_batch
+from api.mpesa_reconcile import recover_abandoned_attempts
 
 class MpesaIntegrationTest(TestCase):
     def setUp(self):
@@ -39,6 +44,23 @@ class MpesaIntegrationTest(TestCase):
         self.assertEqual(payment.status, 'Pending')
         self.assertEqual(payment.transaction_id, 'ws_CO_12345')
 
+    @patch('api.utils.MpesaClient.stk_push')
+    def test_delivery_orders_cannot_be_paid_by_mpesa(self, mock_stk_push):
+        # Payment on Delivery orders had their stock deducted when they were placed
+        self.order.payment_method = 'Delivery'
+        self.order.save(update_fields=['payment_method'])
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2, price_at_order=10)
+
+        url = f'/api/payment/mpesa/initiate/{self.order.id}/'
+        response = self.client.post(url, {'phone_number': '0115709680'}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        mock_stk_push.assert_not_called()
+        self.assertFalse(Payment.objects.exists())
+        self.assertFalse(self.order.reservations.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 10)
+
     def test_mpesa_callback_success(self):
         # Create a pending payment
         payment = Payment.objects.create(
@@ -72,6 +94,7 @@ class MpesaIntegrationTest(TestCase):
         response = self.client.post(url, json.dumps(callback_data), content_type='application/json')
         
         self.assertEqual(response.status_code, 200)
+        process_batch()
         payment.refresh_from_db()
         self.assertEqual(payment.status, 'Completed')
         self.assertEqual(payment.mpesa_receipt_number, 'NLJ7RT6SYZ')
@@ -102,7 +125,61 @@ class MpesaIntegrationTest(TestCase):
         response = self.client.post(url, json.dumps(callback_data), content_type='application/json')
         
         self.assertEqual(response.status_code, 200)
+        process_batch()
         payment.refresh_from_db()
         self.assertEqual(payment.status, 'Failed')
         self.order.refresh_from_db()
         self.assertFalse(self.order.is_paid)
+
+
+class MpesaInitiationPhasesTest(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(total_price=10.50, full_name="John Doe")
+        self.url = f'/api/payment/mpesa/initiate/{self.order.id}/'
+
+    def initiate(self):
+        return self.client.post(self.url, {'phone_number': '0700000000'}, content_type='application/json')
+
+    @patch('api.utils.MpesaClient.stk_push')
+    def test_push_runs_outside_a_transaction(self, mock_stk_push):
+        test_atomic_blocks = len(connection.atomic_blocks)
+
+        def push(**kwargs):
+            self.assertEqual(len(connection.atomic_blocks), test_atomic_blocks)
+            self.assertEqual(Payment.objects.get().status, 'Initiating')
+            # A second checkout for the same phone waits for this push instead of sending another
+            self.assertEqual(self.initiate().status_code, 409)
+            return {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_1', 'CustomerMessage': 'Sent'}
+
+        mock_stk_push.side_effect = push
+        self.assertEqual(self.initiate().status_code, 200)
+        self.assertEqual(list(Payment.objects.values_list('status', 'transaction_id')), [('Pending', 'ws_CO_1')])
+
+    @patch('api.utils.MpesaClient.stk_push')
+    def test_rejected_push_is_recorded_as_failed(self, mock_stk_push):
+        mock_stk_push.return_value = {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid PhoneNumber'}
+        self.assertEqual(self.initiate().status_code, 400)
+        payment = Payment.objects.get()
+        self.assertEqual((payment.status, payment.raw_callback_data['errorCode']), ('Failed', '400.002.02'))
+
+    def test_abandoned_attempt_is_recovered_by_its_callback(self):
+        attempt = Payment.objects.create(
+            order=self.order, payment_method='M-Pesa', amount=10.50, phone_number='254700000000', status='Initiating',
+        )
+        Payment.objects.filter(id=attempt.id).update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(recover_abandoned_attempts(timezone.now()), 1)
+
+        self.client.post('/api/payment/mpesa/callback/', {'Body': {'stkCallback': {
+            'CheckoutRequestID': 'ws_CO_lost', 'ResultCode': 0, 'ResultDesc': 'Processed',
+            'CallbackMetadata': {'Item': [
+                {'Name': 'Amount', 'Value': 10},
+                {'Name': 'MpesaReceiptNumber', 'Value': 'NLJ7RT61SV'},
+                {'Name': 'PhoneNumber', 'Value': 254700000000},
+            ]},
+        }}}, content_type='application/json')
+        process_batch()
+
+        attempt.refresh_from_db()
+        self.assertEqual((attempt.status, attempt.transaction_id), ('Completed', 'ws_CO_lost'))
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.is_paid)
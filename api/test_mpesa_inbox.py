@@ -0,0 +1,68 @@
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from api.models import MpesaCallback, Order, Payment
+from api.mpesa_inbox import process_batch
+
+
+def stk_callback(checkout_request_id, result_code=0, receipt='NLJ7RT6SYZ'):
+    callback = {'CheckoutRequestID': checkout_request_id, 'ResultCode': result_code, 'ResultDesc': 'Done'}
+    if result_code == 0:
+        callback['CallbackMetadata'] = {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': receipt}]}
+    return {'Body': {'stkCallback': callback}}
+
+
+class MpesaInboxTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.order = Order.objects.create(total_price=100, email='jane@example.com')
+        self.payment = Payment.objects.create(order=self.order, transaction_id='ws_CO_1', payment_method='M-Pesa', amount=100)
+
+    def post(self, payload):
+        return self.client.post('/api/payment/mpesa/callback/', payload, format='json')
+
+    def test_webhook_only_records_the_payload(self):
+        with self.assertNumQueries(3):  # savepoint, insert, release
+            response = self.post(stk_callback('ws_CO_1'))
+        self.assertEqual(response.json(), {"ResultCode": 0, "ResultDesc": "Accepted"})
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'Pending')
+
+        self.assertEqual(process_batch(), (1, 0))
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.mpesa_receipt_number), ('Completed', 'NLJ7RT6SYZ'))
+        self.assertTrue(self.order.is_paid)
+        self.assertEqual(MpesaCallback.objects.get().outcome, "Paid, receipt NLJ7RT6SYZ")
+
+    def test_redeliveries_are_applied_once(self):
+        self.post(stk_callback('ws_CO_1'))
+        self.post(stk_callback('ws_CO_1'))
+        self.assertEqual(MpesaCallback.objects.count(), 1)
+        process_batch()
+        self.assertEqual(self.order.status_history.count(), 1)
+
+    def test_unknown_payment_is_retried_then_replayed(self):
+        self.post(stk_callback('ws_CO_2'))
+        self.assertEqual(process_batch(), (0, 1))
+        entry = MpesaCallback.objects.get()
+        self.assertEqual((entry.status, entry.attempts), (MpesaCallback.STATUS_PENDING, 1))
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+
+        # The initiating request commits its payment, and the entry is given up on meanwhile
+        Payment.objects.create(order=self.order, transaction_id='ws_CO_2', payment_method='M-Pesa', amount=100)
+        MpesaCallback.objects.update(status=MpesaCallback.STATUS_FAILED)
+        call_command('replay_mpesa_callbacks', process=True, stdout=StringIO())
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, MpesaCallback.STATUS_PROCESSED)
+        self.assertTrue(Order.objects.get(pk=self.order.pk).is_paid)
+
+    def test_replaying_a_processed_callback_changes_nothing(self):
+        self.post(stk_callback('ws_CO_1', result_code=1032))
+        process_batch()
+        call_command('replay_mpesa_callbacks', checkout_request_id=['ws_CO_1'], process=True, stdout=StringIO())
+        self.assertEqual(MpesaCallback.objects.get().outcome, "Payment already failed")
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, Order.STATUS_FAILED)
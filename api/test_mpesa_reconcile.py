@@ -0,0 +1,130 @@
+import json
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from api.models import MpesaCallback, Order, Payment
+from api.mpesa_reconcile import reconcile
+
+
+class StubDaraja(BaseHTTPRequestHandler):
+    """ Daraja's OAuth and STK query endpoints, answering from the server's `results` """
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.reply(200, {'access_token': 'stub-token', 'expires_in': '3599'})
+
+    def do_POST(self):
+        query = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        server = self.server
+        with server.lock:
+            server.queries.append(query['CheckoutRequestID'])
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(0.05)
+        with server.lock:
+            server.in_flight -= 1
+        result = server.results.get(query['CheckoutRequestID'], 'processing')
+        if result == 'processing':
+            self.reply(500, {'requestId': '1', 'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'})
+        else:
+            self.reply(200, {
+                'ResponseCode': '0', 'ResponseDescription': 'The service request has been accepted successsfully',
+                'MerchantRequestID': '29115-34620561-1', 'CheckoutRequestID': query['CheckoutRequestID'],
+                'ResultCode': result[0], 'ResultDesc': result[1],
+            })
+
+    def log_message(self, *args):
+        pass
+
+
+class ReconcileMpesaTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubDaraja)
+        cls.server.daemon_threads = True
+        cls.server.lock = threading.Lock()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.settings_override = override_settings(
+            DARAJA_BASE_URL=f'http://127.0.0.1:{cls.server.server_port}',
+            DARAJA_BUSINESS_SHORTCODE='174379',
+            DARAJA_PASSKEY='passkey',
+        )
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.results = {}
+        self.server.queries = []
+        self.server.in_flight = self.server.max_in_flight = 0
+
+    def pending_payment(self, checkout_request_id, age=timedelta(minutes=10)):
+        order = Order.objects.create(total_price=100, payment_method='M-Pesa')
+        payment = Payment.objects.create(
+            order=order, transaction_id=checkout_request_id, payment_method='M-Pesa', amount=100, status='Pending',
+        )
+        Payment.objects.filter(id=payment.id).update(created_at=timezone.now() - age)
+        return payment
+
+    def state(self, payment):
+        payment.refresh_from_db()
+        return payment.status, payment.order.status
+
+    def test_settles_stale_payments_from_the_stk_query(self):
+        paid = self.pending_payment('ws_CO_paid')
+        cancelled = self.pending_payment('ws_CO_cancelled')
+        open_prompt = self.pending_payment('ws_CO_open')
+        fresh = self.pending_payment('ws_CO_fresh', age=timedelta(seconds=30))
+        self.server.results = {
+            'ws_CO_paid': ('0', 'The service request is processed successfully.'),
+            'ws_CO_cancelled': ('1032', 'Request cancelled by user'),
+        }
+
+        self.assertEqual(reconcile(), (2, 1))
+        self.assertEqual(sorted(self.server.queries), ['ws_CO_cancelled', 'ws_CO_open', 'ws_CO_paid'])
+        self.assertEqual(self.state(paid), ('Completed', Order.STATUS_PAID))
+        self.assertEqual(self.state(cancelled), ('Failed', Order.STATUS_FAILED))
+        self.assertEqual(self.state(open_prompt), ('Pending', Order.STATUS_PENDING))
+        self.assertEqual(self.state(fresh), ('Pending', Order.STATUS_PENDING))
+        self.assertEqual(MpesaCallback.objects.get(checkout_request_id='ws_CO_paid').status, MpesaCallback.STATUS_PROCESSED)
+
+    def test_queries_run_concurrently_and_page_through_all_payments(self):
+        for i in range(8):
+            self.pending_payment(f'ws_CO_{i}')
+            self.server.results[f'ws_CO_{i}'] = ('0', 'Processed')
+
+        self.assertEqual(reconcile(batch_size=3, max_workers=4), (8, 0))
+        self.assertEqual(len(self.server.queries), 8)
+        self.assertGreater(self.server.max_in_flight, 1)
+        self.assertFalse(Payment.objects.filter(status='Pending').exists())
+
+    def test_leaves_payments_with_a_stored_callback_to_the_inbox(self):
+        payment = self.pending_payment('ws_CO_inbox')
+        MpesaCallback.objects.create(checkout_request_id='ws_CO_inbox', payload={}, next_attempt_at=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(reconcile(), (0, 0))
+        self.assertEqual(self.server.queries, [])
+        self.assertEqual(self.state(payment)[0], 'Pending')
+
+    def test_gives_up_on_payments_without_a_result(self):
+        payment = self.pending_payment('ws_CO_lost', age=timedelta(days=2))
+        call_command('reconcile_mpesa', '--once', stdout=StringIO())
+        self.assertEqual(self.state(payment), ('Failed', Order.STATUS_FAILED))
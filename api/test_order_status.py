@@ -0,0 +1,122 @@
+import asyncio
+import time
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+from api.models import Order, OrderStatusHistory, Product
+from api.order_status import InvalidTransition, mark_paid, transition, wait_for_status
+
+
+class OrderTransitionTest(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(total_price=100, payment_method='Delivery')
+
+    def test_transition_records_history_and_flags(self):
+        transition(self.order, Order.STATUS_CONFIRMED, "Called customer")
+        transition(self.order, Order.STATUS_OUT_FOR_DELIVERY)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.STATUS_OUT_FOR_DELIVERY)
+        self.assertTrue(self.order.is_confirmed and self.order.is_out_for_delivery)
+        self.assertFalse(self.order.is_pending or self.order.is_paid)
+        self.assertEqual(
+            list(self.order.status_history.order_by('id').values_list('from_status', 'to_status', 'note')),
+            [('pending', 'confirmed', "Called customer"), ('confirmed', 'out_for_delivery', '')],
+        )
+
+    def test_final_statuses_reject_moves(self):
+        transition(self.order, Order.STATUS_CANCELLED)
+        with self.assertRaises(InvalidTransition):
+            transition(self.order, Order.STATUS_CONFIRMED)
+        with self.assertRaises(InvalidTransition):
+            transition(self.order, 'lost')
+        self.assertEqual(OrderStatusHistory.objects.count(), 1)
+
+    def test_delivery_collects_payment(self):
+        transition(self.order, Order.STATUS_CONFIRMED)
+        transition(self.order, Order.STATUS_DELIVERED)
+        self.assertTrue(self.order.is_paid and self.order.is_delivered and self.order.is_completed)
+
+    def test_mark_paid_keeps_later_statuses(self):
+        transition(self.order, Order.STATUS_CONFIRMED)
+        self.assertTrue(mark_paid(self.order))
+        self.assertFalse(mark_paid(self.order))
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.is_paid), (Order.STATUS_CONFIRMED, True))
+
+
+class OrderStatusEndpointTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'pass'))
+        self.product = Product.objects.create(name="Pads", price=100, stock_quantity=3)
+
+    def place(self, payment_method):
+        response = self.client.post('/api/orders/create/', {
+            'items': [{'product_id': self.product.id, 'quantity': 2}],
+            'payment_method': payment_method,
+        }, format='json')
+        return Order.objects.get(id=response.json()['order_id'])
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.stock_quantity
+
+    def test_cancel_restores_only_deducted_stock(self):
+        unpaid = self.place('M-Pesa')
+        self.assertEqual(self.client.post(f'/api/orders/{unpaid.id}/cancel/').status_code, 200)
+        self.assertEqual(self.stock(), 3)
+
+        cod = self.place('Delivery')
+        self.assertEqual(self.stock(), 1)
+        self.client.post(f'/api/orders/{cod.id}/cancel/')
+        self.assertEqual(self.stock(), 3)
+        cod.refresh_from_db()
+        self.assertTrue(cod.is_cancelled and cod.is_restored)
+
+    def test_confirm_dispatch_deliver(self):
+        order = self.place('Delivery')
+        self.assertEqual(self.client.post(f'/api/orders/{order.id}/deliver/').status_code, 400)
+        self.client.post(f'/api/orders/{order.id}/confirm/')
+
+        response = self.client.post(f'/api/orders/{order.id}/status/', {'status': 'out_for_delivery', 'note': "Rider Tom"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['to_status'] for row in response.json()['history']], ['confirmed', 'out_for_delivery'])
+        self.assertEqual(response.json()['history'][1]['changed_by'], 'admin')
+
+        self.assertEqual(self.client.post(f'/api/orders/{order.id}/deliver/').status_code, 200)
+        self.assertEqual(self.client.post(f'/api/orders/{order.id}/cancel/').status_code, 400)
+        self.assertEqual(self.client.post(f'/api/orders/{order.id}/status/', {'status': 'cancelled'}, format='json').status_code, 400)
+
+        data = self.client.get(f'/api/orders/{order.id}/', {'view': 'summary'}).json()
+        self.assertEqual((data['status'], data['is_paid'], data['is_delivered']), ('delivered', True, True))
+
+
+class PaymentStatusLongPollTest(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(total_price=100)
+
+    def test_returns_at_once_when_status_moved_on(self):
+        mark_paid(self.order)
+        started = time.monotonic()
+        response = self.client.get(f'/api/orders/{self.order.id}/payment-status/', {'since': 'pending'})
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(response.json(), {'order_id': self.order.id, 'status': 'paid', 'is_paid': True, 'changed': True})
+
+    def test_times_out_with_unchanged_status(self):
+        response = self.client.get(f'/api/orders/{self.order.id}/payment-status/', {'wait': '0.2'})
+        self.assertEqual(response.json()['changed'], False)
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        self.assertEqual(self.client.get('/api/orders/999/payment-status/', {'wait': '0'}).status_code, 404)
+        self.assertEqual(self.client.get(f'/api/orders/{self.order.id}/payment-status/', {'since': 'lost'}).status_code, 400)
+
+    async def test_wakes_up_when_the_order_fails(self):
+        async def fail_later():
+            await asyncio.sleep(0.3)
+            await sync_to_async(transition)(self.order, Order.STATUS_FAILED)
+
+        started = time.monotonic()
+        result, _ = await asyncio.gather(wait_for_status(self.order.id, 'pending', timeout=10), fail_later())
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual((result['status'], result['changed']), ('failed', True))
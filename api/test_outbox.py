@@ -0,0 +1,79 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from api.models import OutboxEmail, Product
+from api.outbox import MAX_ATTEMPTS, send_batch
+from api.utils import send_receipt_email
+
+
+class OutboxTest(TestCase):
+    def test_requests_queue_email_instead_of_sending(self):
+        product = Product.objects.create(name="Pads", price=100, stock_quantity=5)
+        response = APIClient().post('/api/orders/create/', {
+            'items': [{'product_id': product.id, 'quantity': 1}],
+            'payment_method': 'Delivery',
+            'email': 'jane@example.com',
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.to_email, email.status), ('jane@example.com', OutboxEmail.STATUS_PENDING))
+
+    def test_failed_business_change_queues_nothing(self):
+        response = APIClient().post('/api/orders/create/', {
+            'items': [{'product_id': 999, 'quantity': 1}],
+            'payment_method': 'Delivery',
+            'email': 'jane@example.com',
+        }, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_worker_sends_a_batch_over_one_connection(self):
+        for i in range(3):
+            send_receipt_email(f'c{i}@example.com', f"Receipt {i}", "Thanks")
+
+        with patch('api.outbox.get_connection', wraps=mail.get_connection) as get_connection:
+            self.assertEqual(send_batch(), (3, 0))
+        self.assertEqual(get_connection.call_count, 1)
+
+        self.assertEqual([m.to for m in mail.outbox], [['c0@example.com'], ['c1@example.com'], ['c2@example.com']])
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        sent = OutboxEmail.objects.get(to_email='c0@example.com')
+        self.assertEqual(sent.status, OutboxEmail.STATUS_SENT)
+        self.assertIsNotNone(sent.sent_at)
+        self.assertIsNotNone(sent.send_duration_ms)
+        self.assertEqual(send_batch(), (0, 0))
+
+    def test_failures_back_off_then_give_up(self):
+        send_receipt_email('jane@example.com', "Receipt", "Thanks")
+        email = OutboxEmail.objects.get()
+
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError("SMTP down")):
+            self.assertEqual(send_batch(), (0, 1))
+            email.refresh_from_db()
+            self.assertEqual(email.attempts, 1)
+            self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=20))
+            self.assertEqual(send_batch(), (0, 0))  # not due yet
+
+            for _ in range(MAX_ATTEMPTS - 1):
+                OutboxEmail.objects.update(next_attempt_at=timezone.now())
+                send_batch()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.STATUS_FAILED, MAX_ATTEMPTS))
+        self.assertIn("SMTP down", email.last_error)
+
+    def test_claimed_emails_are_skipped_until_the_lease_ends(self):
+        send_receipt_email('jane@example.com', "Receipt", "Thanks")
+        OutboxEmail.objects.update(next_attempt_at=timezone.now() + timedelta(minutes=5))
+        self.assertEqual(send_batch(), (0, 0))
+
+    def test_run_outbox_once(self):
+        send_receipt_email('jane@example.com', "Receipt", "Thanks")
+        call_command('run_outbox', once=True, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
@@ -0,0 +1,62 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.test import TestCase, Client
+from django.utils import timezone
+from api.models import Offer, Order, Product
+from api.pricing import resolve_discounts, with_offer_prices
+
+
+class OfferResolutionTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.now = timezone.now()
+        self.product = Product.objects.create(name="Brake Disc", price=Decimal('2000.00'), stock_quantity=10)
+        self.plain = Product.objects.create(name="Fuse", price=Decimal('50.00'), stock_quantity=10)
+
+    def make_offer(self, percentage, starts=-1, ends=1, **kwargs):
+        offer = Offer.objects.create(
+            name=f"{percentage}% off",
+            discount_percentage=percentage,
+            start_date=self.now + timedelta(days=starts),
+            end_date=self.now + timedelta(days=ends),
+            **kwargs
+        )
+        offer.products.add(self.product)
+        return offer
+
+    def test_largest_active_discount_wins(self):
+        self.make_offer(10)
+        self.make_offer(25)
+        self.make_offer(50, starts=-10, ends=-5)
+        self.make_offer(60, is_active=False)
+
+        product = with_offer_prices(Product.objects.filter(pk=self.product.pk)).get()
+        self.assertEqual(product.active_discount_percentage, Decimal('25'))
+        self.assertEqual(product.discounted_price, Decimal('1500.00'))
+        # The unannotated fallback applies the same rule
+        self.assertEqual(Product.objects.get(pk=self.product.pk).current_offer.discount_percentage, Decimal('25'))
+
+        self.assertEqual(resolve_discounts([self.product.pk, self.plain.pk]), {self.product.pk: Decimal('25')})
+
+    def test_listing_cost_does_not_grow_with_offer_history(self):
+        for day in range(2, 30):
+            self.make_offer(5, starts=-day - 1, ends=-day)
+        self.make_offer(10)
+
+        with self.assertNumQueries(2):
+            products = list(with_offer_prices(Product.objects.prefetch_related('images')))
+        prices = {p.pk: p.discounted_price for p in products}
+        self.assertEqual(prices[self.product.pk], Decimal('1800.00'))
+        self.assertEqual(prices[self.plain.pk], Decimal('50.00'))
+
+    def test_create_order_charges_discounted_price(self):
+        self.make_offer(10)
+        response = self.client.post('/api/orders/create/', {
+            'items': [{'product_id': self.product.pk, 'quantity': 2}, {'product_id': self.plain.pk, 'quantity': 1}],
+            'full_name': "Jane",
+            'payment_method': 'M-Pesa',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(pk=response.json()['order_id'])
+        self.assertEqual(order.total_price, Decimal('3650.00'))
+        self.assertEqual(order.items.get(product=self.product).price_at_order, Decimal('1800.00'))
@@ -0,0 +1,120 @@
+import json
+import shutil
+import tempfile
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from api.models import Product, ProductFitment, ProductImage
+from api.product_import import ProductImporter, read_rows
+from api.search import search_products
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def run_import(text, file_format='csv', **kwargs):
+    return ProductImporter(chunk_size=2).run(read_rows(StringIO(text), file_format), **kwargs)
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    IMAGE_RENDITIONS_ON_UPLOAD=False,
+)
+class ProductImportTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        for name in ('products/pads.jpg', 'products/disc.jpg'):
+            if not default_storage.exists(name):
+                default_storage.save(name, ContentFile(b'image'))
+
+    def test_creates_and_updates_in_chunks(self):
+        existing = Product.objects.create(name="Brake Pads", price=2000, stock_quantity=5)
+        summary = run_import(
+            "name,price,stock_quantity,category\n"
+            "Brake Pads,2500,0,Spare parts\n"
+            "Oil Filter,800,10,service parts\n"
+            "Spark Plug,350.50,4,\n"
+        )
+
+        self.assertEqual((summary['created'], summary['updated'], summary['error_count']), (2, 1, 0))
+        existing.refresh_from_db()
+        self.assertEqual((existing.price, existing.stock_quantity, existing.is_available), (2500, 0, False))
+        oil = Product.objects.get(name="Oil Filter")
+        self.assertEqual((oil.category, oil.is_available), ('Service parts', True))
+        self.assertEqual(Product.objects.get(name="Spark Plug").category, 'Electrical')
+
+    def test_empty_cells_keep_current_values(self):
+        product = Product.objects.create(name="Bulb", price=150, description="H4 bulb")
+        run_import(f"id,price,description\n{product.id},175,\n")
+        product.refresh_from_db()
+        self.assertEqual((product.price, product.description), (175, "H4 bulb"))
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        summary = run_import(
+            "id,name,price,category\n"
+            "999,Ghost,10,\n"
+            ",Cheap,-1,\n"
+            ",Odd,10,Toys\n"
+            ",Fine,10,\n"
+        )
+        self.assertEqual(summary['created'], 1)
+        self.assertEqual([error['line'] for error in summary['errors']], [2, 3, 4])
+        self.assertIn("no product with id 999", summary['errors'][0]['error'])
+
+    def test_images_and_car_models_are_indexed(self):
+        summary = run_import(
+            '{"name": "Disc", "images": ["products/pads.jpg", "products/disc.jpg"], "car_models": ["Toyota Axio 2012-2016", "Nissan Note"]}\n'
+            '{"name": "Missing", "images": ["products/nope.jpg"]}\n',
+            file_format='jsonl',
+        )
+        self.assertEqual(summary['error_count'], 1)
+        product = Product.objects.get(name="Disc")
+        self.assertEqual(
+            list(product.images.order_by('id').values_list('image', 'car_models')),
+            [('products/pads.jpg', "Toyota Axio 2012-2016"), ('products/disc.jpg', "Nissan Note")],
+        )
+        self.assertTrue(ProductFitment.objects.filter(product=product, make='toyota', model='axio').exists())
+        self.assertEqual(list(search_products("axio")), [product])
+
+        # Re-importing the same image set leaves the rows alone
+        ids = set(product.images.values_list('id', flat=True))
+        run_import(f'{{"id": {product.id}, "images": ["products/pads.jpg", "products/disc.jpg"], "car_models": ["Toyota Axio 2012-2016", "Nissan Note"]}}\n', 'jsonl')
+        self.assertEqual(set(product.images.values_list('id', flat=True)), ids)
+
+    def test_dry_run_saves_nothing(self):
+        summary = run_import("name,price\nBulb,150\n", dry_run=True)
+        self.assertEqual(summary['created'], 1)
+        self.assertFalse(Product.objects.exists())
+
+    def test_export_round_trips_through_import(self):
+        product = Product.objects.create(name="Pads", price=2500, stock_quantity=3, category='Spare parts')
+        ProductImage.objects.create(product=product, image='products/pads.jpg', car_models="Toyota Axio")
+        for file_format in ('csv', 'jsonl'):
+            out = StringIO()
+            call_command('export_products', format=file_format, stdout=out, stderr=StringIO())
+            summary = run_import(out.getvalue(), file_format)
+            self.assertEqual((summary['created'], summary['updated'], summary['error_count']), (0, 1, 0))
+        self.assertEqual(product.images.count(), 1)
+
+    def test_admin_upload_endpoint(self):
+        client = APIClient()
+        response = client.post('/api/products/import/', {'file': SimpleUploadedFile('p.csv', b'name\nBulb\n')})
+        self.assertIn(response.status_code, (401, 403))
+
+        client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'pass'))
+        response = client.post('/api/products/import/', {'file': SimpleUploadedFile('p.csv', b'name,price\nBulb,150\n')})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 1)
+
+        response = client.post('/api/products/import/', {'file': SimpleUploadedFile('p.xlsx', b'')})
+        self.assertEqual(response.status_code, 400)
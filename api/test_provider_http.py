@@ -0,0 +1,96 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+import requests
+from django.test import SimpleTestCase
+from api.provider_http import CircuitOpen, ProviderClient
+
+
+class StubProvider(BaseHTTPRequestHandler):
+    """ Replies with the next scripted (status, delay) from the server's `script`, then 200 """
+    protocol_version = 'HTTP/1.1'
+
+    def handle_one(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append((self.command, self.path, self.client_address))
+        status, delay = self.server.script.pop(0) if self.server.script else (200, 0)
+        time.sleep(delay)
+        body = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out
+
+    do_GET = do_POST = handle_one
+
+    def log_message(self, *args):
+        pass
+
+
+@patch('api.provider_http.RETRY_BACKOFF', 0)
+class ProviderClientTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubProvider)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.script = []
+        self.server.requests = []
+        self.client = ProviderClient('Stub', timeout=(1, 0.3), retries=2, breaker_threshold=3, breaker_reset=60)
+
+    def test_reuses_connection_and_times_calls(self):
+        first = self.client.get(f'{self.url}/token')
+        second = self.client.get(f'{self.url}/token')
+        self.assertEqual((first.status_code, second.status_code), (200, 200))
+        self.assertEqual(self.server.requests[0][2], self.server.requests[1][2])
+        self.assertGreaterEqual(second.duration_ms, 0)
+        self.assertEqual(self.client.stats['calls'], 2)
+
+    def test_idempotent_calls_retry_server_errors(self):
+        self.server.script = [(503, 0), (500, 0)]
+        self.assertEqual(self.client.get(f'{self.url}/token').status_code, 200)
+        self.assertEqual((len(self.server.requests), self.client.stats['retries']), (3, 2))
+
+    def test_posts_are_not_repeated(self):
+        self.server.script = [(500, 0)]
+        self.assertEqual(self.client.post(f'{self.url}/stkpush', json={}).status_code, 500)
+        self.server.script = [(200, 1)]
+        with self.assertRaises(requests.ReadTimeout):
+            self.client.post(f'{self.url}/stkpush', json={})
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_slow_provider_times_out(self):
+        self.server.script = [(200, 1)] * 3
+        started = time.monotonic()
+        with self.assertRaises(requests.ReadTimeout):
+            self.client.get(f'{self.url}/token')
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_breaker_fails_fast_then_recovers(self):
+        self.server.script = [(500, 0)] * 3
+        self.assertEqual(self.client.get(f'{self.url}/token').status_code, 500)
+        self.assertTrue(self.client.is_open)
+
+        with self.assertRaises(CircuitOpen):
+            self.client.post(f'{self.url}/stkpush', json={})
+        self.assertEqual(len(self.server.requests), 3)
+
+        # After the reset period one trial call goes through and closes the circuit
+        self.client.breaker_reset = 0
+        self.assertEqual(self.client.post(f'{self.url}/stkpush', json={}).status_code, 200)
+        self.assertFalse(self.client.is_open)
@@ -0,0 +1,96 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from django.test import TestCase, override_settings
+from api.models import Order, Payment
+from api.mpesa_inbox import process_batch, record_callback
+from api.provider_simulator import ProviderSimulator
+from api.utils import MpesaClient, create_stripe_payment_intent
+
+
+class CallbackReceiver(BaseHTTPRequestHandler):
+    """ Stands in for our callback URL, keeping what the simulator posts """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.server.payloads.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        self.server.received.set()
+
+    def log_message(self, *args):
+        pass
+
+
+class ProviderSimulatorTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.receiver = ThreadingHTTPServer(('127.0.0.1', 0), CallbackReceiver)
+        cls.receiver.daemon_threads = True
+        threading.Thread(target=cls.receiver.serve_forever, daemon=True).start()
+        cls.simulator = ProviderSimulator(callback_delay=0.1).start()
+        cls.settings_override = override_settings(
+            DARAJA_BASE_URL=cls.simulator.url, DARAJA_BUSINESS_SHORTCODE='174379', DARAJA_PASSKEY='passkey',
+            DARAJA_CALLBACK_URL=f'http://127.0.0.1:{cls.receiver.server_port}/api/payment/mpesa/callback/',
+        )
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.simulator.stop()
+        cls.receiver.shutdown()
+        cls.receiver.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.simulator.failure_rate = 0
+        self.simulator.success_rate = 1
+        self.receiver.payloads = []
+        self.receiver.received = threading.Event()
+        self.client = MpesaClient()
+
+    def test_stk_push_callback_and_query(self):
+        order = Order.objects.create(total_price=250, payment_method='M-Pesa')
+        response = self.client.stk_push('254700000000', order.total_price, f"ORD{order.id}")
+        self.assertEqual(response['ResponseCode'], '0')
+        checkout_request_id = response['CheckoutRequestID']
+        Payment.objects.create(order=order, transaction_id=checkout_request_id, payment_method='M-Pesa', amount=250)
+        self.assertEqual(self.client.stk_query(checkout_request_id)['errorCode'], '500.001.1001')
+
+        self.assertTrue(self.receiver.received.wait(5))
+        payload = self.receiver.payloads[0]
+        self.assertEqual(payload['Body']['stkCallback']['CheckoutRequestID'], checkout_request_id)
+        record_callback(payload)
+        process_batch()
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.STATUS_PAID)
+        self.assertEqual(self.client.stk_query(checkout_request_id)['ResultCode'], '0')
+
+    def test_injected_failures_and_cancellations(self):
+        self.client.get_access_token()
+        self.simulator.failure_rate = 1
+        self.assertEqual(self.client.stk_push('254700000000', 100, 'ORD1')['errorCode'], '503.001.01')
+
+        self.simulator.failure_rate = 0
+        self.simulator.success_rate = 0
+        self.client.stk_push('254700000000', 100, 'ORD1')
+        self.assertTrue(self.receiver.received.wait(5))
+        self.assertEqual(self.receiver.payloads[0]['Body']['stkCallback']['ResultCode'], 1032)
+
+    def test_rejects_unknown_tokens(self):
+        self.client.access_token = 'stale'
+        self.client.token_expiry = None
+        with patch('api.provider_tokens.usable', return_value=True):
+            self.assertEqual(self.client.stk_push('254700000000', 100, 'ORD1')['errorCode'], '404.001.04')
+
+    def test_stripe_payment_intents(self):
+        with patch('stripe.api_base', self.simulator.url), patch('stripe.api_key', 'sk_test_simulator'):
+            intent = create_stripe_payment_intent(100, 'kes', idempotency_key='checkout-1')
+            retry = create_stripe_payment_intent(100, 'kes', idempotency_key='checkout-1')
+        self.assertEqual((intent['amount'], intent['currency']), (10000, 'kes'))
+        self.assertTrue(intent['client_secret'].startswith(intent['id']))
+        self.assertEqual(retry['id'], intent['id'])
@@ -0,0 +1,70 @@
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+from django.test import TestCase
+from django.utils import timezone
+from api import provider_tokens
+from api.models import ProviderToken
+from api.provider_tokens import TokenUnavailable, get_token
+from api.utils import MpesaClient
+
+
+class ProviderTokenCacheTest(TestCase):
+    def setUp(self):
+        self.fetch = MagicMock(return_value=('fresh', 3599))
+
+    def store(self, token, expires_in, locked=False):
+        now = timezone.now()
+        ProviderToken.objects.create(
+            provider='mpesa',
+            access_token=token,
+            expires_at=now + timedelta(seconds=expires_in),
+            refresh_lock_until=now + timedelta(seconds=30) if locked else None,
+        )
+
+    def test_token_is_fetched_once_and_shared(self):
+        self.assertEqual(get_token('mpesa', self.fetch)[0], 'fresh')
+        self.assertEqual(get_token('mpesa', self.fetch)[0], 'fresh')
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertIsNone(ProviderToken.objects.get().refresh_lock_until)
+
+    def test_refreshes_ahead_of_expiry(self):
+        self.store('old', 60)
+        self.assertEqual(get_token('mpesa', self.fetch)[0], 'fresh')
+
+    def test_others_keep_the_current_token_while_one_refreshes(self):
+        self.store('old', 60, locked=True)
+        self.assertEqual(get_token('mpesa', self.fetch)[0], 'old')
+        self.fetch.assert_not_called()
+
+    def test_failed_refresh_falls_back_to_the_current_token(self):
+        self.store('old', 60)
+        self.fetch.side_effect = ConnectionError("Daraja down")
+        self.assertEqual(get_token('mpesa', self.fetch)[0], 'old')
+        self.assertIsNone(ProviderToken.objects.get().refresh_lock_until)
+
+        ProviderToken.objects.update(expires_at=timezone.now())
+        with self.assertRaises(TokenUnavailable):
+            get_token('mpesa', self.fetch)
+
+    def test_waits_for_the_worker_holding_the_lock(self):
+        self.store('', -1, locked=True)
+
+        def other_worker_finishes(seconds):
+            ProviderToken.objects.update(access_token='theirs', expires_at=timezone.now() + timedelta(hours=1), refresh_lock_until=None)
+
+        with patch('api.provider_tokens.time.sleep', side_effect=other_worker_finishes):
+            self.assertEqual(get_token('mpesa', self.fetch)[0], 'theirs')
+        self.fetch.assert_not_called()
+
+    def test_client_reuses_its_copy(self):
+        client = MpesaClient()
+        hits = provider_tokens.stats['memory_hits']
+        with patch.object(MpesaClient, 'fetch_access_token', return_value=('fresh', 3599)) as fetch:
+            self.assertEqual(client.get_access_token(), 'fresh')
+            self.assertEqual(client.get_access_token(), 'fresh')
+            self.assertEqual(MpesaClient().get_access_token(), 'fresh')
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(provider_tokens.stats['memory_hits'], hits + 1)
+
+        client.invalidate_access_token()
+        self.assertEqual(ProviderToken.objects.get().access_token, '')
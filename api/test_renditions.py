@@ -0,0 +1,147 @@
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest.mock import patch
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+from api.models import Gallery, Product, ProductImage, RenditionJob
+from api.product_import import ProductImporter, read_rows
+from api.renditions import process_batch
+from api.serializers import GallerySerializer
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def upload(name, size=(2000, 1000), mode='RGB', image_format='JPEG'):
+    buffer = BytesIO()
+    Image.new(mode, size, 'red').save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageRenditionTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+
+    def create_gallery(self, file):
+        item = Gallery.objects.create(title="Wrap", image=file)
+        process_batch()
+        item.refresh_from_db()
+        return item
+
+    def test_uploads_are_queued_not_rendered_in_the_request(self):
+        item = Gallery.objects.create(title="Wrap", image=upload('wrap.jpg'))
+        item.refresh_from_db()
+        self.assertEqual(item.image_renditions, {})
+        self.assertEqual(list(RenditionJob.objects.values_list('model', 'object_id')), [('Gallery', item.pk)])
+
+        self.assertEqual(process_batch(), (1, 0))
+        item.refresh_from_db()
+        self.assertEqual(item.image_renditions['source'], item.image.name)
+        self.assertFalse(RenditionJob.objects.exists())
+
+    def test_image_replaced_while_rendering_is_rendered_again(self):
+        item = Gallery.objects.create(title="Wrap", image=upload('wrap.jpg'))
+
+        def replace_meanwhile(instance, force=False):
+            item.image = upload('new.jpg', size=(500, 500))
+            item.save()
+            return False
+
+        with patch('api.renditions.generate_for_instance', side_effect=replace_meanwhile):
+            self.assertEqual(process_batch(), (1, 0))
+        self.assertEqual(RenditionJob.objects.count(), 1)
+        process_batch()
+        item.refresh_from_db()
+        self.assertEqual(item.image_renditions['width'], 500)
+
+    def test_failures_are_retried_with_backoff(self):
+        Gallery.objects.create(title="Wrap", image=upload('wrap.jpg'))
+        with patch('api.renditions.generate_for_instance', side_effect=RuntimeError("disk full")):
+            self.assertEqual(process_batch(), (0, 1))
+        job = RenditionJob.objects.get()
+        self.assertEqual((job.attempts, job.last_error), (1, "disk full"))
+        self.assertEqual(process_batch(), (0, 0))  # not due yet
+
+    def test_import_queues_the_images_it_creates(self):
+        default_storage.save('products/import.jpg', upload('import.jpg'))
+        ProductImporter().run(read_rows(StringIO(
+            "name,price,image,images\nMirror,500,products/import.jpg,products/import.jpg\n"
+        ), 'csv'))
+        product = Product.objects.get(name="Mirror")
+        image = ProductImage.objects.get(product=product)
+        self.assertEqual(
+            sorted(RenditionJob.objects.values_list('model', 'object_id')),
+            [('Product', product.pk), ('ProductImage', image.pk)],
+        )
+        call_command('run_renditions', once=True, stdout=StringIO())
+        product.refresh_from_db()
+        image.refresh_from_db()
+        self.assertEqual(product.image_renditions['source'], 'products/import.jpg')
+        self.assertEqual(image.image_renditions['source'], 'products/import.jpg')
+
+    def test_upload_generates_webp_and_jpeg_renditions(self):
+        item = self.create_gallery(upload('wrap.jpg'))
+        renditions = item.image_renditions
+
+        self.assertEqual(renditions['source'], item.image.name)
+        self.assertEqual((renditions['width'], renditions['height']), (2000, 1000))
+        self.assertEqual([width for _, width in renditions['webp']], [320, 960])
+        for name, width in renditions['webp'] + renditions['jpeg']:
+            self.assertTrue(default_storage.exists(name))
+            with default_storage.open(name) as f, Image.open(f) as image:
+                self.assertEqual(image.width, width)
+        self.assertTrue(renditions['webp'][0][0].endswith('-320w.webp'))
+
+    def test_identical_uploads_share_content_hashed_files(self):
+        first = self.create_gallery(upload('a.jpg'))
+        second = self.create_gallery(upload('b.jpg'))
+        self.assertNotEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image_renditions['jpeg'], second.image_renditions['jpeg'])
+
+    def test_small_images_are_not_upscaled(self):
+        item = self.create_gallery(upload('small.png', size=(200, 100), mode='RGBA', image_format='PNG'))
+        self.assertEqual(item.image_renditions['jpeg'], [[item.image_renditions['jpeg'][0][0], 200]])
+
+    def test_unreadable_upload_is_left_without_renditions(self):
+        with self.assertLogs('api.renditions', 'WARNING'):
+            item = self.create_gallery(SimpleUploadedFile('broken.jpg', b'not an image'))
+        self.assertEqual(item.image_renditions, {})
+
+    def test_serializer_exposes_srcset(self):
+        item = self.create_gallery(upload('wrap.jpg'))
+        data = GallerySerializer(item).data['image_renditions']
+        self.assertEqual(data['width'], 2000)
+        self.assertRegex(data['srcset']['webp'], r'^/media/renditions/\S+-320w\.webp 320w, /media/renditions/\S+-960w\.webp 960w$')
+        self.assertTrue(data['src'].endswith('-960w.jpg'))
+
+    @override_settings(IMAGE_RENDITIONS_ON_UPLOAD=False)
+    def test_command_backfills_missing_renditions(self):
+        product = Product.objects.create(name="Mirror", image=upload('mirror.jpg'))
+        self.assertEqual(product.image_renditions, {})
+
+        out = StringIO()
+        call_command('generate_image_renditions', stdout=out)
+        self.assertIn("Queued renditions for 1 images", out.getvalue())
+        product.refresh_from_db()
+        self.assertEqual(product.image_renditions, {})  # the worker renders, not the backfill
+
+        call_command('run_renditions', once=True, stdout=StringIO())
+        product.refresh_from_db()
+        self.assertEqual(product.image_renditions['source'], product.image.name)
+
+        out = StringIO()
+        call_command('generate_image_renditions', stdout=out)
+        self.assertIn("Queued renditions for 0 images", out.getvalue())
+        call_command('generate_image_renditions', force=True, stdout=out)
+        self.assertIn("Queued renditions for 1 images", out.getvalue())
+        self.assertTrue(RenditionJob.objects.get().force)
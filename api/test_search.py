@@ -0,0 +1,64 @@
+from django.test import TestCase, Client
+from api.models import Product, ProductImage
+from api.search import rebuild_index
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.bulb = Product.objects.create(
+            name="Headlight Bulb H4",
+            description="Halogen bulb",
+            category="Electrical",
+            price=800,
+            stock_quantity=5
+        )
+        self.pads = Product.objects.create(
+            name="Brake Pads",
+            description="Front pads, fits most saloon cars. Not a headlight.",
+            category="Spare parts",
+            price=3500,
+            stock_quantity=5
+        )
+        ProductImage.objects.create(product=self.pads, image='products/pads.jpg', car_models="Toyota Fielder, Axio")
+
+    def search(self, query, **params):
+        response = self.client.get('/api/products/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_prefix_match_on_car_models(self):
+        data = self.search('fiel')
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['results'][0]['id'], self.pads.id)
+
+    def test_name_matches_rank_above_description(self):
+        data = self.search('headlight')
+        self.assertEqual([p['id'] for p in data['results']], [self.bulb.id, self.pads.id])
+
+    def test_results_are_paginated(self):
+        data = self.search('headlight', limit=1)
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(len(data['results']), 1)
+        self.assertIsNotNone(data['next'])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.bulb.name = "LED Bulb"
+        self.bulb.save()
+        self.assertEqual(self.search('led')['count'], 1)
+
+        self.pads.images.all().delete()
+        self.assertEqual(self.search('fielder')['count'], 0)
+
+        self.bulb.delete()
+        self.assertEqual(self.search('led')['count'], 0)
+
+    def test_rebuild_index(self):
+        self.assertEqual(rebuild_index(), 2)
+        self.assertEqual(self.search('axio')['count'], 1)
+
+    def test_operators_in_query_are_ignored(self):
+        self.assertEqual(self.search('"brake" (pads*')['count'], 1)
+
+    def test_search_honours_filters(self):
+        self.assertEqual(self.search('headlight', category='Spare parts')['count'], 1)
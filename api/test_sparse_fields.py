@@ -0,0 +1,68 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from api.models import Cart, CartItem, Order, OrderItem, Product, ProductImage
+
+
+class SparseFieldsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_authenticate(self.admin)
+        self.product = Product.objects.create(name="Brake Pads", price=2500, description="Front pads")
+        ProductImage.objects.create(product=self.product, image='products/pads.jpg', car_models="Toyota Axio")
+        self.order = Order.objects.create(total_price=5000, full_name="Jane")
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2, price_at_order=2500)
+
+    def test_full_response_without_parameters(self):
+        row = self.client.get('/api/products/').json()['results'][0]
+        self.assertIn('description', row)
+        self.assertEqual(len(row['images']), 1)
+
+    def test_fields_selects_columns(self):
+        row = self.client.get('/api/products/', {'fields': 'id,name,discounted_price'}).json()['results'][0]
+        self.assertEqual(set(row), {'id', 'name', 'discounted_price'})
+        self.assertEqual(float(row['discounted_price']), 2500)
+
+    def test_summary_leaves_out_images_unless_expanded(self):
+        row = self.client.get('/api/products/', {'view': 'summary'}).json()['results'][0]
+        self.assertNotIn('images', row)
+        self.assertNotIn('description', row)
+
+        row = self.client.get('/api/products/', {'view': 'summary', 'expand': 'images'}).json()['results'][0]
+        self.assertEqual(len(row['images']), 1)
+
+    def test_dotted_fields_reach_into_nested_objects(self):
+        row = self.client.get('/api/orders/', {'fields': 'id,items.quantity,items.product.name'}).json()['results'][0]
+        self.assertEqual(row, {'id': self.order.id, 'items': [{'quantity': 2, 'product': {'name': "Brake Pads"}}]})
+
+    def test_unexpanded_to_one_relation_collapses_to_id(self):
+        row = self.client.get('/api/orders/', {'fields': 'id,items.quantity,items.product'}).json()['results'][0]
+        self.assertEqual(row['items'], [{'quantity': 2, 'product': self.product.id}])
+
+    def test_sparse_response_skips_unused_prefetches(self):
+        with CaptureQueriesContext(connection) as full:
+            self.client.get('/api/orders/')
+        with CaptureQueriesContext(connection) as summary:
+            self.client.get('/api/orders/', {'view': 'summary'})
+        self.assertLess(len(summary), len(full))
+        self.assertFalse(any('api_orderitem' in q['sql'] for q in summary.captured_queries))
+
+    def test_cart_total_without_items_is_one_aggregate(self):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+        url = f'/api/cart/{cart.id}/'
+        with CaptureQueriesContext(connection) as one_item:
+            self.client.get(url, {'fields': 'id,grand_total'})
+
+        for i in range(3):
+            CartItem.objects.create(cart=cart, product=Product.objects.create(name=f"Filter {i}", price=100), quantity=1)
+        with CaptureQueriesContext(connection) as four_items:
+            row = self.client.get(url, {'fields': 'id,grand_total'}).json()
+        self.assertEqual(len(four_items), len(one_item))
+        self.assertEqual(float(row['grand_total']), 5300)
+        self.assertEqual(float(self.client.get(url).json()['grand_total']), 5300)
@@ -0,0 +1,63 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+from api.models import Product
+from api.stock import adjust_stock, parse_adjustments
+
+
+class StockAdjustmentTest(TestCase):
+    def setUp(self):
+        self.pads = Product.objects.create(name="Pads", stock_quantity=5)
+        self.oil = Product.objects.create(name="Oil", stock_quantity=0, is_available=False)
+        self.bulb = Product.objects.create(name="Bulb", stock_quantity=2)
+
+    def stock(self, product):
+        product.refresh_from_db()
+        return product.stock_quantity, product.is_available
+
+    def test_applies_all_deltas_in_constant_queries(self):
+        # savepoint, locking read, update, savepoint release
+        with self.assertNumQueries(4):
+            result = adjust_stock({self.pads.id: -5, self.oil.id: 12, self.bulb.id: 1})
+
+        self.assertEqual(self.stock(self.pads), (0, False))
+        self.assertEqual(self.stock(self.oil), (12, True))
+        self.assertEqual(self.stock(self.bulb), (3, True))
+        self.assertEqual(len(result['applied']), 3)
+
+    def test_negative_result_rejects_the_whole_batch(self):
+        result = adjust_stock({self.pads.id: -6, self.oil.id: 3, 999: 1})
+        self.assertEqual(result['applied'], [])
+        self.assertEqual(
+            {(row['product_id'], row['error']) for row in result['rejected']},
+            {(self.pads.id, "Stock would go negative"), (999, "Product not found")},
+        )
+        self.assertEqual(self.stock(self.oil), (0, False))
+
+    def test_partial_applies_the_valid_rows(self):
+        result = adjust_stock({self.pads.id: -6, self.oil.id: 3}, partial=True)
+        self.assertEqual([row['product_id'] for row in result['applied']], [self.oil.id])
+        self.assertEqual(self.stock(self.pads), (5, True))
+        self.assertEqual(self.stock(self.oil), (3, True))
+
+    def test_repeated_products_are_summed(self):
+        self.assertEqual(
+            parse_adjustments([{'product_id': 1, 'delta': 2}, {'product_id': '1', 'delta': '-5'}]),
+            {1: -3},
+        )
+        with self.assertRaises(ValueError):
+            parse_adjustments([{'product_id': 1}])
+
+    def test_admin_endpoint(self):
+        client = APIClient()
+        payload = {'adjustments': [{'product_id': self.pads.id, 'delta': -1}]}
+        self.assertIn(client.post('/api/products/stock/adjust/', payload, format='json').status_code, (401, 403))
+
+        client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'pass'))
+        response = client.post('/api/products/stock/adjust/', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['applied'][0]['stock_quantity'], 4)
+
+        response = client.post('/api/products/stock/adjust/', {'adjustments': [{'product_id': self.bulb.id, 'delta': -3}]}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(client.post('/api/products/stock/adjust/', {'adjustments': []}, format='json').status_code, 400)
@@ -1,17 +1,18 @@
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
-from .views import cancel_order, cancel_booking, mark_order_delivered, confirm_order
+from .views import cancel_order, cancel_booking, mark_order_delivered, confirm_order, order_suggested_parts, manage_order_status, order_payment_status
 from .views import (
     ServicesDetailView,
     ProductDetailView,
     create_order, OrderListView, OrderDetailView,
     BookingCreateView, BookingListView, BookingDetailView, create_booking,
     confirm_booking, complete_booking,
-    bookings_summary, booking_revenue, daily_bookings, monthly_bookings, weekly_bookings,
+    booking_availability, bookings_summary, booking_revenue, daily_bookings, monthly_bookings, weekly_bookings,
     CartCreateView, CartDetailView, add_to_cart, UpdateCartItemView,
     initiate_mpesa_payment, mpesa_callback, initiate_stripe_payment,
     GalleryListCreateView, GalleryDetailView, admin_dashboard_stats,
-    ContactCreateView, ContactListView, ContactDetailView, CustomObtainAuthToken,  ProductCreateView, ServicesCreateView, ProductImagesCreateView, ServiceImagesCreateView
+    ContactCreateView, ContactListView, ContactDetailView, CustomObtainAuthToken,  ProductCreateView, ServicesCreateView, ProductImagesCreateView, ServiceImagesCreateView,
+    ProductFitmentView, import_products, adjust_product_stock
 )
 from rest_framework.authtoken.views import obtain_auth_token
 
@@ -22,6 +23,9 @@ urlpatterns = [
 
     # Products
     path('products/', ProductCreateView.as_view()),
+    path('products/fitment/', ProductFitmentView.as_view(), name='product-fitment'),
+    path('products/import/', import_products),
+    path('products/stock/adjust/', adjust_product_stock),
     path('products/<int:pk>/', ProductDetailView.as_view()),
 
     # Orders
@@ -30,11 +34,15 @@ urlpatterns = [
     path('orders/<int:order_id>/cancel/', cancel_order),
     path('orders/<int:order_id>/confirm/', confirm_order),
     path('orders/<int:order_id>/deliver/', mark_order_delivered),
+    path('orders/<int:order_id>/status/', manage_order_status),
+    path('orders/<int:order_id>/payment-status/', order_payment_status),
+    path('orders/<int:order_id>/suggested-parts/', order_suggested_parts),
     path('orders/<int:pk>/', OrderDetailView.as_view()),
 
     # Bookings
     path('bookings/', BookingListView.as_view()),
     path('bookings/create/', create_booking),
+    path('bookings/availability/', booking_availability, name='booking-availability'),
     path('bookings/<int:booking_id>/confirm/', confirm_booking),
     path('bookings/<int:booking_id>/complete/', complete_booking),
     path('bookings/<int:booking_id>/cancel/', cancel_booking),
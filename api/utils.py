@@ -1,39 +1,71 @@
-import requests
 from requests.auth import HTTPBasicAuth
 import base64
 from datetime import datetime
 from django.conf import settings
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
+from django.utils import timezone
 from django.utils.html import strip_tags
 import stripe
+from . import provider_tokens
+from .outbox import enqueue_email
+from .provider_http import DEFAULT_RETRIES, DEFAULT_TIMEOUT, ProviderClient
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
+stripe.api_base = settings.STRIPE_API_BASE
+# Bounded like our own provider calls; Stripe adds idempotency keys to its retries
+stripe.default_http_client = stripe.RequestsClient(timeout=DEFAULT_TIMEOUT)
+stripe.max_network_retries = DEFAULT_RETRIES
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Daraja's STK query reply (HTTP 500) while the customer has not answered the prompt yet
+STK_QUERY_PROCESSING = '500.001.1001'
+
+# Pooled, timeout-bounded HTTP client for Daraja, one per worker process
+daraja = ProviderClient('Daraja')
+
 class MpesaClient:
+    TOKEN_PROVIDER = 'mpesa'
+
     def __init__(self):
+        # This process's copy of the shared token (see api.provider_tokens)
         self.access_token = None
         self.token_expiry = None
 
-    def get_access_token(self):
-        # In production, you might want to cache this in Redis or database
+    def fetch_access_token(self):
+        """ Ask Daraja for a new OAuth token: (token, expires_in seconds) """
         consumer_key = str(settings.DARAJA_CONSUMER_KEY).strip()
         consumer_secret = str(settings.DARAJA_CONSUMER_SECRET).strip()
         api_url = f"{str(settings.DARAJA_BASE_URL).strip()}/oauth/v1/generate?grant_type=client_credentials"
 
+        r = daraja.get(api_url, auth=HTTPBasicAuth(consumer_key, consumer_secret))
+        r.raise_for_status()
+        data = r.json()
+        logger.info("M-Pesa Access Token generated successfully")
+        return data['access_token'], int(data.get('expires_in', 3599))
+
+    def get_access_token(self):
+        if self.access_token and provider_tokens.usable(self.token_expiry, timezone.now(), provider_tokens.REFRESH_AHEAD):
+            provider_tokens.stats['memory_hits'] += 1
+            return self.access_token
         try:
-            r = requests.get(api_url, auth=HTTPBasicAuth(consumer_key, consumer_secret))
-            r.raise_for_status()
-            token = r.json()['access_token']
-            logger.info("M-Pesa Access Token generated successfully")
-            return token
-        except Exception as e:
+            self.access_token, self.token_expiry = provider_tokens.get_token(self.TOKEN_PROVIDER, self.fetch_access_token)
+        except provider_tokens.TokenUnavailable as e:
             logger.error(f"Error generating M-Pesa access token: {e}")
             return None
+        return self.access_token
+
+    def invalidate_access_token(self):
+        self.access_token = self.token_expiry = None
+        provider_tokens.invalidate(self.TOKEN_PROVIDER)
+
+    def password(self):
+        """ Daraja's (Password, Timestamp) pair for STK requests """
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        data_to_encode = settings.DARAJA_BUSINESS_SHORTCODE + settings.DARAJA_PASSKEY + timestamp
+        return base64.b64encode(data_to_encode.encode('utf-8')).decode('utf-8'), timestamp
 
     def stk_push(self, phone_number, amount, account_reference, transaction_desc="Payment"):
         access_token = self.get_access_token()
@@ -41,16 +73,11 @@ class MpesaClient:
             logger.error("Failed to get M-Pesa access token for STK push")
             return None
 
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
         business_short_code = settings.DARAJA_BUSINESS_SHORTCODE
-        passkey = settings.DARAJA_PASSKEY
-        
-        if not business_short_code or not passkey:
+        if not business_short_code or not settings.DARAJA_PASSKEY:
             logger.error("DARAJA_BUSINESS_SHORTCODE or DARAJA_PASSKEY not set in settings")
             return None
-
-        data_to_encode = business_short_code + passkey + timestamp
-        password = base64.b64encode(data_to_encode.encode('utf-8')).decode('utf-8')
+        password, timestamp = self.password()
 
         # Daraja AccountReference must be max 12 chars and alphanumeric
         sanitized_account_ref = str(account_reference)[:12].replace(' ', '').replace('-', '')
@@ -79,7 +106,10 @@ class MpesaClient:
         api_url = f"{settings.DARAJA_BASE_URL}/mpesa/stkpush/v1/processrequest"
 
         try:
-            response = requests.post(api_url, json=payload, headers=headers)
+            response = daraja.post(api_url, json=payload, headers=headers)
+            if response.status_code == 401:
+                # Daraja revoked the token early; the next call fetches a new one
+                self.invalidate_access_token()
             response_data = response.json()
             logger.info(f"Daraja Response: {response.status_code} - {response_data.get('CustomerMessage')}")
             
@@ -93,50 +123,77 @@ class MpesaClient:
                 logger.error(f"Response content: {e.response.text}")
             return None
 
+    def stk_query(self, checkout_request_id):
+        """
+        Ask Daraja for the result of an STK push. Returns Daraja's JSON, which carries
+        ResultCode/ResultDesc once the customer has answered (or the prompt expired) and
+        errorCode STK_QUERY_PROCESSING while it is still open; None if Daraja could not
+        be reached.
+        """
+        access_token = self.get_access_token()
+        if not access_token:
+            logger.error("Failed to get M-Pesa access token for STK query")
+            return None
+        if not settings.DARAJA_BUSINESS_SHORTCODE or not settings.DARAJA_PASSKEY:
+            logger.error("DARAJA_BUSINESS_SHORTCODE or DARAJA_PASSKEY not set in settings")
+            return None
+        password, timestamp = self.password()
+
+        api_url = f"{settings.DARAJA_BASE_URL}/mpesa/stkpushquery/v1/query"
+        payload = {
+            "BusinessShortCode": settings.DARAJA_BUSINESS_SHORTCODE,
+            "Password": password,
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id,
+        }
+        try:
+            response = daraja.post(api_url, json=payload, headers={'Authorization': f'Bearer {access_token}'})
+            if response.status_code == 401:
+                self.invalidate_access_token()
+            response_data = response.json()
+        except Exception as e:
+            logger.error(f"Error querying STK push {checkout_request_id}: {e}")
+            return None
+        if response_data.get('errorCode') == STK_QUERY_PROCESSING:
+            # An answer, not an outage: don't let it count towards opening the breaker
+            daraja.record_success()
+        return response_data
+
+# One client per worker process, so its copy of the access token is reused across requests
+mpesa_client = MpesaClient()
+
 def send_receipt_email(to_email, subject, message_body):
-    """ Helper function to send Email receipts """
+    """
+    Helper function to send Email receipts. The email is queued in the outbox (inside
+    the caller's transaction) and delivered by `manage.py run_outbox`, so requests never
+    wait on the mail server.
+    """
     if not to_email:
         logger.warning("No email address provided for receipt notification")
         return False
-    
-    try:
-        html_message = f'<div style="font-family: Arial, sans-serif; padding: 20px;"><h3>VINNY KJ</h3><p>{message_body}</p></div>'
-        plain_message = strip_tags(html_message)
-        from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', getattr(settings, 'EMAIL_HOST_USER', 'noreply@vinkj.com'))
-        
-        # We set fail_silently=False during setup/debugging to see real SMTP errors in logs
-        # but keep it True or wrap in try-except for production stability.
-        # Here we use logger to capture the error while still preventing a crash.
-        send_mail(
-            subject=subject,
-            message=plain_message,
-            from_email=from_email,
-            recipient_list=[to_email],
-            html_message=html_message,
-            fail_silently=False, 
-        )
-        logger.info(f"Email successfully sent to {to_email} with subject: {subject}")
-        return True
-    except Exception as e:
-        logger.error(f"SMTP Error: Failed to send email to {to_email}. Error: {str(e)}")
-        # If it's a connection error, it might be due to missing/wrong credentials in .env
-        if "Authentication failed" in str(e) or "SMTPAuthenticationError" in str(e):
-            logger.error("Check EMAIL_HOST_USER and EMAIL_HOST_PASSWORD in your .env file.")
-        return False
+
+    html_message = f'<div style="font-family: Arial, sans-serif; padding: 20px;"><h3>VINNY KJ</h3><p>{message_body}</p></div>'
+    plain_message = strip_tags(html_message)
+    from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', getattr(settings, 'EMAIL_HOST_USER', 'noreply@vinkj.com'))
+    email = enqueue_email(to_email, subject, plain_message, html_message, from_email=from_email)
+    logger.info(f"Email {email.id} queued for {to_email} with subject: {subject}")
+    return True
 
 
 
-def create_stripe_payment_intent(amount, currency='usd'):
+def create_stripe_payment_intent(amount, currency='usd', idempotency_key=None):
     try:
-        # Stripe expects amount in cents
+        # Stripe expects amount in cents. Passing the client's idempotency key on means
+        # Stripe returns the same intent if our own record of the request was lost.
         intent = stripe.PaymentIntent.create(
             amount=int(amount * 100),
             currency=currency,
             automatic_payment_methods={
                 'enabled': True,
             },
+            idempotency_key=idempotency_key,
         )
         return intent
     except Exception as e:
-        print(f"Error creating stripe payment intent: {e}")
+        logger.error(f"Error creating stripe payment intent: {e}")
         return None
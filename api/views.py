@@ -1,18 +1,20 @@
 from rest_framework import generics
 from .models import Services, Product, Order, Booking, Cart, CartItem, Payment, OrderItem, Gallery, ContactMessage, ProductImage, ServiceImage
-from rest_framework.decorators import api_view, permission_classes, authentication_classes
+from rest_framework.decorators import api_view, permission_classes, authentication_classes, parser_classes
 from rest_framework.permissions import IsAdminUser, AllowAny
 from rest_framework.response import Response
-from django.db.models.functions import TruncDay, TruncMonth,TruncWeek
+from django.db.models.functions import TruncDay
 from rest_framework import status
-from django.db.models import Sum, Count
+from django.db.models import Sum, Prefetch
 from datetime import timedelta, datetime
 from django.utils import timezone
+from rest_framework import serializers
 from .serializers import (
     ServicesSerializer,
     ProductSerializer,
     OrderSerializer,
     OrderItemSerializer,
+    OrderStatusHistorySerializer,
     BookingSerializer,
     CartSerializer,
     CartItemSerializer,
@@ -22,21 +24,80 @@ from .serializers import (
     ServiceImageSerializer
     
 )
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse, JsonResponse
+from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
 from django.utils.decorators import method_decorator
 from django.conf import settings
 from rest_framework import permissions
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
-from .utils import MpesaClient, create_stripe_payment_intent, send_receipt_email
+from .utils import mpesa_client, create_stripe_payment_intent, send_receipt_email
+from .pagination import ProductSearchPagination, CreatedAtCursorPagination
+from .filters import QueryParamFilterMixin, parse_bool, parse_date, parse_str
+from .search import search_products
+from .idempotency import idempotent
+from .mpesa_inbox import record_callback
+from .mpesa_reconcile import INITIATE_TIMEOUT
+from .analytics import bookings_by_status, bookings_per, orders_by_paid, report_range
+from .availability import AVAILABLE_TIME_SLOTS, MAX_RANGE_DAYS, availability_grid, fits, slot_is_free
+from .order_status import (
+    STATUS_LABELS, STATUS_WAIT_MAX, InvalidTransition, flag_filter, parse_statuses, transition, wait_for_status,
+)
+from .catalog_cache import CatalogSnapshotMixin, invalidate_catalog
+from .pricing import with_offer_prices, resolve_discounts
+from .fitment import products_fitting, parse_year
+from .product_import import ProductImporter, detect_format, read_rows
+from .stock import (
+    StockConflict, adjust_stock, apply_stock_deltas, parse_adjustments,
+    active_holds, hold_order_stock, reserve_stock, release_reservations,
+)
+from rest_framework.parsers import MultiPartParser
+import io
 import json
+from functools import wraps
+from collections import defaultdict
 import logging
 
 logger = logging.getLogger(__name__)
 
+def renders_nested(serializer, path):
+    """ Whether `serializer` renders the nested relation at dotted `path` as an object """
+    for name in path.split('.'):
+        serializer = getattr(serializer, 'child', serializer)
+        field = serializer.fields.get(name)
+        if not isinstance(getattr(field, 'child', field), serializers.BaseSerializer):
+            return False
+        serializer = field
+    return True
+
+
+class SparseQuerysetMixin:
+    """
+    Loads only what the (possibly sparse, see SparseFieldsMixin) response renders:
+    `sparse_prefetches` maps a nested field path to the prefetch it needs, and sparse
+    responses also restrict the SELECT to the columns their fields read.
+    """
+    sparse_prefetches = {}
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        serializer = self.get_serializer()
+        for path, prefetch in self.sparse_prefetches.items():
+            if renders_nested(serializer, path):
+                queryset = queryset.prefetch_related(prefetch() if callable(prefetch) else prefetch)
+
+        columns = serializer.get_rendered_columns()
+        if columns is not None:
+            # Cursor pagination reads its ordering fields from the last row
+            ordering = getattr(self.pagination_class, 'ordering', None) or ()
+            columns.update(field.lstrip('-') for field in ordering)
+            queryset = queryset.only(*columns)
+        return queryset
+
+
 class CustomObtainAuthToken(ObtainAuthToken):
     authentication_classes = []
     permission_classes = [AllowAny]
@@ -49,8 +110,9 @@ class CustomObtainAuthToken(ObtainAuthToken):
         token, created = Token.objects.get_or_create(user=user)
         return Response({'token': token.key})
 
-class ServicesCreateView(generics.ListAPIView):
+class ServicesCreateView(CatalogSnapshotMixin, SparseQuerysetMixin, generics.ListAPIView):
     queryset = Services.objects.all()
+    sparse_prefetches = {'images': 'images'}
     serializer_class = ServicesSerializer
     authentication_classes = []
     permission_classes = [AllowAny]
@@ -77,23 +139,89 @@ class ServicesDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ServicesSerializer
     permission_classes = [IsAdminUser]
 
-class ProductCreateView(generics.ListAPIView):
-    queryset = Product.objects.prefetch_related('offers').all()
+def products_with_prices(images=True):
+    # Product rows with their winning offer resolved in the same query
+    queryset = with_offer_prices(Product.objects.all())
+    return queryset.prefetch_related('images') if images else queryset
+
+
+def order_items_prefetch():
+    return Prefetch('items__product', queryset=products_with_prices(images=False))
+
+
+class ProductCreateView(CatalogSnapshotMixin, SparseQuerysetMixin, QueryParamFilterMixin, generics.ListAPIView):
+    queryset = Product.objects.all()
+    sparse_prefetches = {'images': 'images'}
+    serializer_class = ProductSerializer
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    pagination_class = CreatedAtCursorPagination
+    filter_params = {
+        'category': ('category', parse_str),
+        'is_available': ('is_available', parse_bool),
+        'is_active': ('is_active', parse_bool),
+    }
+
+    def get_queryset(self):
+        return products_with_prices(images=False)
+
+    def list(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return super().list(request, *args, **kwargs)
+
+        # Ranked search: only the requested page of matches is loaded and serialized
+        paginator = ProductSearchPagination()
+        results = search_products(query, self.filter_queryset(self.get_queryset()))
+        page = paginator.paginate_queryset(results, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class ProductFitmentView(SparseQuerysetMixin, generics.ListAPIView):
+    """ Products that fit a vehicle: /api/products/fitment/?make=toyota&model=fielder&year=2015 """
     serializer_class = ProductSerializer
     authentication_classes = []
     permission_classes = [AllowAny]
+    pagination_class = CreatedAtCursorPagination
+    sparse_prefetches = {'images': 'images'}
+
+    def list(self, request, *args, **kwargs):
+        make = request.query_params.get('make', '').strip()
+        model = request.query_params.get('model', '').strip()
+        if not make and not model:
+            return Response({"error": "Provide a make and/or model"}, status=status.HTTP_400_BAD_REQUEST)
+
+        year = request.query_params.get('year')
+        if year:
+            year = parse_year(year)
+            if year is None:
+                return Response({"error": "Invalid year"}, status=status.HTTP_400_BAD_REQUEST)
+
+        self.fitment = (make, model, year)
+        return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return products_fitting(products_with_prices(images=False), *self.fitment)
 
 
 class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Product.objects.prefetch_related('offers').all()
+    queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAdminUser]
 
-class GalleryListCreateView(generics.ListAPIView):
+    def get_queryset(self):
+        return products_with_prices()
+
+class GalleryListCreateView(CatalogSnapshotMixin, SparseQuerysetMixin, QueryParamFilterMixin, generics.ListAPIView):
     queryset = Gallery.objects.all()
     serializer_class = GallerySerializer
     authentication_classes = []
     permission_classes = [AllowAny]
+    pagination_class = CreatedAtCursorPagination
+    filter_params = {
+        'category': ('category', parse_str),
+    }
 
 class GalleryDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Gallery.objects.all()
@@ -105,25 +233,54 @@ class OrderCreateView(generics.CreateAPIView):
     serializer_class = OrderSerializer
 
 
-class OrderListView(generics.ListAPIView):
-    queryset = Order.objects.all()
-    serializer_class = OrderSerializer
+ORDER_ITEM_PREFETCHES = {
+    'items': 'items',
+    'items.product': order_items_prefetch,
+    'items.product.images': 'items__product__images',
+}
 
 
-class OrderDetailView(generics.RetrieveAPIView):
+class OrderListView(SparseQuerysetMixin, QueryParamFilterMixin, generics.ListAPIView):
+    queryset = Order.objects.all()
+    serializer_class = OrderSerializer
+    pagination_class = CreatedAtCursorPagination
+    filter_params = {
+        'status': ('status__in', parse_statuses),
+        'is_paid': (flag_filter('is_paid'), parse_bool),
+        'is_pending': (flag_filter('is_pending'), parse_bool),
+        'is_confirmed': (flag_filter('is_confirmed'), parse_bool),
+        'is_out_for_delivery': (flag_filter('is_out_for_delivery'), parse_bool),
+        'is_delivered': (flag_filter('is_delivered'), parse_bool),
+        'is_completed': (flag_filter('is_completed'), parse_bool),
+        'is_cancelled': (flag_filter('is_cancelled'), parse_bool),
+        'is_failed': (flag_filter('is_failed'), parse_bool),
+        'payment_method': ('payment_method', parse_str),
+    }
+    sparse_prefetches = ORDER_ITEM_PREFETCHES
+
+
+class OrderDetailView(SparseQuerysetMixin, generics.RetrieveAPIView):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     authentication_classes = []
     permission_classes = [AllowAny]
+    sparse_prefetches = ORDER_ITEM_PREFETCHES
 
 class BookingCreateView(generics.CreateAPIView):
     queryset = Booking.objects.all()
     serializer_class = BookingSerializer
 
 
-class BookingListView(generics.ListAPIView):
+class BookingListView(SparseQuerysetMixin, QueryParamFilterMixin, generics.ListAPIView):
     queryset = Booking.objects.all()
     serializer_class = BookingSerializer
+    pagination_class = CreatedAtCursorPagination
+    filter_params = {
+        'status': ('status', parse_str),
+        'services': ('services_id', int),
+        'booking_date_from': ('booking_date__gte', parse_date),
+        'booking_date_to': ('booking_date__lte', parse_date),
+    }
 
 
 class BookingDetailView(generics.RetrieveAPIView):
@@ -132,39 +289,107 @@ class BookingDetailView(generics.RetrieveAPIView):
 
 #calculating total price for order
 
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+@parser_classes([MultiPartParser])
+def import_products(request):
+    """ Bulk create/update products from an uploaded CSV or JSONL file (same layout as export_products) """
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({"error": "Upload a CSV or JSONL file as 'file'"}, status=status.HTTP_400_BAD_REQUEST)
+
+    file_format = request.data.get('format') or detect_format(upload.name)
+    if file_format not in ('csv', 'jsonl'):
+        return Response({"error": "Unsupported file type; use .csv or .jsonl"}, status=status.HTTP_400_BAD_REQUEST)
+
+    dry_run = str(request.data.get('dry_run', '')).lower() in ('true', '1', 'yes')
+    stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    try:
+        summary = ProductImporter().run(read_rows(stream, file_format), dry_run=dry_run)
+    except UnicodeDecodeError:
+        return Response({"error": "File must be UTF-8 encoded"}, status=status.HTTP_400_BAD_REQUEST)
+
+    logger.info(f"Product import by {request.user}: {summary['created']} created, {summary['updated']} updated")
+    return Response(summary)
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def adjust_product_stock(request):
+    """
+    Apply many stock changes at once: {"adjustments": [{"product_id": 1, "delta": -2}, ...]}.
+    Nothing is applied if any product is unknown or would go negative, unless "partial" is true.
+    """
+    try:
+        deltas = parse_adjustments(request.data.get('adjustments'))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    partial = str(request.data.get('partial', '')).lower() in ('true', '1', 'yes')
+    try:
+        result = adjust_stock(deltas, partial=partial)
+    except StockConflict as e:
+        return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+
+    if result['rejected'] and not result['applied']:
+        return Response(result, status=status.HTTP_409_CONFLICT)
+    return Response(result)
+
+def parse_order_lines(items_data):
+    """ Order payload items -> [(product_id, quantity), ...] """
+    lines = []
+    for item in items_data:
+        try:
+            product_id, quantity = int(item.get('product_id')), int(item.get('quantity', 1))
+        except (TypeError, ValueError):
+            raise ValueError("Each item needs a numeric product_id and quantity")
+        if quantity < 1:
+            raise ValueError("Quantity must be at least 1")
+        lines.append((product_id, quantity))
+    return lines
+
 @api_view(['POST'])
 @authentication_classes([])
 @permission_classes([AllowAny])
+@idempotent('create_order')
 def create_order(request):
     try:
         items_data = request.data.get('items', [])
         if not items_data:
             return Response({"error": "No items provided"}, status=status.HTTP_400_BAD_REQUEST)
 
-        with transaction.atomic():
-            total_order_price = 0
-            order_items_to_create = []
-            
-            for item in items_data:
-                product_id = item.get('product_id')
-                quantity = int(item.get('quantity', 1))
-
-                product = Product.objects.select_for_update().get(id=product_id)
-                if not product.has_stock(quantity):
-                    raise ValueError(f"Not enough stock for {product.name}")
-
-                # Note: Stock deduction moved to mpesa_callback / successful payment handler
-                
-                price_at_order = product.price
-                total_order_price += price_at_order * quantity
-                
-                order_items_to_create.append({
-                    'product': product,
-                    'quantity': quantity,
-                    'price_at_order': price_at_order
-                })
+        lines = parse_order_lines(items_data)
+        payment_method = request.data.get('payment_method', 'M-Pesa')
 
-            payment_method = request.data.get('payment_method', 'M-Pesa')
+        with transaction.atomic():
+            # Lock every ordered product with one query, always in id order, so two
+            # orders for overlapping products cannot deadlock each other
+            products = {
+                product.id: product
+                for product in Product.objects.select_for_update().filter(id__in=[product_id for product_id, _ in lines]).order_by('id')
+            }
+            if len(products) != len({product_id for product_id, _ in lines}):
+                raise Product.DoesNotExist
+
+            demand = defaultdict(int)
+            for product_id, quantity in lines:
+                demand[product_id] += quantity
+            # Stock held by other unpaid orders is not available
+            holds = active_holds(list(products))
+            for product_id, quantity in demand.items():
+                if not products[product_id].has_stock(quantity + holds.get(product_id, 0)):
+                    raise ValueError(f"Not enough stock for {products[product_id].name}")
+
+            # Winning offer for every ordered product, resolved in one query
+            discounts = resolve_discounts(list(products))
+            order_items = [
+                OrderItem(
+                    product=products[product_id],
+                    quantity=quantity,
+                    price_at_order=products[product_id].price_with_discount(discounts.get(product_id)),
+                )
+                for product_id, quantity in lines
+            ]
+            total_order_price = sum(item.price_at_order * item.quantity for item in order_items)
 
             order = Order.objects.create(
                 total_price=total_order_price,
@@ -179,28 +404,26 @@ def create_order(request):
                 street_address=request.data.get('street_address'),
                 payment_method=payment_method
             )
-            
-            for item_data in order_items_to_create:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item_data['product'],
-                    quantity=item_data['quantity'],
-                    price_at_order=item_data['price_at_order']
-                )
-                
-                # If it's Payment on Delivery, deduct stock immediately 
-                # because there won't be an automated M-Pesa webhook to do it later.
-                if payment_method == 'Delivery':
-                    item_data['product'].reduce_stock(item_data['quantity'])
+            for item in order_items:
+                item.order = order
+            OrderItem.objects.bulk_create(order_items)
+
+            # If it's Payment on Delivery, deduct stock immediately (one set-based UPDATE)
+            # because there won't be an automated M-Pesa webhook to do it later.
+            if payment_method == 'Delivery':
+                deltas = {product_id: -quantity for product_id, quantity in demand.items()}
+                if apply_stock_deltas(deltas) != len(deltas):
+                    raise ValueError("Not enough stock for one or more products")
+                invalidate_catalog()
+            else:
+                # Held until the payment callback converts it, or it expires
+                reserve_stock(order, demand)
 
-        # Send Email Receipt ONLY if Delivery. M-Pesa receipts are sent in the callback webhook.
-        try:
+            # Queue Email Receipt ONLY if Delivery. M-Pesa receipts are sent in the callback webhook.
             if order.email and payment_method == 'Delivery':
                 subject = f"Order #{order.id} Confirmation (Payment on Delivery)"
                 email_body = f"Hello {order.full_name},<br><br>We have received your order <b>#{order.id}</b> for a total of <b>KES {total_order_price}</b>. Since you selected Payment on Delivery, payment will be collected upon arrival at your location.<br><br>Thank you for shopping with Vinny KJ!"
                 send_receipt_email(order.email, subject, email_body)
-        except Exception as e:
-            logger.error(f"Failed to send Email Receipt for Delivery order {order.id}: {e}")
 
         return Response({
             "message": "Order created successfully",
@@ -218,6 +441,7 @@ def create_order(request):
 @api_view(['POST'])
 @authentication_classes([])
 @permission_classes([AllowAny])
+@transaction.atomic
 def create_booking(request):
     try:
         services_id = request.data.get('services')
@@ -243,15 +467,17 @@ def create_booking(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Logic for avoid booking twice
-        existing_booking = Booking.objects.filter(
-            services=services,
-            booking_date=booking_date,
-            booking_time=booking_time,
-            status__in=['pending', 'confirmed']
-        ).exists()
-
-        if existing_booking:
+        if booking_time_str not in AVAILABLE_TIME_SLOTS:
+            return Response(
+                {"error": f"Bookings start at one of {', '.join(AVAILABLE_TIME_SLOTS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not fits(services, None, booking_time_str):
+            return Response(
+                {"error": f"{services.name} takes {services.duration_minutes} minutes and would run past closing time"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not slot_is_free(services, booking_date, booking_time_str):
             return Response(
                 {"error": "This time slot is already booked."},
                 status=status.HTTP_400_BAD_REQUEST
@@ -259,18 +485,28 @@ def create_booking(request):
 
         total_price = services.price
 
-        booking = Booking.objects.create(
-            services=services,
-            total_price=total_price,
-            booking_date=booking_date,
-            booking_time=booking_time,
-            full_name=request.data.get('full_name'),
-            email=request.data.get('email'),
-            phone_number=request.data.get('phone_number'),
-            vehicle_model=request.data.get('vehicle_model'),
-            number_plate=request.data.get('number_plate'),
-            additional_notes=request.data.get('additional_notes')
-        )
+        # The booking's slot claims are inserted with it (see sync_slot_claim); the unique
+        # constraint rejects a second claim on a unit, so concurrent requests cannot overbook
+        try:
+            with transaction.atomic():
+                booking = Booking.objects.create(
+                    services=services,
+                    total_price=total_price,
+                    booking_date=booking_date,
+                    booking_time=booking_time,
+                    duration_minutes=services.duration_minutes,
+                    full_name=request.data.get('full_name'),
+                    email=request.data.get('email'),
+                    phone_number=request.data.get('phone_number'),
+                    vehicle_model=request.data.get('vehicle_model'),
+                    number_plate=request.data.get('number_plate'),
+                    additional_notes=request.data.get('additional_notes')
+                )
+        except IntegrityError:
+            return Response(
+                {"error": "This time slot is already booked."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
         # Send Email Receipt (wrapped to prevent booking failure on Email error)
         try:
@@ -284,7 +520,7 @@ def create_booking(request):
                 if not success:
                     logger.error(f"send_receipt_email returned False for booking {booking.id}")
                 else:
-                    logger.info(f"Booking confirmation email sent for booking {booking.id}")
+                    logger.info(f"Booking confirmation email queued for booking {booking.id}")
         except Exception as e:
             logger.error(f"Failed to send Email Receipt for booking {booking.id}: {e}")
 
@@ -320,29 +556,31 @@ def cancel_order(request, order_id):
             if order.is_cancelled:
                 return Response({"message": "Order already cancelled"}, status=status.HTTP_400_BAD_REQUEST)
 
-            for item in order.items.all():
-                item.product.restore_stock(item.quantity)
+            transition(order, Order.STATUS_CANCELLED, request.data.get('note', ''), request.user)
 
-            order.is_cancelled = True
-            order.is_pending = False
-            order.is_completed = False
-            order.is_restored = True
-            order.save()
+            # Stock was only deducted for cash-on-delivery and paid orders; the rest just held it
+            if order.payment_method == 'Delivery' or order.is_paid:
+                for item in order.items.all():
+                    item.product.restore_stock(item.quantity)
+            release_reservations(order)
 
         return Response({
             "message": "Order cancelled and stock restored",
             "order_id": order.id
         }, status=status.HTTP_200_OK)
 
+    except InvalidTransition as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Order.DoesNotExist:
         return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
 
 
 @api_view(['POST'])
 @permission_classes([IsAdminUser])
+@transaction.atomic
 def mark_order_delivered(request, order_id):
     try:
-        order = Order.objects.get(id=order_id)
+        order = Order.objects.select_for_update().get(id=order_id)
 
         if order.is_cancelled:
             return Response({"error": "Cannot deliver a cancelled order"}, status=status.HTTP_400_BAD_REQUEST)
@@ -350,14 +588,8 @@ def mark_order_delivered(request, order_id):
         if order.is_delivered:
             return Response({"error": "Order already marked as delivered"}, status=status.HTTP_400_BAD_REQUEST)
 
-        order.is_delivered = True
-        order.is_completed = True
-        order.is_pending = False
-        order.is_out_for_delivery = False
-        
         # When an admin marks an order as delivered, we assume payment was collected (for COD)
-        order.is_paid = True
-        order.save()
+        transition(order, Order.STATUS_DELIVERED, request.data.get('note', ''), request.user)
 
         # Send delivery confirmation email
         try:
@@ -374,26 +606,79 @@ def mark_order_delivered(request, order_id):
                     f"<b>Vinny KJ Auto Services</b>"
                 )
                 send_receipt_email(order.email, subject, email_body)
-                logger.info(f"Delivery email sent for order {order.id} to {order.email}")
+                logger.info(f"Delivery email queued for order {order.id} to {order.email}")
         except Exception as e:
             logger.error(f"Failed to send delivery email for order {order.id}: {e}")
 
         return Response({"message": "Order marked as delivered", "is_delivered": True})
 
+    except InvalidTransition as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Order.DoesNotExist:
         return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def order_suggested_parts(request, order_id):
+    """ Available parts that fit the vehicle on an order, excluding what was already ordered """
+    order = get_object_or_404(Order, id=order_id)
+    if not order.vehicle_make and not order.vehicle_model:
+        return Response([])
+
+    products = products_fitting(
+        products_with_prices(), order.vehicle_make, order.vehicle_model, parse_year(order.vehicle_year)
+    ).filter(
+        is_available=True, is_active=True
+    ).exclude(
+        pk__in=order.items.values('product_id')
+    ).order_by('name')[:20]
+
+    return Response(ProductSerializer(products, many=True).data)
+
 @api_view(['POST'])
 @permission_classes([IsAdminUser])
+@transaction.atomic
 def confirm_order(request, order_id):
     try:
-        order = Order.objects.get(id=order_id)
+        order = Order.objects.select_for_update().get(id=order_id)
         if order.is_cancelled:
             return Response({"error": "Cannot confirm a cancelled order"}, status=status.HTTP_400_BAD_REQUEST)
         
-        order.is_confirmed = True
-        order.save()
+        if not order.is_confirmed:
+            transition(order, Order.STATUS_CONFIRMED, request.data.get('note', ''), request.user)
         return Response({"message": "Order confirmed", "is_confirmed": True})
+    except InvalidTransition as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Order.DoesNotExist:
+        return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
+
+# Statuses an admin can set directly; cancelling and delivering go through their own
+# endpoints, which also restore stock and notify the customer
+MANUAL_ORDER_STATUSES = {Order.STATUS_CONFIRMED, Order.STATUS_OUT_FOR_DELIVERY}
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAdminUser])
+@transaction.atomic
+def manage_order_status(request, order_id):
+    try:
+        order = Order.objects.select_for_update().get(id=order_id)
+        if request.method == 'POST':
+            to_status = request.data.get('status')
+            if to_status not in MANUAL_ORDER_STATUSES:
+                return Response(
+                    {"error": f"status must be one of: {', '.join(sorted(MANUAL_ORDER_STATUSES))}"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            transition(order, to_status, request.data.get('note', ''), request.user)
+
+        history = order.status_history.select_related('changed_by').order_by('changed_at', 'id')
+        return Response({
+            "order_id": order.id,
+            "status": order.status,
+            "history": OrderStatusHistorySerializer(history, many=True).data,
+        })
+    except InvalidTransition as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Order.DoesNotExist:
         return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
 
@@ -405,13 +690,13 @@ def cancel_booking(request, booking_id):
         with transaction.atomic():
             booking = Booking.objects.select_for_update().get(id=booking_id)
 
-            if booking.is_cancelled:
+            if booking.status == 'cancelled':
                 return Response(
                     {"message": "Booking already cancelled"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            if booking.is_completed:
+            if booking.status == 'completed':
                 return Response(
                     {"message": "Completed bookings cannot be cancelled"},
                     status=status.HTTP_400_BAD_REQUEST
@@ -440,9 +725,8 @@ def cancel_booking(request, booking_id):
                     status=status.HTTP_400_BAD_REQUEST
                 )    
 
-            booking.is_cancelled = True
-            booking.is_pending = False
-            booking.is_confirmed = False
+            # Saving releases the booking's slot claim
+            booking.status = 'cancelled'
             booking.save()
 
         return Response({
@@ -459,6 +743,7 @@ def cancel_booking(request, booking_id):
 
 @api_view(['POST'])
 @permission_classes([IsAdminUser])
+@transaction.atomic
 def confirm_booking(request, booking_id):
     booking = Booking.objects.get(id=booking_id)
 
@@ -496,7 +781,7 @@ def confirm_booking(request, booking_id):
                 f"<b>Vinny KJ Auto Services</b>"
             )
             send_receipt_email(booking.email, subject, email_body)
-            logger.info(f"Booking confirmation email sent for booking {booking.id} to {booking.email}")
+            logger.info(f"Booking confirmation email queued for booking {booking.id} to {booking.email}")
     except Exception as e:
         logger.error(f"Failed to send confirmation email for booking {booking.id}: {e}")
 
@@ -505,6 +790,7 @@ def confirm_booking(request, booking_id):
 
 @api_view(['POST'])
 @permission_classes([IsAdminUser])
+@transaction.atomic
 def complete_booking(request, booking_id):
     booking = Booking.objects.get(id=booking_id)
 
@@ -533,98 +819,93 @@ def complete_booking(request, booking_id):
                 f"<b>Vinny KJ Auto Services</b>"
             )
             send_receipt_email(booking.email, subject, email_body)
-            logger.info(f"Booking completion email sent for booking {booking.id} to {booking.email}")
+            logger.info(f"Booking completion email queued for booking {booking.id} to {booking.email}")
     except Exception as e:
         logger.error(f"Failed to send completion email for booking {booking.id}: {e}")
 
     return Response({"message": "Booking completed", "status": "completed"})
 
 
+def with_report_range(view):
+    """ Call the report view with the (start, end) of ?start=&end=, or answer 400 for a bad range """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            start, end = report_range(request.query_params)
+        except ValueError:
+            return Response({"error": "Pass start=YYYY-MM-DD and/or end=YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        return view(request, start, end, *args, **kwargs)
+    return wrapper
+
+
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
-def bookings_summary(request):
-    total = Booking.objects.count()
-    pending = Booking.objects.filter(status='pending').count()
-    confirmed = Booking.objects.filter(status='confirmed').count()
-    completed = Booking.objects.filter(status='completed').count()
-    cancelled = Booking.objects.filter(status='cancelled').count()
+@with_report_range
+def bookings_summary(request, start, end):
+    """ Bookings created from ?start= to ?end= (both optional) by status, from the daily stats """
+    counts = {name: count for name, (count, _) in bookings_by_status(start, end).items()}
 
     return Response({
-        "total_bookings": total,
-        "pending": pending,
-        "confirmed": confirmed,
-        "completed": completed,
-        "cancelled": cancelled
+        "total_bookings": sum(counts.values()),
+        "pending": counts.get('pending', 0),
+        "confirmed": counts.get('confirmed', 0),
+        "completed": counts.get('completed', 0),
+        "cancelled": counts.get('cancelled', 0)
     })
 
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
-def booking_revenue(request):
-    revenue = Booking.objects.filter(
-        status='completed'
-    ).aggregate(
-        total_revenue=Sum('total_price')
-    )
+@with_report_range
+def booking_revenue(request, start, end):
+    """ Revenue of completed bookings created from ?start= to ?end= """
+    revenue = bookings_by_status(start, end).get('completed', (0, 0))[1]
 
     return Response({
-        "completed_booking_revenue": revenue['total_revenue'] or 0
+        "completed_booking_revenue": revenue
     })
 
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
-def daily_bookings(request):
-    daily = Booking.objects.annotate(
-        day=TruncDay('created_at')
-    ).values('day').annotate(
-        count=Count('id')
-    ).order_by('day')
-
-    return Response(daily)
+@with_report_range
+def daily_bookings(request, start, end):
+    """ Bookings created per day from ?start= to ?end= """
+    return Response(bookings_per('day', start, end))
 
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
-def monthly_bookings(request):
-    monthly = Booking.objects.annotate(
-        month=TruncMonth('created_at')
-    ).values('month').annotate(
-        count=Count('id')
-    ).order_by('month')
-
-    return Response(monthly)
+@with_report_range
+def monthly_bookings(request, start, end):
+    """ Bookings created per month from ?start= to ?end= """
+    return Response(bookings_per('month', start, end))
 
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
-def weekly_bookings(request):
-    weekly = Booking.objects.annotate(
-        week=TruncWeek('created_at')
-    ).values('week').annotate(
-        count=Count('id')
-    ).order_by('week')
-
-    return Response(weekly)
+@with_report_range
+def weekly_bookings(request, start, end):
+    """ Bookings created per week (starting Monday) from ?start= to ?end= """
+    return Response(bookings_per('week', start, end))
 
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
 def admin_dashboard_stats(request):
     # Total Revenue = Paid Orders + Completed Bookings
-    order_revenue = Order.objects.filter(is_paid=True).aggregate(total=Sum('total_price'))['total'] or 0
-    booking_revenue = Booking.objects.filter(status='completed').aggregate(total=Sum('total_price'))['total'] or 0
+    orders = orders_by_paid()
+    by_status = bookings_by_status()
+    order_revenue = orders.get(True, (0, 0))[1]
+    booking_revenue = by_status.get('completed', (0, 0))[1]
     total_revenue = order_revenue + booking_revenue
     
-    total_orders = Order.objects.count()
-    pending_bookings = Booking.objects.filter(status='pending').count()
+    total_orders = sum(count for count, _ in orders.values())
+    pending_bookings = by_status.get('pending', (0, 0))[0]
     low_stock_count = Product.objects.filter(stock_quantity__lt=5).count()
     
-    # Booking status distribution
-    booking_stats = Booking.objects.values('status').annotate(count=Count('id'))
-    
     # Revenue Trends (Last 7 Days) - Combining Orders and Bookings
     today = timezone.now().date()
     seven_days_ago = today - timedelta(days=6)
     
     # Daily Paid Orders
     order_trends = Order.objects.filter(
-        is_paid=True, 
+        paid_at__isnull=False, 
         created_at__date__gte=seven_days_ago
     ).annotate(
         day=TruncDay('created_at')
@@ -667,58 +948,39 @@ def admin_dashboard_stats(request):
         "total_orders": total_orders,
         "pending_bookings": pending_bookings,
         "low_stock_count": low_stock_count,
-        "booking_status_distribution": {s['status']: s['count'] for s in booking_stats},
+        "booking_status_distribution": {name: count for name, (count, _) in by_status.items()},
         "revenue_trends": {
             "labels": labels,
             "data": revenue_data
         }
     })
 
-AVAILABLE_TIME_SLOTS = [
-    "09:00",
-    "10:00",
-    "11:00",
-    "12:00",
-    "14:00",
-    "15:00",
-    "16:00",
-    "17:00",
-    "18:00",
-    "19:00",
-    "20:00",
-]
-#get available slots
-
-
 @api_view(['GET'])
-def get_available_slots(request):
-    service_id = request.GET.get('service_id')
-    booking_date = request.GET.get('booking_date')
-
-    service = Services.objects.get(id=service_id)
-
-    booked_slots = Booking.objects.filter(
-        services=service,
-        booking_date=booking_date,
-        status__in=['pending', 'confirmed']
-    ).values_list('booking_time', flat=True)
-
-    booked_slots = [time.strftime("%H:%M") for time in booked_slots]
-
-    available_slots = [
-        slot for slot in AVAILABLE_TIME_SLOTS
-        if slot not in booked_slots
-    ]
-
-    return Response({
-        "date": booking_date,
-        "available_slots": available_slots
-    })
+@authentication_classes([])
+@permission_classes([AllowAny])
+def booking_availability(request):
+    """
+    Free slots for a service over a range of days, for the booking form:
+    ?service=<id>&start=YYYY-MM-DD (default today)&days=N (default 7) or &end=YYYY-MM-DD.
+    Each day is a string with one character per start time in `slots`: '1' if a booking
+    can start then (a unit is free for the service's whole duration), '0' if not.
+    """
+    try:
+        service_id = int(request.query_params.get('service') or request.query_params.get('service_id'))
+        start = parse_date(request.query_params['start']) if request.query_params.get('start') else timezone.localdate()
+        if request.query_params.get('end'):
+            end = parse_date(request.query_params['end'])
+        else:
+            end = start + timedelta(days=int(request.query_params.get('days', 7)) - 1)
+    except (TypeError, ValueError):
+        return Response({"error": "Pass service=<id>, start=YYYY-MM-DD and days=N or end=YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
 
-    return Response({
-        "date": booking_date,
-        "available_slots": available_slots
-    })
+    if end < start or (end - start).days >= MAX_RANGE_DAYS:
+        return Response({"error": f"The range must cover 1 to {MAX_RANGE_DAYS} days"}, status=status.HTTP_400_BAD_REQUEST)
+    service = Services.objects.filter(id=service_id).first()
+    if service is None:
+        return Response({"error": "Service not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response(availability_grid(service, start, end))
 
 # Cart Views
 
@@ -728,12 +990,17 @@ class CartCreateView(generics.CreateAPIView):
     authentication_classes = []
     permission_classes = [AllowAny]
 
-class CartDetailView(generics.RetrieveAPIView):
+class CartDetailView(SparseQuerysetMixin, generics.RetrieveAPIView):
     queryset = Cart.objects.all()
     serializer_class = CartSerializer
     lookup_field = 'id'
     authentication_classes = []
     permission_classes = [AllowAny]
+    sparse_prefetches = {
+        # Sub-totals read the product price even when the product is collapsed
+        'items': lambda: Prefetch('items__product', queryset=products_with_prices(images=False)),
+        'items.product.images': 'items__product__images',
+    }
 
 @api_view(['POST'])
 @authentication_classes([])
@@ -782,12 +1049,25 @@ class UpdateCartItemView(generics.RetrieveUpdateDestroyAPIView):
 
 # Payment Views
 # Payment Views
+
+# An STK prompt stays on the customer's phone for about a minute; a retry within that
+# window gets the push already sent instead of a second one
+STK_PUSH_REUSE_WINDOW = timedelta(seconds=60)
+
 @api_view(['POST'])
 @authentication_classes([])
 @permission_classes([AllowAny])
+@idempotent('initiate_mpesa_payment')
 def initiate_mpesa_payment(request, order_id):
     order = get_object_or_404(Order, id=order_id)
     phone_number = request.data.get('phone_number')
+
+    if order.is_paid:
+        return Response({"error": "Order is already paid"}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Its stock was deducted when it was placed; holding and converting it again would deduct it twice
+    if order.payment_method == 'Delivery':
+        return Response({"error": "Order is paid on delivery"}, status=status.HTTP_400_BAD_REQUEST)
     
     if not phone_number:
         return Response({"error": "Phone number is required"}, status=status.HTTP_400_BAD_REQUEST)
@@ -801,140 +1081,127 @@ def initiate_mpesa_payment(request, order_id):
     elif not phone_number.startswith('254') or len(phone_number) != 12:
         return Response({"error": "Invalid phone number format. Use 07XXXXXXXX, 01XXXXXXXX, or 2547XXXXXXXX"}, status=status.HTTP_400_BAD_REQUEST)
     
-    try:
-        with transaction.atomic():
-            # Check if there's already a pending payment for this order to avoid duplicates
-            existing_pending_payment = Payment.objects.filter(order=order, status='Pending', payment_method='M-Pesa').first()
-            
-            mpesa_client = MpesaClient()
-            response = mpesa_client.stk_push(
-                phone_number=phone_number,
-                amount=order.total_price,
-                account_reference=f"ORD{order.id}",
-                transaction_desc=f"Payment for Order {order.id}"
-            )
-
-            if response and response.get('ResponseCode') == '0':
-                checkout_request_id = response.get('CheckoutRequestID')
-                
-                # If we have an existing pending payment, we update it or keep it as is. 
-                # Better to create a new one to track separate attempts, or update if we want to keep it simple.
-                # Production usually creates a new record for each attempt.
-                Payment.objects.create(
-                    order=order,
-                    transaction_id=checkout_request_id,
-                    payment_method='M-Pesa',
-                    amount=order.total_price,
-                    phone_number=phone_number,
-                    status='Pending'
-                )
-                
-                return Response({
-                    "message": "STK Push initiated successfully",
-                    "checkout_request_id": checkout_request_id,
-                    "customer_message": response.get('CustomerMessage')
-                })
-            else:
-                error_msg = response.get('errorMessage', 'Failed to initiate STK Push') if response else 'No response from Daraja'
-                return Response({"error": error_msg, "details": response}, status=status.HTTP_400_BAD_REQUEST)
+    # Check if there's already a pending payment for this order to avoid duplicates
+    now = timezone.now()
+    recent = Payment.objects.filter(order=order, payment_method='M-Pesa', phone_number=phone_number)
+    existing_pending_payment = recent.filter(
+        status='Pending', created_at__gte=now - STK_PUSH_REUSE_WINDOW,
+    ).order_by('-created_at').first()
+    if existing_pending_payment:
+        return Response({
+            "message": "STK Push already sent",
+            "checkout_request_id": existing_pending_payment.transaction_id,
+            "customer_message": "Check your phone for the M-Pesa prompt",
+        })
+    if recent.filter(status='Initiating', created_at__gte=now - INITIATE_TIMEOUT).exists():
+        response = Response({"error": "An STK Push for this order is already being sent"}, status=status.HTTP_409_CONFLICT)
+        response['Retry-After'] = '1'
+        return response
+
+    # A failed payment released the order's holds; a new attempt needs them back, or
+    # the payment could be for stock sold to someone else meanwhile
+    shortages = hold_order_stock(order)
+    if shortages:
+        return Response({"error": f"Not enough stock for {', '.join(shortages)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Phase 1: record the attempt in its own short write. Daraja is called outside any
+    # transaction, so a slow push never holds the database lock; an attempt left
+    # 'Initiating' by a crash is recovered by reconcile_mpesa.
+    attempt = Payment.objects.create(
+        order=order,
+        payment_method='M-Pesa',
+        amount=order.total_price,
+        phone_number=phone_number,
+        status='Initiating',
+    )
 
+    # Phase 2: the STK push (and OAuth fetch, if due)
+    try:
+        response = mpesa_client.stk_push(
+            phone_number=phone_number,
+            amount=order.total_price,
+            account_reference=f"ORD{order.id}",
+            transaction_desc=f"Payment for Order {order.id}"
+        )
     except Exception as e:
+        Payment.objects.filter(id=attempt.id, status='Initiating').update(status='Failed', updated_at=timezone.now())
         logger.error(f"Unexpected error in initiate_mpesa_payment: {e}")
         return Response({"error": f"Internal Server Error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    # Phase 3: one short write with the outcome. Each attempt keeps its own record.
+    if response and response.get('ResponseCode') == '0':
+        checkout_request_id = response.get('CheckoutRequestID')
+        Payment.objects.filter(id=attempt.id, status='Initiating').update(
+            transaction_id=checkout_request_id, status='Pending', updated_at=timezone.now(),
+        )
+        return Response({
+            "message": "STK Push initiated successfully",
+            "checkout_request_id": checkout_request_id,
+            "customer_message": response.get('CustomerMessage')
+        })
+
+    Payment.objects.filter(id=attempt.id, status='Initiating').update(
+        status='Failed', raw_callback_data=response, updated_at=timezone.now(),
+    )
+    if not response or str(response.get('errorCode', '')).startswith('5'):
+        # Daraja unreachable (timeout, open circuit) or failing on its side: worth retrying
+        error_msg = response.get('errorMessage', 'M-Pesa is unavailable') if response else 'No response from Daraja'
+        return Response({"error": error_msg, "details": response}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        headers={'Retry-After': '5'})
+    error_msg = response.get('errorMessage', 'Failed to initiate STK Push')
+    return Response({"error": error_msg, "details": response}, status=status.HTTP_400_BAD_REQUEST)
+
+@require_GET
+async def order_payment_status(request, order_id):
+    """
+    Long-poll for checkout: responds as soon as the order's status moves away from
+    ?since=<status> (e.g. the M-Pesa callback marks it paid or failed), or after
+    ?wait= seconds (at most STATUS_WAIT_MAX) with the unchanged status. A plain async
+    view, so under ASGI a waiting customer does not tie up a worker.
+    """
+    since = request.GET.get('since') or None
+    if since is not None and since not in STATUS_LABELS:
+        return JsonResponse({"error": f"Unknown status '{since}'"}, status=400)
+    try:
+        wait = min(max(float(request.GET.get('wait', STATUS_WAIT_MAX)), 0), STATUS_WAIT_MAX)
+    except ValueError:
+        return JsonResponse({"error": "wait must be a number of seconds"}, status=400)
+
+    result = await wait_for_status(order_id, since, wait)
+    if result is None:
+        return JsonResponse({"error": "Order not found"}, status=404)
+    return JsonResponse(result, headers={'Cache-Control': 'no-store'})
+
 @csrf_exempt
 @api_view(['POST'])
 def mpesa_callback(request):
     """
-    M-Pesa STK Push Callback Handler
+    M-Pesa STK Push Callback Handler: stores the payload in the inbox and acknowledges
+    straight away. `manage.py process_mpesa_callbacks` applies it to the payment and order.
     """
+    data = request.data
+    logger.info(f"M-Pesa Callback Received: {json.dumps(data)}")
     try:
-        data = request.data
-        logger.info(f"M-Pesa Callback Received: {json.dumps(data)}")
-        
-        stk_callback = data.get('Body', {}).get('stkCallback', {})
-        result_code = stk_callback.get('ResultCode')
-        result_desc = stk_callback.get('ResultDesc')
-        checkout_request_id = stk_callback.get('CheckoutRequestID')
-        
-        payment = Payment.objects.filter(transaction_id=checkout_request_id).first()
-        if not payment:
-            logger.error(f"Payment with CheckoutRequestID {checkout_request_id} not found")
-            return Response({"message": "Payment not found"}, status=status.HTTP_404_NOT_FOUND)
-
-        # Save raw data for auditing
-        payment.raw_callback_data = data
-        
-        if result_code == 0:
-            logger.info(f"Payment successful: CheckoutID={checkout_request_id}, Ref={payment.order.id}")
-            payment.status = 'Completed'
-            
-            # Extract Metadata
-            items = stk_callback.get('CallbackMetadata', {}).get('Item', [])
-            for item in items:
-                name = item.get('Name')
-                value = item.get('Value')
-                if name == 'MpesaReceiptNumber':
-                    receipt_number = value
-                    print(f"M-Pesa Receipt Number: {receipt_number}")
-                    payment.mpesa_receipt_number = receipt_number
-                elif name == 'Amount':
-                    # Optional: verify amount matches
-                    pass
-            
-            payment.save()
-            
-            # Update order status and deduct stock
-            order = payment.order
-            
-            # Deduct stock ONLY when genuinely paid
-            if not order.is_paid:
-                for order_item in order.items.all():
-                    if order_item.product.has_stock(order_item.quantity):
-                        order_item.product.reduce_stock(order_item.quantity)
-                    else:
-                        logger.warning(f"Stock shortage for product {order_item.product.name} during late M-Pesa payment.")
-
-            order.is_paid = True
-            order.is_pending = False
-            order.save()
-            
-            # Send Email Receipt upon successful M-Pesa Payment
-            try:
-                if order.email:
-                    subject = f"Payment Received: Order #{order.id}"
-                    email_body = f"Hello {order.full_name},<br><br>We have successfully received your M-Pesa payment of <b>KES {payment.amount}</b> (Receipt: {payment.mpesa_receipt_number}) for Order <b>#{order.id}</b>.<br><br>Your order is now processing. Thank you for shopping with Vinny KJ!"
-                    send_receipt_email(order.email, subject, email_body)
-            except Exception as e:
-                logger.error(f"Failed to send Email Receipt for M-Pesa Order {order.id}: {e}")
-
-            return Response({"ResultCode": 0, "ResultDesc": "Success"})
-        else:
-            logger.warning(f"Payment failed: CheckoutID={checkout_request_id}, Code={result_code}, Desc={result_desc}")
-            payment.status = 'Failed'
-            payment.save()
-            
-            # Update order status to Failed
-            order = payment.order
-            order.is_failed = True
-            order.is_pending = False
-            order.save()
-            
-            return Response({"ResultCode": 0, "ResultDesc": "Failure acknowledged"})
-
+        entry, created = record_callback(data)
     except Exception as e:
         logger.error(f"CRITICAL: M-Pesa Callback Processing Error: {str(e)}")
         return Response({"ResultCode": 1, "ResultDesc": "Internal Error"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    if not created:
+        logger.info(f"Duplicate M-Pesa callback for CheckoutRequestID {entry.checkout_request_id}")
+    return Response({"ResultCode": 0, "ResultDesc": "Accepted"})
+
 @api_view(['POST'])
 @authentication_classes([])
 @permission_classes([AllowAny])
+@idempotent('initiate_stripe_payment')
 def initiate_stripe_payment(request, order_id):
     order = get_object_or_404(Order, id=order_id)
     
     intent = create_stripe_payment_intent(
         amount=order.total_price,
-        currency='kes' 
+        currency='kes',
+        idempotency_key=request.headers.get('Idempotency-Key'),
     )
 
     if intent:
@@ -959,6 +1226,7 @@ class ContactCreateView(generics.CreateAPIView):
     authentication_classes = []
     permission_classes = [AllowAny]
 
+    @transaction.atomic
     def perform_create(self, serializer):
         instance = serializer.save()
         
@@ -977,14 +1245,18 @@ class ContactCreateView(generics.CreateAPIView):
             # Send to the business email (using DEFAULT_FROM_EMAIL or a specific address)
             business_email = getattr(settings, 'EMAIL_HOST_USER', 'vinkjautoservices@gmail.com')
             send_receipt_email(business_email, subject, email_body)
-            logger.info(f"Contact inquiry email sent for message {instance.id}")
+            logger.info(f"Contact inquiry email queued for message {instance.id}")
         except Exception as e:
             logger.error(f"Failed to send contact inquiry email for message {instance.id}: {e}")
 
-class ContactListView(generics.ListAPIView):
+class ContactListView(SparseQuerysetMixin, QueryParamFilterMixin, generics.ListAPIView):
     queryset = ContactMessage.objects.all().order_by('-created_at')
     serializer_class = ContactMessageSerializer
     permission_classes = [permissions.IsAdminUser]
+    pagination_class = CreatedAtCursorPagination
+    filter_params = {
+        'is_read': ('is_read', parse_bool),
+    }
 
 class ContactDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = ContactMessage.objects.all()
@@ -0,0 +1,93 @@
+import random
+import time
+from django.db import close_old_connections
+from django.utils import timezone
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WorkQueue:
+    """
+    A table of jobs worked by polling workers: rows with `attempts`, `last_error` and
+    `next_attempt_at` columns. Claiming pushes next_attempt_at out by the lease, so
+    concurrent workers skip a row and a crashed worker's rows come back. Failures are
+    retried with exponential backoff and jitter up to `max_attempts`.
+
+    With a `pending_status`, only rows in it are claimed and rows that run out of
+    attempts move to `failed_status`; without one, such rows are deleted.
+    """
+    def __init__(self, model, max_attempts, backoff_base, backoff_max, lease,
+                 pending_status=None, failed_status=None, describe=None):
+        self.model = model
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.pending_status = pending_status
+        self.failed_status = failed_status
+        self.describe = describe or (lambda row: f"{model.__name__} {row.pk}")
+
+    def pending(self):
+        if self.pending_status is None:
+            return self.model.objects.all()
+        return self.model.objects.filter(status=self.pending_status)
+
+    def retry_delay(self, attempts):
+        delay = min(self.backoff_base * (2 ** max(attempts - 1, 0)), self.backoff_max)
+        return delay * random.uniform(0.8, 1.2)
+
+    def claim(self, batch_size, now=None):
+        """ Take up to `batch_size` due rows, leasing them so other workers skip them """
+        now = now or timezone.now()
+        lease_until = now + self.lease
+        ids = list(
+            self.pending().filter(next_attempt_at__lte=now).order_by('next_attempt_at', 'id').values_list(
+                'id', flat=True,
+            )[:batch_size]
+        )
+        if not ids:
+            return []
+        self.pending().filter(id__in=ids, next_attempt_at__lte=now).update(next_attempt_at=lease_until)
+        return list(self.model.objects.filter(id__in=ids, next_attempt_at=lease_until).order_by('id'))
+
+    def record_failure(self, row, error, now=None):
+        """ Count a failed attempt and schedule the retry, or give up on the row after the last one """
+        now = now or timezone.now()
+        row.attempts += 1
+        row.last_error = str(error)[:2000]
+        if row.attempts < self.max_attempts:
+            row.next_attempt_at = now + self.retry_delay(row.attempts)
+            logger.warning(f"{self.describe(row)} failed (attempt {row.attempts}), retrying at {row.next_attempt_at}: {error}")
+            row.save(update_fields=['attempts', 'last_error', 'next_attempt_at'])
+            return
+
+        logger.error(f"Giving up on {self.describe(row)} after {row.attempts} attempts: {error}")
+        if self.pending_status is None:
+            row.delete()
+        else:
+            row.status = self.failed_status
+            row.save(update_fields=['attempts', 'last_error', 'status'])
+
+
+def worker_runs(step, once=False, interval=5, drain=True):
+    """
+    Call `step` and yield its result until interrupted, for the worker commands. With
+    `drain`, steps run back to back while they return any work done and the worker
+    sleeps `interval` seconds only when a step found nothing; without it, it sleeps
+    after every step. `once` stops at the first idle step instead of sleeping.
+    """
+    try:
+        while True:
+            result = step()
+            yield result
+            if drain and any(result):
+                continue
+            if once:
+                return
+            time.sleep(interval)
+            # The connection may have gone stale while idle
+            close_old_connections()
+    except KeyboardInterrupt:
+        return
@@ -11,8 +11,10 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 
 # Load environment variables from .env file
 load_dotenv()
@@ -101,9 +103,42 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'data' / 'db.sqlite3',
+        'OPTIONS': {
+            # Writers take the lock when their transaction starts, so concurrent writes
+            # wait (up to `timeout` seconds) instead of failing with "database is locked"
+            # when a read transaction tries to upgrade; WAL lets reads run alongside them.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        },
+        # A file rather than shared in-memory SQLite, so concurrency tests see the same
+        # locking (WAL, busy timeout) as production
+        'TEST': {'NAME': BASE_DIR / 'data' / 'test_db.sqlite3'},
+    }
+}
+
+
+# Cache
+# File based so all gunicorn workers in the container share catalog snapshots
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_DIR', str(BASE_DIR / 'data' / 'cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
     }
 }
 
+# The test runner gets a per-process in-memory cache, so tests never touch data/cache
+if sys.argv[1:2] == ['test']:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -158,9 +193,17 @@ DARAJA_BUSINESS_SHORTCODE = os.getenv('DARAJA_BUSINESS_SHORTCODE', '')
 DARAJA_BASE_URL = os.getenv('DARAJA_BASE_URL', 'https://sandbox.safaricom.co.ke')
 DARAJA_CALLBACK_URL = os.getenv('DARAJA_CALLBACK_URL', '')
 
+# How long an unpaid M-Pesa/card order holds its stock
+STOCK_RESERVATION_MINUTES = int(os.getenv('STOCK_RESERVATION_MINUTES', 15))
+
+# How long a stored Idempotency-Key response is replayed to retries
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', 24))
+
 # STRIPE
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
+# Point at `manage.py run_provider_simulator` for load tests
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
 
 # EMAIL SETTINGS (SMTP)
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -180,4 +223,5 @@ DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'VIN-KJ Auto Services <echo
 EMAIL_TIMEOUT = 5 # Don't block requests indefinitely if email is unreachable
 # CORS
 CORS_ALLOW_ALL_ORIGINS = True # For testing, can be restricted later
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 